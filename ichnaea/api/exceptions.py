@@ -186,6 +186,14 @@ class ParseError(BaseAPIClientError):
     message = 'Parse Error'  #:
 
 
+class RequestTooLarge(BaseAPIClientError):
+
+    code = 413  #:
+    domain = 'global'  #:
+    reason = 'requestTooLarge'  #:
+    message = 'Request Entity Too Large'  #:
+
+
 class ServiceUnavailable(BaseAPIServiceError):
 
     code = 503  #:
@@ -35,6 +35,18 @@ from ichnaea.models import (
 from ichnaea import util
 
 
+def rank_cells(lookups):
+    """
+    Sort the cell lookups by their signal strength, strongest first.
+
+    Lookups without a signal strength are sorted last.
+    """
+    return sorted(lookups,
+                  key=lambda lookup: (lookup.signal is not None,
+                                      lookup.signal or 0),
+                  reverse=True)
+
+
 def pick_best_cells(cells):
     """
     Group cells by area, pick the best cell area. Either
@@ -119,8 +131,9 @@ def query_cells(query, lookups, model, raven_client):
 
     if model == CellOCID:
         # non sharded OCID table
-        return query_cell_table(query.session, model, cellids,
-                                temp_blocked, load_fields, raven_client)
+        with query.timer.phase('db', tags=['table:%s' % model.__tablename__]):
+            return query_cell_table(query.session, model, cellids,
+                                    temp_blocked, load_fields, raven_client)
 
     result = []
     shards = defaultdict(list)
@@ -128,9 +141,10 @@ def query_cells(query, lookups, model, raven_client):
         shards[CellShard.shard_model(lookup.radio)].append(lookup.cellid)
 
     for shard, shard_cellids in shards.items():
-        result.extend(
-            query_cell_table(query.session, shard, shard_cellids,
-                             temp_blocked, load_fields, raven_client))
+        with query.timer.phase('db', tags=['table:%s' % shard.__tablename__]):
+            result.extend(
+                query_cell_table(query.session, shard, shard_cellids,
+                                 temp_blocked, load_fields, raven_client))
 
     return result
 
@@ -143,11 +157,12 @@ def query_areas(query, lookups, model, raven_client):
     load_fields = ('lat', 'lon', 'radius',
                    'created', 'modified', 'num_cells')
     try:
-        areas = (query.session.query(model)
-                              .filter(model.areaid.in_(areaids))
-                              .filter(model.lat.isnot(None))
-                              .filter(model.lon.isnot(None))
-                              .options(load_only(*load_fields))).all()
+        with query.timer.phase('db', tags=['table:%s' % model.__tablename__]):
+            areas = (query.session.query(model)
+                                  .filter(model.areaid.in_(areaids))
+                                  .filter(model.lat.isnot(None))
+                                  .filter(model.lon.isnot(None))
+                                  .options(load_only(*load_fields))).all()
 
         return areas
     except Exception:
@@ -160,24 +175,64 @@ class CellPositionMixin(object):
     A CellPositionMixin implements a position search using the cell models.
     """
 
-    cell_model = CellShard
     area_model = CellArea
+    cell_model = CellShard
+    cell_query_budget = 0  #: Maximum number of cells in the first query.
+    raven_client = None
     result_type = Position
+    stats_client = None
+
+    def configure_cell(self, settings):
+        """
+        Read the cell specific settings from the source settings.
+
+        A ``cell_query_budget`` setting limits the initial database
+        lookup to the strongest cell networks in the query. A value of
+        zero disables the budget.
+        """
+        if settings:
+            self.cell_query_budget = int(
+                settings.get('cell_query_budget', 0))
 
     def should_search_cell(self, query, results):
         if not (query.cell or query.cell_area):
             return False
         return True
 
+    def _query_cells(self, query):
+        budget = self.cell_query_budget
+        if not budget or len(query.cell) <= budget:
+            return query_cells(
+                query, query.cell, self.cell_model, self.raven_client)
+
+        ranked = rank_cells(query.cell)
+        status = 'first'
+        cells = query_cells(
+            query, ranked[:budget], self.cell_model, self.raven_client)
+        if not cells:
+            # None of the strongest cells are known, widen the search
+            # to all cells in the query.
+            status = 'widened'
+            cells = query_cells(
+                query, ranked[budget:], self.cell_model, self.raven_client)
+
+        self.stats_client.incr(
+            'locate.budget',
+            tags=['source:%s' % self.source.name,
+                  'type:cell',
+                  'status:%s' % status])
+        return cells
+
     def search_cell(self, query):
         result = self.result_type()
 
         if query.cell:
-            cells = query_cells(
-                query, query.cell, self.cell_model, self.raven_client)
+            cells = self._query_cells(query)
             if cells:
-                best_cells = pick_best_cells(cells)
-                result = aggregate_cell_position(best_cells, self.result_type)
+                with query.timer.phase('cluster'):
+                    best_cells = pick_best_cells(cells)
+                    result = aggregate_cell_position(
+                        best_cells, self.result_type)
 
             if not result.empty():
                 return result
@@ -235,6 +290,10 @@ class CellPositionSource(CellPositionMixin, PositionSource):
     fallback_field = None  #:
     source = DataSource.internal
 
+    def __init__(self, settings, *args, **kw):
+        super(CellPositionSource, self).__init__(settings, *args, **kw)
+        self.configure_cell(settings)
+
     def should_search(self, query, results):
         return self.should_search_cell(query, results)
 
@@ -356,7 +356,8 @@ class FallbackPositionSource(PositionSource):
             return None
 
         try:
-            with self._stat_timed('lookup', tags=None):
+            with self._stat_timed('lookup', tags=None), \
+                    query.timer.phase('fallback'):
                 response = query.http_session.post(
                     self.url,
                     headers={'User-Agent': 'ichnaea'},
@@ -51,6 +51,11 @@ class InternalPositionSource(CellPositionMixin,
     fallback_field = None  #:
     source = DataSource.internal  #:
 
+    def __init__(self, settings, *args, **kw):
+        super(InternalPositionSource, self).__init__(settings, *args, **kw)
+        self.configure_cell(settings)
+        self.configure_wifi(settings)
+
     def should_search(self, query, results):
         if not PositionSource.should_search(
                 self, query, results):  # pragma: no cover
@@ -119,6 +119,12 @@ class TestView(LocateV2Base, CommonLocateTest, CommonPositionTest):
                  'accuracy:medium', 'status:hit']),
         ], timer=[
             ('request', [self.metric_path, 'method:post']),
+        ], histogram=[
+            (self.metric_type + '.timing', [self.metric_path, 'phase:decode']),
+            (self.metric_type + '.timing', [self.metric_path, 'phase:geoip']),
+            (self.metric_type + '.timing',
+                [self.metric_path, 'phase:db',
+                 'table:%s' % cell.__tablename__]),
         ])
 
     def test_partial_cell(self):
@@ -12,6 +12,7 @@ from ichnaea.api.locate.schema import (
     FallbackLookup,
     WifiLookup,
 )
+from ichnaea.api.timing import PhaseTimer
 
 try:
     from collections import OrderedDict
@@ -36,10 +37,12 @@ class Query(object):
     _geoip = None
     _ip = None
     _region = None
+    result_source = None  #: The data source of the final result, if any.
 
     def __init__(self, fallback=None, ip=None, cell=None, wifi=None,
                  api_key=None, api_type=None, session=None,
-                 http_session=None, geoip_db=None, stats_client=None):
+                 http_session=None, geoip_db=None, stats_client=None,
+                 timer=None):
         """
         A class representing a concrete query.
 
@@ -70,11 +73,17 @@ class Query(object):
 
         :param stats_client: A stats client.
         :type stats_client: :class:`~ichnaea.log.StatsClient`
+
+        :param timer: A phase timer for the current request.
+        :type timer: :class:`~ichnaea.api.timing.PhaseTimer`
         """
         self.geoip_db = geoip_db
         self.http_session = http_session
         self.session = session
         self.stats_client = stats_client
+        if timer is None:
+            timer = PhaseTimer()
+        self.timer = timer
 
         self.fallback = fallback
         self.ip = ip
@@ -129,7 +138,8 @@ class Query(object):
             region = None
             geoip = None
             if self.geoip_db:
-                geoip = self.geoip_db.lookup(valid)
+                with self.timer.phase('geoip'):
+                    geoip = self.geoip_db.lookup(valid)
                 if geoip:
                     region = geoip.get('region_code')
             self._geoip = geoip
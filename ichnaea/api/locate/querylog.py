@@ -0,0 +1,193 @@
+"""
+A sampled log of locate queries, used to replay realistic production
+traffic in the locate benchmark.
+
+The logged queries contain the identifiers of the observed cells and
+WiFi networks, which are needed to replay them, so the log files have
+to be treated as personal data.
+"""
+
+from collections import deque
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import os.path
+from random import random
+
+from gevent.threadpool import ThreadPool
+import simplejson
+
+
+def _compact(values):
+    return dict((key, value) for key, value in values.items()
+                if value is not None)
+
+
+def query_log_record(query, path, max_networks=20):
+    """
+    Return a record of the query.
+
+    The record contains the number of validated networks of each type,
+    the summed up timing phases, the source of the result and the
+    query itself in the geolocate request format, including the cell
+    ids and WiFi MAC addresses. It doesn't contain the IP address,
+    API key, WiFi network names or timestamps of the query. At most
+    `max_networks` networks of each type are kept.
+    """
+    cells = []
+    for cell in query.cell[:max_networks]:
+        cells.append(_compact({
+            'radioType': cell.radio.name,
+            'mobileCountryCode': cell.mcc,
+            'mobileNetworkCode': cell.mnc,
+            'locationAreaCode': cell.lac,
+            'cellId': cell.cid,
+            'psc': cell.psc,
+            'signalStrength': cell.signal,
+            'timingAdvance': cell.ta,
+        }))
+
+    wifis = []
+    for wifi in query.wifi[:max_networks]:
+        wifis.append(_compact({
+            'macAddress': wifi.mac,
+            'channel': wifi.channel,
+            'signalStrength': wifi.signal,
+            'signalToNoiseRatio': wifi.snr,
+        }))
+
+    source = None
+    if query.result_source is not None:
+        source = query.result_source.name
+
+    return {
+        'path': path,
+        'networks': {
+            'area': len(query.cell_area),
+            'cell': len(query.cell),
+            'wifi': len(query.wifi),
+        },
+        'timing': query.timer.totals(),
+        'source': source,
+        'query': {
+            'cellTowers': cells,
+            'wifiAccessPoints': wifis,
+            'fallbacks': {
+                'ipf': bool(query.fallback.ipf),
+                'lacf': bool(query.fallback.lacf),
+            },
+        },
+    }
+
+
+class DisabledQueryLog(object):
+    """
+    A DisabledQueryLog implements a no-op version of the
+    :class:`~ichnaea.api.locate.querylog.QueryLog`.
+    """
+
+    max_networks = 0
+
+    def sample(self):
+        return False
+
+    def log(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+class QueryLog(object):
+    """
+    A QueryLog writes a sampled fraction of all queries into a local
+    rotating file, with one compact JSON record per line.
+
+    Records are put into a bounded in-memory queue and written by an
+    operating system thread from a gevent thread pool, so the blocking
+    file writes and rotations never block the gevent hub. If the queue
+    is full, records are dropped instead of slowing down the request.
+    """
+
+    def __init__(self, filename, sample_rate=0.0,
+                 max_bytes=10485760, backup_count=5,
+                 max_networks=20, queue_size=1000, raven_client=None):
+        self.sample_rate = sample_rate
+        self.max_networks = max_networks
+        self.queue_size = queue_size
+        self.raven_client = raven_client
+        self.handler = RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count,
+            delay=True)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.queue = deque()
+        self._pool = None
+        self._writer = None
+
+    def _write(self):
+        # runs in the thread pool and writes all queued records
+        while self.queue:
+            line = self.queue.popleft()
+            try:
+                self.handler.emit(logging.makeLogRecord({'msg': line}))
+            except Exception:  # pragma: no cover
+                if self.raven_client is not None:
+                    self.raven_client.captureException()
+
+    def sample(self):
+        """Should the current query be logged?"""
+        return random() < self.sample_rate
+
+    def log(self, record):
+        """
+        Queue the record for writing, without waiting for the write.
+
+        :param record: A query record.
+        :type record: dict
+        """
+        if len(self.queue) >= self.queue_size:  # pragma: no cover
+            return
+        self.queue.append(simplejson.dumps(record, separators=(',', ':')))
+        if self._pool is None:
+            # started lazily, inside the forked worker process
+            self._pool = ThreadPool(1)
+        if self._writer is None or self._writer.ready():
+            self._writer = self._pool.spawn(self._write)
+
+    def close(self):
+        """Write all queued records and close the file."""
+        if self._pool is not None:
+            # also writes records queued after the last write finished
+            self._pool.spawn(self._write).get()
+            self._pool.kill()
+            self._pool = None
+            self._writer = None
+        self.handler.close()
+
+
+def configure_query_log(app_config, raven_client=None):
+    """
+    Configure and return a query log, based on the `[querylog]`
+    section of the application ini file.
+    """
+    section = {}
+    if app_config is not None:
+        section = app_config.get_map('querylog', {})
+
+    filename = section.get('filename', '').strip()
+    sample_rate = float(section.get('sample_rate', 0.0))
+    if not filename or sample_rate <= 0.0:
+        return DisabledQueryLog()
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(dirname):  # pragma: no cover
+        os.makedirs(dirname)
+
+    return QueryLog(
+        filename,
+        sample_rate=sample_rate,
+        max_bytes=int(section.get('max_bytes', 10485760)),
+        backup_count=int(section.get('backup_count', 5)),
+        max_networks=int(section.get('max_networks', 20)),
+        raven_client=raven_client,
+    )
@@ -116,9 +116,11 @@ class Searcher(object):
         """
         query.emit_query_stats()
         result = self._search(query)
+        query.result_source = result.source
         query.emit_result_stats(result)
         if not result.empty():
-            return self.format_result(result)
+            with query.timer.phase('render'):
+                return self.format_result(result)
 
 
 class PositionSearcher(Searcher):
@@ -411,6 +411,14 @@ class CommonLocateTest(BaseLocateTest):
                          method='post', status=self.not_found.code)
         self.check_response(res, 'not_found')
 
+    def test_malformed_gzip(self):
+        headers = {
+            'Content-Encoding': 'gzip',
+        }
+        res = self._call(body='invalid', headers=headers,
+                         method='post', status=400)
+        self.check_response(res, 'parse_error')
+
 
 class CommonPositionTest(BaseLocateTest):
     # tests for only the locate_v1 and locate_v2 API's
@@ -129,3 +129,43 @@ class TestOCIDPositionSource(BaseSourceTest):
         query = self.model_query(cells=[cell])
         result = self.source.search(query)
         self.check_model_result(result, cell)
+
+
+class TestCellBudget(BaseSourceTest):
+
+    TestSource = CellPositionSource
+    settings = {'cell_query_budget': '1'}
+
+    def test_first_pass(self):
+        cell = CellShardFactory()
+        cell2 = CellShardFactory(radio=cell.radio, mcc=cell.mcc, mnc=cell.mnc,
+                                 lac=cell.lac, cid=cell.cid + 1,
+                                 lat=cell.lat + 0.2)
+        self.session.flush()
+
+        query = self.model_query(cells=[cell2, cell])
+        query.cell[0].signal = -90
+        query.cell[1].signal = -70
+        result = self.source.search(query)
+        self.check_model_result(result, cell)
+        self.check_stats(counter=[
+            ('locate.budget', 1, 1,
+             ['source:internal', 'type:cell', 'status:first']),
+        ])
+
+    def test_widened(self):
+        cell = CellShardFactory()
+        unknown = CellShardFactory.build(
+            radio=cell.radio, mcc=cell.mcc, mnc=cell.mnc,
+            lac=cell.lac, cid=cell.cid + 1)
+        self.session.flush()
+
+        query = self.model_query(cells=[cell, unknown])
+        query.cell[0].signal = -90
+        query.cell[1].signal = -70
+        result = self.source.search(query)
+        self.check_model_result(result, cell)
+        self.check_stats(counter=[
+            ('locate.budget', 1, 1,
+             ['source:internal', 'type:cell', 'status:widened']),
+        ])
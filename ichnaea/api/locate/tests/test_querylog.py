@@ -0,0 +1,107 @@
+import os.path
+
+import simplejson
+
+from ichnaea.api.locate.constants import DataSource
+from ichnaea.api.locate.locate_v2.schema import LOCATE_V2_SCHEMA
+from ichnaea.api.locate.query import Query
+from ichnaea.api.locate.querylog import (
+    configure_query_log,
+    DisabledQueryLog,
+    query_log_record,
+    QueryLog,
+)
+from ichnaea.config import DummyConfig
+from ichnaea.tests.base import TestCase
+from ichnaea.tests.factories import (
+    CellShardFactory,
+    WifiShardFactory,
+)
+from ichnaea import util
+
+
+class TestRecord(TestCase):
+
+    def _query(self, **kw):
+        cell = CellShardFactory.build()
+        wifis = WifiShardFactory.build_batch(3)
+        query = Query(
+            ip='127.0.0.1',
+            cell=[{'radio': cell.radio.name, 'mcc': cell.mcc,
+                   'mnc': cell.mnc, 'lac': cell.lac, 'cid': cell.cid,
+                   'signal': -70}],
+            wifi=[{'mac': wifi.mac, 'signal': -80, 'ssid': 'home'}
+                  for wifi in wifis],
+            **kw)
+        with query.timer.phase('db', tags=['table:wifi_shard_0']):
+            pass
+        with query.timer.phase('db', tags=['table:wifi_shard_1']):
+            pass
+        return query
+
+    def test_record(self):
+        query = self._query()
+        query.result_source = DataSource.internal
+        record = query_log_record(query, 'v1.geolocate')
+        self.assertEqual(record['path'], 'v1.geolocate')
+        self.assertEqual(record['networks'],
+                         {'area': 1, 'cell': 1, 'wifi': 3})
+        self.assertEqual(list(record['timing'].keys()), ['db'])
+        self.assertEqual(record['source'], 'internal')
+
+        # the record contains neither the IP address nor network names
+        text = simplejson.dumps(record)
+        self.assertFalse('127.0.0.1' in text)
+        self.assertFalse('home' in text)
+
+        # the query can be replayed
+        data = LOCATE_V2_SCHEMA.deserialize(record['query'])
+        replayed = Query(
+            fallback=data['fallbacks'], cell=data['cell'], wifi=data['wifi'])
+        self.assertEqual(replayed.cell, query.cell)
+        self.assertEqual(
+            [wifi.mac for wifi in replayed.wifi],
+            [wifi.mac for wifi in query.wifi])
+
+    def test_max_networks(self):
+        query = self._query()
+        record = query_log_record(query, 'v1.geolocate', max_networks=2)
+        self.assertEqual(record['networks']['wifi'], 3)
+        self.assertEqual(len(record['query']['wifiAccessPoints']), 2)
+        self.assertEqual(record['source'], None)
+
+
+class TestQueryLog(TestCase):
+
+    def test_configure_disabled(self):
+        self.assertTrue(isinstance(
+            configure_query_log(None), DisabledQueryLog))
+        config = DummyConfig({'querylog': {'filename': 'query.log'}})
+        self.assertTrue(isinstance(
+            configure_query_log(config), DisabledQueryLog))
+
+    def test_configure(self):
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = os.path.join(temp_dir, 'query.log')
+            config = DummyConfig({'querylog': {
+                'filename': filename, 'sample_rate': '1.0',
+                'max_networks': '5'}})
+            query_log = configure_query_log(config)
+            self.assertTrue(isinstance(query_log, QueryLog))
+            self.assertTrue(query_log.sample())
+            self.assertEqual(query_log.max_networks, 5)
+            query_log.close()
+
+    def test_log(self):
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = os.path.join(temp_dir, 'query.log')
+            query_log = QueryLog(filename, sample_rate=1.0)
+            query_log.log({'path': 'v1.geolocate', 'source': None})
+            query_log.log({'path': 'v1.search', 'source': 'internal'})
+            query_log.close()
+
+            with open(filename) as fd:
+                lines = fd.read().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(simplejson.loads(lines[1]),
+                             {'path': 'v1.search', 'source': 'internal'})
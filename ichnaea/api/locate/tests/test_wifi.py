@@ -169,3 +169,55 @@ class TestWifi(BaseSourceTest):
         query = self.model_query(wifis=[wifi, wifis[1]])
         result = self.source.search(query)
         self.check_model_result(result, None)
+
+
+class TestWifiBudget(BaseSourceTest):
+
+    TestSource = WifiPositionSource
+    settings = {'wifi_query_budget': '2'}
+
+    def test_first_pass(self):
+        wifi = WifiShardFactory()
+        wifis = WifiShardFactory.create_batch(
+            3, lat=wifi.lat, lon=wifi.lon + 0.00001)
+        self.session.flush()
+
+        query = self.model_query(wifis=[wifi] + wifis)
+        for i, entry in enumerate(query.wifi):
+            entry.signal = -60 - i
+        result = self.source.search(query)
+        self.check_model_result(
+            result, wifi, lon=wifi.lon + 0.000005)
+        self.check_stats(counter=[
+            ('locate.budget', 1, 1,
+             ['source:internal', 'type:wifi', 'status:first']),
+        ])
+
+    def test_widened(self):
+        wifi = WifiShardFactory()
+        wifis = WifiShardFactory.create_batch(
+            2, lat=wifi.lat, lon=wifi.lon + 0.00001)
+        self.session.flush()
+        unknown = WifiShardFactory.build()
+
+        # the strongest two networks don't form a cluster
+        query = self.model_query(wifis=[unknown, wifi] + wifis)
+        for i, entry in enumerate(query.wifi):
+            entry.signal = -60 - i
+        result = self.source.search(query)
+        self.check_model_result(
+            result, wifi, lon=wifi.lon + 0.0000066667)
+        self.check_stats(counter=[
+            ('locate.budget', 1, 1,
+             ['source:internal', 'type:wifi', 'status:widened']),
+        ])
+
+    def test_within_budget(self):
+        wifi = WifiShardFactory()
+        wifi2 = WifiShardFactory(lat=wifi.lat, lon=wifi.lon + 0.00001)
+        self.session.flush()
+
+        query = self.model_query(wifis=[wifi, wifi2])
+        result = self.source.search(query)
+        self.check_model_result(result, wifi, lon=wifi.lon + 0.000005)
+        self.check_stats(counter=[('locate.budget', 0)])
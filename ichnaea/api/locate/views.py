@@ -4,6 +4,7 @@ Implementation of a locate specific HTTP service view.
 
 from ichnaea.api.exceptions import LocationNotFound
 from ichnaea.api.locate.query import Query
+from ichnaea.api.locate.querylog import query_log_record
 from ichnaea.api.views import BaseAPIView
 
 
@@ -28,10 +29,19 @@ class BaseLocateView(BaseAPIView):
             http_session=self.request.registry.http_session,
             geoip_db=self.request.registry.geoip_db,
             stats_client=self.stats_client,
+            timer=self.timer,
         )
 
         searcher = getattr(self.request.registry, self.searcher)
-        return searcher.search(query)
+        result = searcher.search(query)
+
+        query_log = self.request.registry.query_log
+        if query_log.sample():
+            query_log.log(query_log_record(
+                query, self.metric_path,
+                max_networks=query_log.max_networks))
+
+        return result
 
     def prepare_response(self, response_data):  # pragma: no cover
         return response_data
@@ -53,4 +63,5 @@ class BasePositionView(BaseLocateView):
     #: Use renderer with prettier float output.
     renderer = 'floatjson'  #:
     searcher = 'position_searcher'  #:
+    timing_metrics = True  #:
     view_type = 'locate'  #:
@@ -158,8 +158,19 @@ def aggregate_cluster_position(cluster, result_type):
     return result_type(lat=lat, lon=lon, accuracy=accuracy)
 
 
-def query_wifis(query, raven_client):
-    macs = [lookup.mac for lookup in query.wifi]
+def rank_wifis(lookups):
+    """
+    Sort the wifi lookups by their signal strength, strongest first.
+
+    Lookups without a signal strength are treated as having a signal
+    of -100 dBm, the same estimate used in :func:`get_clusters`.
+    """
+    return sorted(lookups, key=lambda lookup: lookup.signal or -100,
+                  reverse=True)
+
+
+def query_wifis(query, lookups, raven_client):
+    macs = [lookup.mac for lookup in lookups]
     if not macs:  # pragma: no cover
         return []
 
@@ -177,20 +188,22 @@ def query_wifis(query, raven_client):
             shards[WifiShard.shard_model(mac)].append(mac)
 
         for shard, shard_macs in shards.items():
-            rows = (
-                query.session.query(shard)
-                             .filter(shard.mac.in_(shard_macs))
-                             .filter(shard.lat.isnot(None))
-                             .filter(shard.lon.isnot(None))
-                             .filter(or_(
-                                 shard.block_count.is_(None),
-                                 shard.block_count <
-                                     PERMANENT_BLOCKLIST_THRESHOLD))
-                             .filter(or_(
-                                 shard.block_last.is_(None),
-                                 shard.block_last < temp_blocked))
-                             .options(load_only(*load_fields))
-            ).all()
+            with query.timer.phase(
+                    'db', tags=['table:%s' % shard.__tablename__]):
+                rows = (
+                    query.session.query(shard)
+                                 .filter(shard.mac.in_(shard_macs))
+                                 .filter(shard.lat.isnot(None))
+                                 .filter(shard.lon.isnot(None))
+                                 .filter(or_(
+                                     shard.block_count.is_(None),
+                                     shard.block_count <
+                                         PERMANENT_BLOCKLIST_THRESHOLD))
+                                 .filter(or_(
+                                     shard.block_last.is_(None),
+                                     shard.block_last < temp_blocked))
+                                 .options(load_only(*load_fields))
+                ).all()
             result.extend(list(rows))
     except Exception:
         raven_client.captureException()
@@ -205,6 +218,20 @@ class WifiPositionMixin(object):
 
     raven_client = None
     result_type = Position
+    stats_client = None
+    wifi_query_budget = 0  #: Maximum number of wifis in the first query.
+
+    def configure_wifi(self, settings):
+        """
+        Read the wifi specific settings from the source settings.
+
+        A ``wifi_query_budget`` setting limits the initial database
+        lookup to the strongest wifi networks in the query. A value of
+        zero disables the budget.
+        """
+        if settings:
+            self.wifi_query_budget = int(
+                settings.get('wifi_query_budget', 0))
 
     def should_search_wifi(self, query, results):
         return bool(query.wifi)
@@ -214,11 +241,37 @@ class WifiPositionMixin(object):
         if not query.wifi:
             return result
 
-        wifis = query_wifis(query, self.raven_client)
-        clusters = get_clusters(wifis, query.wifi)
+        budget = self.wifi_query_budget
+        lookups = query.wifi
+        remaining = []
+        if budget and len(lookups) > budget:
+            ranked = rank_wifis(lookups)
+            lookups, remaining = ranked[:budget], ranked[budget:]
+
+        wifis = query_wifis(query, lookups, self.raven_client)
+        with query.timer.phase('cluster'):
+            clusters = get_clusters(wifis, query.wifi)
+        if remaining:
+            status = 'first'
+            if not clusters:
+                # The strongest networks didn't form a valid cluster,
+                # widen the search to all networks in the query.
+                status = 'widened'
+                wifis.extend(
+                    query_wifis(query, remaining, self.raven_client))
+                with query.timer.phase('cluster'):
+                    clusters = get_clusters(wifis, query.wifi)
+            self.stats_client.incr(
+                'locate.budget',
+                tags=['source:%s' % self.source.name,
+                      'type:wifi',
+                      'status:%s' % status])
+
         if clusters:
-            cluster = pick_best_cluster(clusters)
-            result = aggregate_cluster_position(cluster, self.result_type)
+            with query.timer.phase('cluster'):
+                cluster = pick_best_cluster(clusters)
+                result = aggregate_cluster_position(
+                    cluster, self.result_type)
 
         return result
 
@@ -233,6 +286,10 @@ class WifiPositionSource(WifiPositionMixin, PositionSource):
     fallback_field = None  #:
     source = DataSource.internal
 
+    def __init__(self, settings, *args, **kw):
+        super(WifiPositionSource, self).__init__(settings, *args, **kw)
+        self.configure_wifi(settings)
+
     def should_search(self, query, results):
         return self.should_search_wifi(query, results)
 
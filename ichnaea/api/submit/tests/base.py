@@ -4,6 +4,7 @@ from simplejson import dumps
 
 from ichnaea.api.exceptions import (
     ParseError,
+    RequestTooLarge,
     ServiceUnavailable,
 )
 from ichnaea.models import Radio
@@ -67,6 +68,22 @@ class BaseSubmitTest(object):
             content_type='application/json', status=400)
         self._assert_queue_size(0)
 
+    def test_error_too_large(self):
+        body = b' ' * (20 * 1024 * 1024 + 1)
+        res = self.app.post(
+            self.url, body, content_type='application/json', status=413)
+        self.assertEqual(res.json, RequestTooLarge.json_body())
+        self._assert_queue_size(0)
+
+    def test_error_too_large_gzip(self):
+        body = util.encode_gzip(b' ' * (20 * 1024 * 1024 + 1))
+        headers = {'Content-Encoding': 'gzip'}
+        res = self.app.post(
+            self.url, body, headers=headers,
+            content_type='application/json', status=413)
+        self.assertEqual(res.json, RequestTooLarge.json_body())
+        self._assert_queue_size(0)
+
     def test_error_get(self):
         res = self.app.get(self.url, status=400)
         self.assertEqual(res.json, ParseError.json_body())
@@ -93,19 +110,34 @@ class BaseSubmitTest(object):
         self.check_raven([('ParseError', 1)])
 
     def test_error_redis_failure(self):
-        mock_task = mock.Mock()
-        mock_task.side_effect = RedisError()
+        mock_queue = mock.Mock()
+        mock_queue.side_effect = RedisError()
 
-        with mock.patch('ichnaea.async.task.BaseTask.apply', mock_task):
+        with mock.patch('ichnaea.queue.ExportQueue.enqueue', mock_queue):
             res = self._post_one_cell(status=503)
             self.assertEqual(res.json, ServiceUnavailable.json_body())
 
-        self.assertTrue(mock_task.called)
+        self.assertTrue(mock_queue.called)
         self.check_stats(counter=[
             ('data.batch.upload', 0),
             ('request', [self.metric_path, 'method:post', 'status:503']),
         ])
 
+    def test_trusted(self):
+        self._post_one_cell()
+        item = self.queue.dequeue(self.queue.queue_key())[0]
+        self.assertTrue(item['internal']['trusted'])
+        self.assertEqual(len(item['internal']['cell']), 1)
+        self.assertEqual(item['internal']['malformed'],
+                         {'cell': 0, 'wifi': 0})
+
+    def test_no_task(self):
+        mock_task = mock.Mock()
+        with mock.patch('ichnaea.async.task.BaseTask.apply', mock_task):
+            self._post_one_cell()
+        self.assertFalse(mock_task.called)
+        self._assert_queue_size(1)
+
     def test_headers_email_without_nickname(self):
         self._post_one_cell(nickname=None, email=self.email)
         item = self.queue.dequeue(self.queue.queue_key())[0]
@@ -10,18 +10,25 @@ from ichnaea.api.exceptions import (
     UploadSuccess,
 )
 from ichnaea.api.views import BaseAPIView
-from ichnaea.data.tasks import queue_reports
+from ichnaea.cache import redis_pipeline
+from ichnaea.data.internal import InternalTransform
+from ichnaea.data.report import trusted_report
+from ichnaea.queue import enqueue_reports
 
 
 class BaseSubmitView(BaseAPIView):
     """Common base class for all submit related views."""
 
     error_on_invalidkey = False  #:
+    max_body_size = 20971520  #:
     view_type = 'submit'  #:
 
     #: :exc:`ichnaea.api.exceptions.UploadSuccess`
     success = UploadSuccess
 
+    #: :class:`ichnaea.data.internal.InternalTransform`
+    transform = InternalTransform()
+
     def __init__(self, request):
         super(BaseSubmitView, self).__init__(request)
         self.email, self.nickname = self.get_request_user_data()
@@ -62,22 +69,27 @@ class BaseSubmitView(BaseAPIView):
         # may raise HTTP error
         request_data = self.preprocess()
 
-        # data pipeline using new internal data format
+        # data pipeline using new internal data format, the reports
+        # are added to the export queues directly in one Redis pipeline
         reports = request_data['items']
-        batch_size = 50
-        for i in range(0, len(reports), batch_size):
-            batch = reports[i:i + batch_size]
-            # insert reports, expire the task if it wasn't processed
-            # after six hours to avoid queue overload
-            queue_reports.apply_async(
-                kwargs={
-                    'api_key': api_key.valid_key,
-                    'email': self.email,
-                    'ip': self.request.client_addr,
-                    'nickname': self.nickname,
-                    'reports': batch,
-                },
-                expires=21600)
+        export_queues = self.request.registry.export_queues
+
+        internal = None
+        if [queue for queue in export_queues.values()
+                if queue.scheme == 'internal']:
+            # validate the reports once for the internal data pipeline
+            with self.timer.phase('trust'):
+                internal = [trusted_report(self.transform(report))
+                            for report in reports]
+
+        with redis_pipeline(self.redis_client) as pipe:
+            enqueue_reports(
+                export_queues, reports, pipe,
+                api_key=api_key.valid_key,
+                email=self.email,
+                ip=self.request.client_addr,
+                nickname=self.nickname,
+                internal=internal)
 
         self.emit_upload_metrics(len(reports), api_key)
 
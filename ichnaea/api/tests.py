@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import time
 
 from colander import MappingSchema, String
@@ -6,7 +9,15 @@ from pyramid.request import Request
 from ichnaea.api import exceptions as api_exceptions
 from ichnaea.api.rate_limit import rate_limit_exceeded
 from ichnaea.api.schema import InternalSchemaNode, InternalMapping
+from ichnaea.api.timing import (
+    configure_profiler,
+    DisabledProfiler,
+    PhaseTimer,
+    RequestProfiler,
+)
+from ichnaea.config import DummyConfig
 from ichnaea.tests.base import (
+    LogTestCase,
     RedisTestCase,
     TestCase,
 )
@@ -125,3 +136,73 @@ class TestLimiter(RedisTestCase):
             maxreq=maxreq,
             expire=expire,
         ))
+
+
+class TestPhaseTimer(LogTestCase):
+
+    def test_emit(self):
+        timer = PhaseTimer()
+        with timer.phase('geoip'):
+            pass
+        with timer.phase('db', tags=['table:wifi_shard_0']):
+            pass
+        with timer.phase('db', tags=['table:wifi_shard_0']):
+            pass
+        self.assertEqual(len(timer.phases), 2)
+
+        timer.emit(self.stats_client, 'locate.timing', tags=['path:v1'])
+        self.check_stats(total=2, histogram=[
+            ('locate.timing', 1,
+                ['path:v1', 'phase:db', 'table:wifi_shard_0']),
+            ('locate.timing', 1, ['path:v1', 'phase:geoip']),
+        ])
+
+    def test_exception(self):
+        timer = PhaseTimer()
+        try:
+            with timer.phase('fallback'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(list(timer.phases.keys()), [('fallback', ())])
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        super(TestProfiler, self).setUp()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestProfiler, self).tearDown()
+
+    def test_configure_disabled(self):
+        self.assertTrue(isinstance(
+            configure_profiler(None), DisabledProfiler))
+        config = DummyConfig({'profile': {'path': self.path}})
+        self.assertTrue(isinstance(
+            configure_profiler(config), DisabledProfiler))
+
+    def test_configure(self):
+        config = DummyConfig({'profile': {
+            'path': self.path, 'sample_rate': '0.5', 'slow_ms': '200'}})
+        profiler = configure_profiler(config)
+        self.assertTrue(isinstance(profiler, RequestProfiler))
+        self.assertEqual(profiler.sample_rate, 0.5)
+        self.assertEqual(profiler.slow_ms, 200)
+
+    def test_slow(self):
+        profiler = RequestProfiler(self.path, sample_rate=1.0, slow_ms=0)
+        with profiler.profile('v1.geolocate'):
+            pass
+        files = os.listdir(self.path)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('v1.geolocate-'))
+        self.assertTrue(files[0].endswith('.prof'))
+
+    def test_fast(self):
+        profiler = RequestProfiler(self.path, sample_rate=1.0, slow_ms=10000)
+        with profiler.profile('v1.geolocate'):
+            pass
+        self.assertEqual(os.listdir(self.path), [])
@@ -0,0 +1,160 @@
+"""
+Per-request phase timing and sampled profiling for the API views.
+"""
+
+from contextlib import contextmanager
+import cProfile
+import os
+import os.path
+from random import random
+import time
+import uuid
+
+
+class PhaseTimer(object):
+    """
+    A PhaseTimer tracks how much time a single request spends in
+    each of a number of named phases.
+
+    Entering the same phase multiple times adds up the durations.
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name, tags=None):
+        """
+        Time the enclosed block of code as part of the named phase.
+
+        :param name: The name of the phase, for example `geoip`.
+        :type name: str
+
+        :param tags: An optional list of additional statsd tags.
+        :type tags: list
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            key = (name, tuple(tags or ()))
+            duration = (time.time() - start) * 1000.0
+            self.phases[key] = self.phases.get(key, 0.0) + duration
+
+    def totals(self):
+        """
+        Return a dict of the total duration in milliseconds of each
+        phase, summed up over all tags.
+        """
+        totals = {}
+        for (name, extra_tags), duration in self.phases.items():
+            totals[name] = totals.get(name, 0.0) + duration
+        return dict((name, int(round(duration)))
+                    for name, duration in totals.items())
+
+    def emit(self, stats_client, metric, tags=None):
+        """
+        Emit one histogram value per recorded phase.
+
+        :param stats_client: A stats client.
+        :type stats_client: :class:`~ichnaea.log.StatsClient`
+
+        :param metric: The metric name, for example `locate.timing`.
+        :type metric: str
+
+        :param tags: A list of statsd tags added to all values.
+        :type tags: list
+        """
+        tags = list(tags or ())
+        for (name, extra_tags), duration in sorted(self.phases.items()):
+            stats_client.histogram(
+                metric, int(round(duration)),
+                tags=tags + ['phase:%s' % name] + list(extra_tags))
+
+
+class DisabledProfiler(object):
+    """
+    A DisabledProfiler implements a no-op version of the
+    :class:`~ichnaea.api.timing.RequestProfiler`.
+    """
+
+    @contextmanager
+    def profile(self, name):
+        yield
+
+
+class RequestProfiler(object):
+    """
+    A RequestProfiler runs a sampled fraction of all requests under
+    :mod:`cProfile` and writes the collected profile of slow requests
+    into a local directory.
+
+    The profiler sees all code running in the current thread, so in
+    a gevent worker the profile can include other concurrent requests.
+    """
+
+    def __init__(self, path, sample_rate=0.0, slow_ms=1000,
+                 raven_client=None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.raven_client = raven_client
+
+    def _filename(self, name, duration):
+        return os.path.join(self.path, '{name}-{ms}ms-{uuid}.prof'.format(
+            name=name, ms=int(duration), uuid=uuid.uuid4().hex))
+
+    def _dump(self, profiler, name, duration):
+        try:
+            profiler.dump_stats(self._filename(name, duration))
+        except (IOError, OSError):  # pragma: no cover
+            if self.raven_client is not None:
+                self.raven_client.captureException()
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profile the enclosed block of code, if this request was sampled.
+
+        :param name: A name for the request, used in the profile filename.
+        :type name: str
+        """
+        if not self.sample_rate or random() >= self.sample_rate:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        start = time.time()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            duration = (time.time() - start) * 1000.0
+            if duration >= self.slow_ms:
+                self._dump(profiler, name, duration)
+
+
+def configure_profiler(app_config, raven_client=None):
+    """
+    Configure and return a request profiler, based on the `[profile]`
+    section of the application ini file.
+    """
+    section = {}
+    if app_config is not None:
+        section = app_config.get_map('profile', {})
+
+    path = section.get('path', '').strip()
+    sample_rate = float(section.get('sample_rate', 0.0))
+    if not path or sample_rate <= 0.0:
+        return DisabledProfiler()
+
+    if not os.path.isdir(path):  # pragma: no cover
+        os.makedirs(path)
+
+    return RequestProfiler(
+        path,
+        sample_rate=sample_rate,
+        slow_ms=int(section.get('slow_ms', 1000)),
+        raven_client=raven_client,
+    )
@@ -10,8 +10,10 @@ from ichnaea.api.exceptions import (
     DailyLimitExceeded,
     InvalidAPIKey,
     ParseError,
+    RequestTooLarge,
 )
 from ichnaea.api.rate_limit import rate_limit_exceeded
+from ichnaea.api.timing import PhaseTimer
 from ichnaea.models.api import ApiKey
 from ichnaea import util
 from ichnaea.webapp.view import BaseView
@@ -27,8 +29,10 @@ class BaseAPIView(BaseView):
 
     check_api_key = True  #: Should API keys be checked?
     error_on_invalidkey = True  #: Deny access for invalid API keys?
+    max_body_size = 1048576  #: Maximum decoded request body size in bytes.
     metric_path = None  #: Dotted URL path, for example v1.submit.
     schema = None  #: An instance of a colander schema to validate the data.
+    timing_metrics = False  #: Emit per-phase request timing metrics?
     view_type = None  #: The type of view, for example submit or locate.
 
     def __init__(self, request):
@@ -36,6 +40,7 @@ class BaseAPIView(BaseView):
         self.raven_client = request.registry.raven_client
         self.redis_client = request.registry.redis_client
         self.stats_client = request.registry.stats_client
+        self.timer = PhaseTimer()
 
     def log_unique_ip(self, apikey_shortname):
         try:
@@ -78,7 +83,8 @@ class BaseAPIView(BaseView):
         if api_key_text is not None:
             try:
                 session = self.request.db_ro_session
-                api_key = session.query(ApiKey).get(api_key_text)
+                with self.timer.phase('api_key'):
+                    api_key = session.query(ApiKey).get(api_key_text)
             except Exception:
                 # if we cannot connect to backend DB, skip api key check
                 skip_check = True
@@ -93,11 +99,12 @@ class BaseAPIView(BaseView):
                 time=util.utcnow().strftime('%Y%m%d')
             )
 
-            should_limit = rate_limit_exceeded(
-                self.redis_client,
-                rate_key,
-                maxreq=api_key.maxreq
-            )
+            with self.timer.phase('rate_limit'):
+                should_limit = rate_limit_exceeded(
+                    self.redis_client,
+                    rate_key,
+                    maxreq=api_key.maxreq
+                )
 
             if should_limit:
                 raise self.prepare_exception(DailyLimitExceeded())
@@ -114,41 +121,76 @@ class BaseAPIView(BaseView):
         api_key = api_key or ApiKey(valid_key=None)
         return self.view(api_key)
 
+    def read_request_body(self):
+        """
+        Read and if necessary decompress the request body, without ever
+        holding more than :attr:`max_body_size` bytes of decoded data.
+
+        :raises: OSError for malformed gzip data.
+        """
+        content_length = self.request.content_length
+        if content_length and content_length > self.max_body_size:
+            # reject oversized bodies before reading them
+            raise self.prepare_exception(RequestTooLarge())
+
+        # webob spools large bodies to a temporary file
+        body_file = self.request.body_file_seekable
+        try:
+            if self.request.headers.get('Content-Encoding') == 'gzip':
+                # handle gzip request bodies
+                return util.gunzip(body_file, max_size=self.max_body_size)
+            return util.read_limited(body_file, max_size=self.max_body_size)
+        except util.SizeLimitError:
+            raise self.prepare_exception(RequestTooLarge())
+
     def preprocess_request(self):
         errors = []
 
-        request_content = self.request.body
-        if self.request.headers.get('Content-Encoding') == 'gzip':
-            # handle gzip self.request bodies
+        with self.timer.phase('decode'):
             try:
-                request_content = util.decode_gzip(self.request.body)
-            except OSError as exc:
-                errors.append({'name': None, 'description': repr(exc)})
+                request_content = self.read_request_body()
+            except OSError:
+                # a malformed gzip body is never an empty request
+                raise self.prepare_exception(ParseError())
 
-        request_data = {}
-        try:
-            request_data = json.loads(
-                request_content, encoding=self.request.charset)
-        except ValueError as exc:
-            errors.append({'name': None, 'description': repr(exc)})
+            request_data = {}
+            try:
+                request_data = json.loads(
+                    request_content, encoding=self.request.charset)
+            except ValueError as exc:
+                errors.append({'name': None, 'description': repr(exc)})
 
         validated_data = {}
-        try:
-            validated_data = self.schema.deserialize(request_data)
-        except colander.Invalid as exc:
-            errors.append({'name': None, 'description': exc.asdict()})
+        with self.timer.phase('validate'):
+            try:
+                validated_data = self.schema.deserialize(request_data)
+            except colander.Invalid as exc:
+                errors.append({'name': None, 'description': exc.asdict()})
 
         if request_content and errors:
             raise self.prepare_exception(ParseError())
 
         return (validated_data, errors)
 
+    def emit_timing_stats(self):
+        """Emit the per-phase timings collected for this request."""
+        if not self.timing_metrics:
+            return
+        self.timer.emit(
+            self.stats_client, self.view_type + '.timing',
+            tags=['path:' + self.metric_path])
+
     def __call__(self):
         """Execute the view and return a response."""
-        if self.check_api_key:
-            return self.check()
-        else:
-            api_key = ApiKey(
-                valid_key=None, allow_fallback=False,
-                log_locate=False, log_region=False, log_submit=False)
-            return self.view(api_key)
+        profiler = self.request.registry.profiler
+        try:
+            with profiler.profile(self.metric_path):
+                if self.check_api_key:
+                    return self.check()
+                else:
+                    api_key = ApiKey(
+                        valid_key=None, allow_fallback=False,
+                        log_locate=False, log_region=False, log_submit=False)
+                    return self.view(api_key)
+        finally:
+            self.emit_timing_stats()
@@ -8,6 +8,7 @@ from kombu import Queue
 from kombu.serialization import register
 
 from ichnaea.async.schedule import CELERYBEAT_SCHEDULE
+from ichnaea.bloom import BloomFilter
 from ichnaea.cache import configure_redis
 from ichnaea.config import read_config
 from ichnaea import internaljson
@@ -25,10 +26,12 @@ from ichnaea.models import (
 from ichnaea.queue import (
     DataQueue,
     ExportQueue,
+    UniqueDataQueue,
 )
 
 CELERY_QUEUES = (
     Queue('celery_cell', routing_key='celery_cell'),
+    Queue('celery_consume', routing_key='celery_consume'),
     Queue('celery_default', routing_key='celery_default'),
     Queue('celery_export', routing_key='celery_export'),
     Queue('celery_incoming', routing_key='celery_incoming'),
@@ -36,7 +39,7 @@ CELERY_QUEUES = (
     Queue('celery_ocid', routing_key='celery_ocid'),
     Queue('celery_reports', routing_key='celery_reports'),
     Queue('celery_upload', routing_key='celery_upload'),
-    Queue('celery_wifi', routing_key='celery_wifi'),
+    Queue('celery_wifi', routing_key='celery_wifi'),  # BBB
 )  #: List of :class:`kombu.Queue` instances.
 
 register('internal_json',
@@ -90,24 +93,32 @@ def configure_data(redis_client):
     data_queues = {
         'update_cell': DataQueue('update_cell', redis_client,
                                  queue_key='update_cell'),  # BBB
-        'update_cellarea': DataQueue('update_cellarea', redis_client,
-                                     queue_key='update_cellarea'),
-        'update_cellarea_ocid': DataQueue('update_cellarea_ocid', redis_client,
-                                          queue_key='update_cellarea_ocid'),
+        'update_cellarea': UniqueDataQueue(
+            'update_cellarea', redis_client,
+            queue_key='update_cellarea_unique',
+            legacy_key='update_cellarea'),  # BBB
+        'update_cellarea_ocid': UniqueDataQueue(
+            'update_cellarea_ocid', redis_client,
+            queue_key='update_cellarea_ocid_unique',
+            legacy_key='update_cellarea_ocid'),  # BBB
         'update_score': DataQueue('update_score', redis_client,
-                                  queue_key='update_score'),
+                                  queue_key='update_score'),  # BBB
     }
     for shard_id in DataMap.shards().keys():
         name = 'update_datamap_' + shard_id
-        data_queues[name] = DataQueue(name, redis_client, queue_key=name)
+        data_queues[name] = UniqueDataQueue(
+            name, redis_client, queue_key=name + '_unique',
+            legacy_key=name)  # BBB
     for shard_id in CellShard.shards().keys():
         name = 'update_cell_' + shard_id
         data_queues[name] = DataQueue(
-            name, redis_client, queue_key=name)
+            name, redis_client, queue_key=name,
+            codec='binary', reliable=True)
     for shard_id in WifiShard.shards().keys():
         name = 'update_wifi_' + shard_id
         data_queues[name] = DataQueue(
-            name, redis_client, queue_key=name)
+            name, redis_client, queue_key=name,
+            codec='binary', reliable=True)
     return data_queues
 
 
@@ -125,6 +136,35 @@ def configure_export(redis_client, app_config):
     return export_queues
 
 
+def configure_station_filters(redis_client, app_config):
+    """
+    Configure one Bloom filter of known station keys per station shard,
+    based on the `[station_filter]` section from the application ini file.
+
+    Filters are only configured for the station types with an explicit
+    capacity setting.
+    """
+    section = {}
+    if app_config is not None:
+        section = app_config.get_map('station_filter', {})
+    error_rate = float(section.get('error_rate', 0.01))
+
+    station_filters = {}
+    for station_type, model in (('cell', CellShard), ('wifi', WifiShard)):
+        capacity = section.get(station_type + '_capacity')
+        if not capacity:
+            continue
+        shards = model.shards()
+        capacity = int(capacity)
+        for shard_id in shards.keys():
+            name = '%s_%s' % (station_type, shard_id)
+            station_filters[name] = BloomFilter(
+                name, redis_client,
+                capacity=max(capacity // len(shards), 1),
+                error_rate=error_rate)
+    return station_filters
+
+
 def init_worker(celery_app, app_config,
                 _db_rw=None, _db_ro=None, _geoip_db=None,
                 _raven_client=None, _redis_client=None, _stats_client=None):
@@ -177,6 +217,9 @@ def init_worker(celery_app, app_config,
         if queue.monitor_name:
             all_queues.add(queue.monitor_name)
 
+    celery_app.station_filters = configure_station_filters(
+        redis_client, app_config)
+
 
 def shutdown_worker(celery_app):
     """
@@ -198,3 +241,4 @@ def shutdown_worker(celery_app):
     del celery_app.data_queues
     del celery_app.export_queues
     del celery_app.settings
+    del celery_app.station_filters
@@ -17,6 +17,11 @@ CELERYBEAT_SCHEDULE = {
         'schedule': timedelta(seconds=60),
         'options': {'expires': 57},
     },
+    'sweep-data-queues': {
+        'task': 'ichnaea.data.tasks.sweep_data_queues',
+        'schedule': timedelta(seconds=60),
+        'options': {'expires': 57},
+    },
     'monitor-ocid-import': {
         'task': 'ichnaea.data.tasks.monitor_ocid_import',
         'schedule': timedelta(seconds=600),
@@ -33,6 +38,14 @@ CELERYBEAT_SCHEDULE = {
         'options': {'expires': 570},
     },
 
+    # Every few minutes
+
+    'refresh-stats-cache': {
+        'task': 'ichnaea.data.tasks.refresh_stats_cache',
+        'schedule': timedelta(seconds=300),
+        'options': {'expires': 290},
+    },
+
     # Daily
 
     'cell-export-full': {
@@ -40,6 +53,22 @@ CELERYBEAT_SCHEDULE = {
         'schedule': crontab(hour=0, minute=13),
         'options': {'expires': 39600},
     },
+    'build-station-filters': {
+        'task': 'ichnaea.data.tasks.build_station_filters',
+        'schedule': crontab(hour=1, minute=23),
+        'options': {'expires': 39600},
+    },
+    'build-leaderboard': {
+        'task': 'ichnaea.data.tasks.build_leaderboard',
+        'schedule': crontab(hour=2, minute=17),
+        'options': {'expires': 39600},
+    },
+    'recount-statregion': {
+        'task': 'ichnaea.data.tasks.update_statregion',
+        'kwargs': {'recount': True},
+        'schedule': crontab(hour=2, minute=35),
+        'options': {'expires': 39600},
+    },
 
     # Hourly
 
@@ -54,6 +83,18 @@ CELERYBEAT_SCHEDULE = {
         'schedule': crontab(minute=52),
         'options': {'expires': 2700},
     },
+    'repair-cellarea': {
+        'task': 'ichnaea.data.tasks.repair_cellarea',
+        'args': (10000, ),
+        'schedule': crontab(minute=43),
+        'options': {'expires': 2700},
+    },
+    'rollup-scores': {
+        'task': 'ichnaea.data.tasks.rollup_scores',
+        'args': (30, ),
+        'schedule': crontab(minute=27),
+        'options': {'expires': 2700},
+    },
     'update-statcounter': {
         'task': 'ichnaea.data.tasks.update_statcounter',
         'args': (1, ),
@@ -81,61 +122,73 @@ CELERYBEAT_SCHEDULE = {
         'options': {'expires': 60},
     },
 
+    # Watchdogs for the long-running queue consumers, which drain
+    # their queue and hand over to a new task every 55 seconds.
+
     'update-cell-gsm': {
         'task': 'ichnaea.data.tasks.update_cell',
-        'schedule': timedelta(seconds=7),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'gsm'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-cell-wcdma': {
         'task': 'ichnaea.data.tasks.update_cell',
-        'schedule': timedelta(seconds=7),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'wcdma'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-cell-lte': {
         'task': 'ichnaea.data.tasks.update_cell',
-        'schedule': timedelta(seconds=7),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'lte'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
 
     'update-cellarea': {
         'task': 'ichnaea.data.tasks.update_cellarea',
-        'schedule': timedelta(seconds=8),
+        'schedule': timedelta(seconds=60),
         'args': (100, ),
-        'options': {'expires': 15},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-cellarea-ocid': {
         'task': 'ichnaea.data.tasks.update_cellarea_ocid',
-        'schedule': timedelta(seconds=9),
+        'schedule': timedelta(seconds=60),
         'args': (100, ),
-        'options': {'expires': 15},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
 
     'update-datamap-ne': {
         'task': 'ichnaea.data.tasks.update_datamap',
         'args': (500, 'ne'),
-        'schedule': timedelta(seconds=14),
-        'options': {'expires': 20},
+        'kwargs': {'drain': 55},
+        'schedule': timedelta(seconds=60),
+        'options': {'expires': 60},
     },
     'update-datamap-nw': {
         'task': 'ichnaea.data.tasks.update_datamap',
         'args': (500, 'nw'),
-        'schedule': timedelta(seconds=14),
-        'options': {'expires': 20},
+        'kwargs': {'drain': 55},
+        'schedule': timedelta(seconds=60),
+        'options': {'expires': 60},
     },
     'update-datamap-se': {
         'task': 'ichnaea.data.tasks.update_datamap',
         'args': (500, 'se'),
-        'schedule': timedelta(seconds=14),
-        'options': {'expires': 20},
+        'kwargs': {'drain': 55},
+        'schedule': timedelta(seconds=60),
+        'options': {'expires': 60},
     },
     'update-datamap-sw': {
         'task': 'ichnaea.data.tasks.update_datamap',
         'args': (500, 'sw'),
-        'schedule': timedelta(seconds=14),
-        'options': {'expires': 20},
+        'kwargs': {'drain': 55},
+        'schedule': timedelta(seconds=60),
+        'options': {'expires': 60},
     },
 
     'update-score': {
@@ -147,99 +200,115 @@ CELERYBEAT_SCHEDULE = {
 
     'update-wifi-0': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '0'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-1': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '1'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-2': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '2'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-3': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '3'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-4': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '4'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-5': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '5'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-6': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '6'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-7': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '7'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-8': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '8'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-9': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, '9'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-a': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'a'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-b': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'b'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-c': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'c'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-d': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'd'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-e': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'e'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
     'update-wifi-f': {
         'task': 'ichnaea.data.tasks.update_wifi',
-        'schedule': timedelta(seconds=6),
+        'schedule': timedelta(seconds=60),
         'args': (500, 'f'),
-        'options': {'expires': 10},
+        'kwargs': {'drain': 55},
+        'options': {'expires': 60},
     },
 
 }  #:
@@ -27,8 +27,9 @@ CELERY_IMPORTS = [
     'ichnaea.data.tasks',
 ]
 
-#: Optimization for a mix of fast and slow tasks.
-CELERYD_PREFETCH_MULTIPLIER = 8
+#: Only reserve one task per worker process, so no tasks wait behind
+#: the long-running queue consumers.
+CELERYD_PREFETCH_MULTIPLIER = 1
 CELERY_DISABLE_RATE_LIMITS = True  #: Optimization
 CELERY_MESSAGE_COMPRESSION = 'gzip'  #: Optimization
 
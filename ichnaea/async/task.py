@@ -2,6 +2,9 @@
 Contains a Celery base task.
 """
 
+from contextlib import contextmanager
+import time
+
 from celery import Task
 from kombu.serialization import (
     dumps as kombu_dumps,
@@ -10,6 +13,38 @@ from kombu.serialization import (
 
 from ichnaea.cache import redis_pipeline
 from ichnaea.db import db_worker_session
+from ichnaea.lease import (
+    Lease,
+    LeaseLost,
+)
+
+
+class AdaptiveBatch(object):
+    """
+    The batch size of a draining consumer, adapted to the queue
+    backlog and the time it took to process and commit the last batch.
+
+    The batch size is halved if a batch took longer than the `target`
+    duration in seconds. It is doubled if a batch was processed in less
+    than half the target duration and the backlog exceeds the batch.
+    """
+
+    def __init__(self, batch, min_batch=None, max_batch=None, target=2.0):
+        self.batch = batch
+        self.min_batch = min_batch or max(batch // 10, 1)
+        self.max_batch = max_batch or batch * 10
+        self.target = target
+
+    def update(self, duration, backlog):
+        """
+        Update the batch size based on the duration of the last batch
+        and the number of items left in the queue.
+        """
+        if duration > self.target:
+            self.batch = max(self.batch // 2, self.min_batch)
+        elif duration < self.target / 2.0 and backlog > self.batch:
+            self.batch = min(self.batch * 2, self.max_batch)
+        return self.batch
 
 
 class BaseTask(Task):
@@ -79,6 +114,99 @@ class BaseTask(Task):
         """
         return db_worker_session(self.app.db_rw, commit=commit)
 
+    @contextmanager
+    def lease(self, name, timeout=60):
+        """
+        Returns a :class:`ichnaea.lease.Lease` on the named resource
+        usable as a context manager. If the lease is currently held by
+        another consumer, None is returned instead. The lease is
+        released at the end.
+        """
+        lease = Lease(name, self.redis_client, self.stats_client,
+                      timeout=timeout)
+        if not lease.acquire():
+            yield None
+            return
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    def drain(self, data_queue, process, batch, duration,
+              lease=None, wait=5):
+        """
+        Continuously process batches of items from the data queue for
+        up to `duration` seconds and return the number of batches.
+
+        `process` is called with the current batch size and should
+        process and commit a single batch. The batch size adapts to the
+        backlog and the processing time, see :class:`AdaptiveBatch`.
+        Once the queue is empty, the method blocks for up to `wait`
+        seconds at a time until new items arrive.
+
+        :param lease: An optional :class:`ichnaea.lease.Lease`, which
+                      is renewed between batches. Draining stops, if
+                      the lease is lost.
+        """
+        sizer = AdaptiveBatch(batch)
+        end = time.time() + duration
+        batches = 0
+        backlog = 1  # always process at least one batch
+        while True:
+            if backlog:
+                start = time.time()
+                process(sizer.batch)
+                batches += 1
+                backlog = data_queue.size()
+                sizer.update(time.time() - start, backlog)
+
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            if lease is not None and not lease.renew():
+                break
+            if not backlog:
+                # Redis only supports whole seconds as timeouts
+                timeout = int(min(wait, remaining))
+                if timeout < 1:
+                    break
+                backlog = int(data_queue.wait(timeout=timeout))
+        return batches
+
+    def consume(self, queue_name, process, batch, drain=0, **kw):
+        """
+        Consume the named data queue under a lease of the same name.
+
+        `process` is called with the batch size and the lease. With a
+        `drain` duration in seconds, the queue is drained continuously,
+        see :meth:`drain`, after which the task hands over to a new
+        task. Otherwise a single batch is processed and the task
+        reschedules itself, if enough data is left in the queue.
+        Processing stops, if it raises :exc:`ichnaea.lease.LeaseLost`.
+        Any extra keyword arguments are passed on to the next task.
+        """
+        data_queue = self.app.data_queues[queue_name]
+        with self.lease(queue_name) as lease:
+            if lease is None:
+                # another task is already consuming this queue
+                return
+            try:
+                self.drain(data_queue, lambda batch: process(batch, lease),
+                           batch, drain, lease=lease)
+            except LeaseLost:
+                # another task might be consuming this queue by now
+                return
+
+        kw['batch'] = batch
+        if drain:
+            # Celery Beat only restarts consumers which died,
+            # eager mode would run the new task right here
+            if not self.app.conf.CELERY_ALWAYS_EAGER:  # pragma: no cover
+                kw['drain'] = drain
+                self.apply_async(kwargs=kw, expires=drain)
+        elif data_queue.enough_data(batch=batch):
+            self.apply_async(kwargs=kw, countdown=2, expires=10)
+
     def redis_pipeline(self, execute=True):
         """
         Returns a Redis pipeline usable as a context manager.
@@ -4,6 +4,7 @@ import tempfile
 
 from ichnaea.async.app import celery_app
 from ichnaea.async import schedule
+from ichnaea.async.task import AdaptiveBatch
 from ichnaea.tests.base import CeleryTestCase, TestCase
 
 
@@ -29,3 +30,32 @@ class TestWorkerConfig(TestCase):
     def test_config(self):
         self.assertTrue(celery_app.conf['CELERY_ALWAYS_EAGER'])
         self.assertTrue('redis' in celery_app.conf['CELERY_RESULT_BACKEND'])
+
+
+class TestAdaptiveBatch(TestCase):
+
+    def test_grow(self):
+        sizer = AdaptiveBatch(100, target=2.0)
+        self.assertEqual(sizer.update(0.5, 1000), 200)
+        # the batch only grows if there is a large enough backlog
+        self.assertEqual(sizer.update(0.5, 150), 200)
+        # or if the last batch was fast enough
+        self.assertEqual(sizer.update(1.5, 1000), 200)
+
+    def test_shrink(self):
+        sizer = AdaptiveBatch(100, target=2.0)
+        self.assertEqual(sizer.update(3.0, 1000), 50)
+        self.assertEqual(sizer.update(3.0, 0), 25)
+
+    def test_bounds(self):
+        sizer = AdaptiveBatch(100, min_batch=40, max_batch=300)
+        self.assertEqual(sizer.update(10.0, 0), 50)
+        self.assertEqual(sizer.update(10.0, 0), 40)
+        for i in range(5):
+            sizer.update(0.0, 10000)
+        self.assertEqual(sizer.batch, 300)
+
+    def test_default_bounds(self):
+        sizer = AdaptiveBatch(5)
+        self.assertEqual(sizer.min_batch, 1)
+        self.assertEqual(sizer.max_batch, 50)
@@ -0,0 +1,115 @@
+"""
+A Redis backed Bloom filter, used to quickly answer if a station
+is definitely unknown, without having to query the database.
+"""
+
+import hashlib
+import math
+import struct
+
+from six import text_type
+
+_HASH_STRUCT = struct.Struct('<QQ')
+MAX_BITS = 2 ** 32  #: Maximum number of bits in a single Redis string.
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter stored in a single Redis bitmap.
+
+    The filter can answer if a value was definitely never added to it,
+    or if the value was probably added to it. The probability of a
+    false positive answer depends on the number of values in the filter.
+    It stays below the `error_rate` as long as the filter contains at
+    most `capacity` values.
+
+    The filter is only used once it has been marked as ready, which
+    happens after it has been populated with all existing values.
+
+    :param name: The name of the filter.
+    :param redis_client: A Redis client.
+    :param capacity: The expected number of values.
+    :param error_rate: The expected false positive rate at capacity.
+    """
+
+    def __init__(self, name, redis_client, capacity, error_rate=0.01):
+        self.name = name
+        self.redis_client = redis_client
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = min(int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))),
+            MAX_BITS)
+        self.num_hashes = max(int(round(
+            float(self.num_bits) / capacity * math.log(2))), 1)
+
+    def _key(self, suffix=''):
+        # A change in the filter size results in a new empty filter.
+        return ('bloom:%s:%s:%s%s' % (
+            self.name, self.num_bits, self.num_hashes, suffix)).encode(
+            'ascii')
+
+    def key(self):
+        """Returns the Redis key of the bitmap."""
+        return self._key()
+
+    def ready_key(self):
+        """Returns the Redis key marking the filter as populated."""
+        return self._key(':ready')
+
+    def offsets(self, value):
+        """Returns the bit offsets for the given value."""
+        if isinstance(value, text_type):
+            value = value.encode('utf-8')
+        one, two = _HASH_STRUCT.unpack(hashlib.md5(value).digest())
+        return [(one + i * two) % self.num_bits
+                for i in range(self.num_hashes)]
+
+    def add(self, values, pipe=None):
+        """
+        Add the values to the filter.
+
+        :param pipe: An optional Redis pipeline, which will be used
+                     instead of executing the commands directly.
+        """
+        if not values:
+            return
+        if pipe is None:
+            with self.redis_client.pipeline() as pipe:
+                self.add(values, pipe=pipe)
+                pipe.execute()
+            return
+
+        key = self.key()
+        for value in values:
+            for offset in self.offsets(value):
+                pipe.setbit(key, offset, 1)
+
+    def contains(self, values):
+        """
+        Returns a list of booleans, one for each value. `False` means
+        the value is definitely not in the filter, `True` means it
+        probably is.
+        """
+        if not values:
+            return []
+        key = self.key()
+        with self.redis_client.pipeline() as pipe:
+            for value in values:
+                for offset in self.offsets(value):
+                    pipe.getbit(key, offset)
+            bits = pipe.execute()
+
+        result = []
+        for i in range(len(values)):
+            start = i * self.num_hashes
+            result.append(all(bits[start:start + self.num_hashes]))
+        return result
+
+    def ready(self):
+        """Has the filter been populated with all existing values?"""
+        return bool(self.redis_client.exists(self.ready_key()))
+
+    def mark_ready(self):
+        """Mark the filter as fully populated."""
+        self.redis_client.set(self.ready_key(), b'1')
@@ -6,7 +6,9 @@ from mock import MagicMock, patch
 from pyramid.testing import DummyRequest
 from pyramid import testing
 
+from ichnaea.lease import Lease
 from ichnaea.models.content import (
+    RegionStat,
     Score,
     ScoreKey,
     Stat,
@@ -17,6 +19,7 @@ from ichnaea.content.views import (
     LOCAL_TILES,
     LOCAL_TILES_BASE,
 )
+from ichnaea.stats import StatsCache
 from ichnaea.tests.base import AppTestCase, TestCase
 from ichnaea import util
 
@@ -243,6 +246,7 @@ class TestFunctionalContentViews(AppTestCase):
         request = DummyRequest()
         request.db_ro_session = self.session
         request.registry.redis_client = self.redis_client
+        request.registry.stats_client = self.stats_client
         inst = self._make_view(request)
         result = inst.leaders_view()
         self.assertEqual(
@@ -277,6 +281,7 @@ class TestFunctionalContentViews(AppTestCase):
         request = DummyRequest()
         request.db_ro_session = self.session
         request.registry.redis_client = self.redis_client
+        request.registry.stats_client = self.stats_client
         inst = self._make_view(request)
         result = inst.leaders_weekly_view()
         for score_name in ('new_cell', 'new_wifi'):
@@ -310,6 +315,7 @@ class TestFunctionalContentViews(AppTestCase):
         request = DummyRequest()
         request.db_ro_session = self.session
         request.registry.redis_client = self.redis_client
+        request.registry.stats_client = self.stats_client
         inst = self._make_view(request)
         result = inst.stats_view()
         self.assertEqual(result['page_title'], 'Statistics')
@@ -336,6 +342,7 @@ class TestFunctionalContentViews(AppTestCase):
         request = DummyRequest()
         request.db_ro_session = self.session
         request.registry.redis_client = self.redis_client
+        request.registry.stats_client = self.stats_client
         inst = self._make_view(request)
         result = inst.stats_regions_view()
         self.assertEqual(result['page_title'], 'Region Statistics')
@@ -347,6 +354,50 @@ class TestFunctionalContentViews(AppTestCase):
         second_result = inst.stats_regions_view()
         self.assertEqual(second_result, result)
 
+    def test_stats_stale(self):
+        request = DummyRequest()
+        request.db_ro_session = self.session
+        request.registry.redis_client = self.redis_client
+        request.registry.stats_client = self.stats_client
+        stats_cache = StatsCache(self.redis_client, self.stats_client)
+        inst = self._make_view(request)
+        result = inst.stats_regions_view()
+        self.assertEqual(result['metrics'], [])
+
+        # stale data is served without a database session, until
+        # the background task refreshes it
+        self.session.add(RegionStat(region='DE', gsm=1))
+        self.session.commit()
+        stats_cache.expire(['stats_regions'])
+        request.db_ro_session = None
+        inst = self._make_view(request)
+        self.assertEqual(inst.stats_regions_view(), result)
+
+        stats_cache.refresh('stats_regions', self.session)
+        inst = self._make_view(request)
+        result = inst.stats_regions_view()
+        self.assertEqual([region['code'] for region in result['metrics']],
+                         ['DE'])
+
+    def test_stats_cold(self):
+        request = DummyRequest()
+        request.db_ro_session = None
+        request.registry.redis_client = self.redis_client
+        request.registry.stats_client = self.stats_client
+        stats_cache = StatsCache(self.redis_client, self.stats_client)
+        lease = Lease(StatsCache.lease_name,
+                      self.redis_client, self.stats_client)
+        self.assertTrue(lease.acquire())
+        # the data is being computed elsewhere, empty data is shown
+        inst = self._make_view(request)
+        result = inst.stats_view()
+        self.assertEqual(result['metrics1'], [])
+        inst = self._make_view(request)
+        self.assertEqual(inst.stats_wifi_json(),
+                         {'series': [{'title': 'MLS WiFi', 'data': []}]})
+        self.assertEqual(stats_cache.stale(['stats']), ['stats'])
+        lease.release()
+
 
 class TestLayout(TestCase):
 
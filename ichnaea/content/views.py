@@ -16,15 +16,8 @@ from pyramid.response import Response
 from pyramid.view import view_config
 from six.moves.urllib import parse as urlparse
 
-from ichnaea.content.stats import (
-    global_stats,
-    histogram,
-    leaders,
-    leaders_weekly,
-    regions,
-)
 from ichnaea.internaljson import internal_dumps, internal_loads
-from ichnaea.models.content import StatKey
+from ichnaea.stats import StatsCache
 from ichnaea import util
 
 HERE = os.path.dirname(__file__)
@@ -198,27 +191,15 @@ class ContentViews(Layout):
     def privacy_view(self):
         return {'page_title': 'Privacy Notice'}
 
+    def _stats_page(self, name):
+        registry = self.request.registry
+        stats_cache = StatsCache(registry.redis_client, registry.stats_client)
+        return stats_cache.get(name, self.request.db_ro_session)
+
     @view_config(renderer='templates/leaders.pt',
                  route_name='leaders', http_cache=3600)
     def leaders_view(self):
-        redis_client = self.request.registry.redis_client
-        cache_key = redis_client.cache_keys['leaders']
-        cached = redis_client.get(cache_key)
-
-        if cached:
-            data = internal_loads(cached)
-        else:
-            session = self.request.db_ro_session
-            data = list(enumerate(leaders(session)))
-            data = [
-                {
-                    'pos': l[0] + 1,
-                    'num': l[1]['num'],
-                    'nickname': l[1]['nickname'],
-                    'anchor': l[1]['nickname'],
-                } for l in data]
-            redis_client.set(cache_key, internal_dumps(data), ex=1800)
-
+        data = self._stats_page('leaders')
         half = len(data) // 2 + len(data) % 2
         leaders1 = data[:half]
         leaders2 = data[half:]
@@ -231,35 +212,9 @@ class ContentViews(Layout):
     @view_config(renderer='templates/leaders_weekly.pt',
                  route_name='leaders_weekly', http_cache=3600)
     def leaders_weekly_view(self):
-        redis_client = self.request.registry.redis_client
-        cache_key = redis_client.cache_keys['leaders_weekly']
-        cached = redis_client.get(cache_key)
-
-        if cached:
-            data = internal_loads(cached)
-        else:
-            session = self.request.db_ro_session
-            data = {
-                'new_cell': {'leaders1': [], 'leaders2': []},
-                'new_wifi': {'leaders1': [], 'leaders2': []},
-            }
-            for name, value in leaders_weekly(session).items():
-                value = [
-                    {
-                        'pos': l[0] + 1,
-                        'num': l[1]['num'],
-                        'nickname': l[1]['nickname'],
-                    } for l in list(enumerate(value))]
-                half = len(value) // 2 + len(value) % 2
-                data[name] = {
-                    'leaders1': value[:half],
-                    'leaders2': value[half:],
-                }
-            redis_client.set(cache_key, internal_dumps(data), ex=3600)
-
         return {
             'page_title': 'Weekly Leaderboard',
-            'scores': data,
+            'scores': self._stats_page('leaders_weekly'),
         }
 
     @view_config(renderer='templates/map.pt', name='map', http_cache=3600)
@@ -277,83 +232,26 @@ class ContentViews(Layout):
     @view_config(
         renderer='json', name='stats_cell.json', http_cache=3600)
     def stats_cell_json(self):
-        redis_client = self.request.registry.redis_client
-        cache_key = redis_client.cache_keys['stats_cell_json']
-        cached = redis_client.get(cache_key)
-        if cached:
-            data = internal_loads(cached)
-        else:
-            session = self.request.db_ro_session
-            mls_data = histogram(session, StatKey.unique_cell)
-            ocid_data = histogram(session, StatKey.unique_cell_ocid)
-            data = [
-                {'title': 'MLS Cells', 'data': mls_data[0]},
-                {'title': 'OCID Cells', 'data': ocid_data[0]},
-            ]
-            redis_client.set(cache_key, internal_dumps(data), ex=3600)
-        return {'series': data}
+        return {'series': self._stats_page('stats_cell_json')}
 
     @view_config(
         renderer='json', name='stats_wifi.json', http_cache=3600)
     def stats_wifi_json(self):
-        redis_client = self.request.registry.redis_client
-        cache_key = redis_client.cache_keys['stats_wifi_json']
-        cached = redis_client.get(cache_key)
-        if cached:
-            data = internal_loads(cached)
-        else:
-            session = self.request.db_ro_session
-            data = histogram(session, StatKey.unique_wifi)
-            redis_client.set(cache_key, internal_dumps(data), ex=3600)
+        data = self._stats_page('stats_wifi_json')
         return {'series': [{'title': 'MLS WiFi', 'data': data[0]}]}
 
     @view_config(renderer='templates/stats.pt',
                  route_name='stats', http_cache=3600)
     def stats_view(self):
-        redis_client = self.request.registry.redis_client
-        cache_key = redis_client.cache_keys['stats']
-        cached = redis_client.get(cache_key)
-        if cached:
-            data = internal_loads(cached)
-        else:
-            session = self.request.db_ro_session
-            data = {
-                'leaders': [],
-                'metrics1': [],
-                'metrics2': [],
-            }
-            metrics = global_stats(session)
-            metric_names = [
-                (StatKey.unique_cell.name, 'MLS Cells'),
-                (StatKey.unique_cell_ocid.name, 'OpenCellID Cells'),
-                (StatKey.cell.name, 'MLS Cell Observations'),
-                (StatKey.unique_wifi.name, 'Wifi Networks'),
-                (StatKey.wifi.name, 'Wifi Observations'),
-            ]
-            for mid, name in metric_names[:3]:
-                data['metrics1'].append({'name': name, 'value': metrics[mid]})
-            for mid, name in metric_names[3:]:
-                data['metrics2'].append({'name': name, 'value': metrics[mid]})
-            redis_client.set(cache_key, internal_dumps(data), ex=3600)
-
         result = {'page_title': 'Statistics'}
-        result.update(data)
+        result.update(self._stats_page('stats'))
         return result
 
     @view_config(renderer='templates/stats_regions.pt',
                  route_name='stats_regions', http_cache=3600)
     def stats_regions_view(self):
-        redis_client = self.request.registry.redis_client
-        cache_key = redis_client.cache_keys['stats_regions']
-        cached = redis_client.get(cache_key)
-        if cached:
-            data = internal_loads(cached)
-        else:
-            session = self.request.db_ro_session
-            data = regions(session)
-            redis_client.set(cache_key, internal_dumps(data), ex=3600)
-
-        return {'page_title': 'Region Statistics', 'metrics': data}
+        return {'page_title': 'Region Statistics',
+                'metrics': self._stats_page('stats_regions')}
 
 
 def favicon_view(request):
@@ -1,16 +1,20 @@
+import base64
 from collections import defaultdict
 
 import numpy
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import load_only
 
-from ichnaea.data.base import DataTask
-from ichnaea.geocalc import (
-    centroid,
-    circle_radius,
+from ichnaea.cache import redis_pipeline
+from ichnaea.data.base import (
+    DataTask,
+    upsert_rows,
 )
+from ichnaea.geocalc import circle_radius
 from ichnaea.geocode import GEOCODER
 from ichnaea.models import (
     decode_cellarea,
+    encode_cellarea,
     CellArea,
     CellAreaOCID,
     CellOCID,
@@ -18,135 +22,450 @@ from ichnaea.models import (
 )
 from ichnaea import util
 
+AREA_CELL_FIELDS = ('lat', 'lon', 'radius', 'region',
+                    'max_lat', 'max_lon', 'min_lat', 'min_lon')
+AREA_UPDATE_FIELDS = ('modified', 'lat', 'lon', 'radius', 'region',
+                      'avg_cell_radius', 'num_cells')
+
+# Apply a delta to an existing aggregate hash. Deltas for areas without
+# an aggregate are dropped, those are rebuilt from a full scan instead.
+# ARGV holds the TTL, the four bounds, which only ever get extended,
+# and field name / increment pairs.
+_AREA_DELTA_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return 0
+end
+local bounds = {'max_lat', 'max_lon', 'min_lat', 'min_lon'}
+for i = 1, 4 do
+    local value = tonumber(ARGV[i + 1])
+    if value then
+        local current = tonumber(redis.call('hget', KEYS[1], bounds[i]))
+        if (not current or (i <= 2 and value > current) or
+                (i > 2 and value < current)) then
+            redis.call('hset', KEYS[1], bounds[i], ARGV[i + 1])
+        end
+    end
+end
+for i = 6, #ARGV, 2 do
+    redis.call('hincrbyfloat', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('expire', KEYS[1], tonumber(ARGV[1]))
+return 1
+"""
+
+
+class AreaAggregate(object):
+    """
+    Running aggregates of all cells with a position in a cell area,
+    from which the area position, radius and region are derived.
+
+    An aggregate can also represent the change caused by cells being
+    added, changed or removed. The bounds are never shrunk, as that
+    would require looking at all cells again.
+    """
+
+    counters = ('num_cells', 'sum_lat', 'sum_lon',
+                'num_radius', 'sum_radius')  #:
+    bounds = ('max_lat', 'max_lon', 'min_lat', 'min_lon')  #:
+
+    def __init__(self):
+        for field in self.counters:
+            setattr(self, field, 0)
+        for field in self.bounds:
+            setattr(self, field, None)
+        self.regions = defaultdict(int)
+
+    def _extend(self, lat, lon):
+        if lat is not None:
+            self.max_lat = lat if self.max_lat is None else max(
+                self.max_lat, lat)
+            self.min_lat = lat if self.min_lat is None else min(
+                self.min_lat, lat)
+        if lon is not None:
+            self.max_lon = lon if self.max_lon is None else max(
+                self.max_lon, lon)
+            self.min_lon = lon if self.min_lon is None else min(
+                self.min_lon, lon)
+
+    def add(self, cell, sign=1):
+        """
+        Add a cell to the aggregate, or remove it with a `sign` of -1.
+
+        :param cell: A dict with the :data:`AREA_CELL_FIELDS` of the
+                     cell or None. Cells without a position are ignored.
+        """
+        if not cell or cell.get('lat') is None or cell.get('lon') is None:
+            return
+        self.num_cells += sign
+        self.sum_lat += sign * cell['lat']
+        self.sum_lon += sign * cell['lon']
+        if cell.get('radius') is not None:
+            self.num_radius += sign
+            self.sum_radius += sign * cell['radius']
+        self.regions[cell.get('region') or ''] += sign
+        if sign > 0:
+            self._extend(cell['lat'], cell['lon'])
+            self._extend(cell.get('max_lat'), cell.get('max_lon'))
+            self._extend(cell.get('min_lat'), cell.get('min_lon'))
+
+    def increments(self):
+        """Returns a dict of all non-zero counters, by hash field name."""
+        result = {}
+        for field in self.counters:
+            value = getattr(self, field)
+            if value:
+                result[field] = value
+        for region, value in self.regions.items():
+            if value:
+                result['region:' + region] = value
+        return result
+
+    @classmethod
+    def from_hash(cls, values):
+        """Create an aggregate from the fields of a Redis hash."""
+        aggregate = cls()
+        for field, value in values.items():
+            if isinstance(field, bytes):
+                field = field.decode('ascii')
+            value = float(value)
+            if field.startswith('region:'):
+                aggregate.regions[field[7:]] = int(round(value))
+            elif field in ('num_cells', 'num_radius'):
+                setattr(aggregate, field, int(round(value)))
+            elif field in cls.counters or field in cls.bounds:
+                setattr(aggregate, field, value)
+        return aggregate
+
+    def to_hash(self):
+        """Returns a dict of Redis hash fields for the aggregate."""
+        result = dict([(field, getattr(self, field))
+                       for field in self.counters])
+        for field in self.bounds:
+            value = getattr(self, field)
+            if value is not None:
+                result[field] = value
+        for region, value in self.regions.items():
+            if value:
+                result['region:' + region] = value
+        return result
+
+
+class AreaAggregates(object):
+    """
+    Stores one :class:`AreaAggregate` per cell area in a Redis hash.
+
+    Aggregates expire if their area isn't updated for a while and can
+    be dropped at any time, they are rebuilt by a full scan of the
+    area's cells.
+
+    :param area_model: The cell area model class.
+    :param redis_client: A Redis client.
+    """
+
+    ttl = 7 * 86400  #: Time in seconds after which unused aggregates expire.
+
+    def __init__(self, area_model, redis_client):
+        self.area_model = area_model
+        self.redis_client = redis_client
+        self._delta_script = redis_client.register_script(
+            _AREA_DELTA_SCRIPT)
+
+    def key(self, areaid):
+        """Returns the Redis key of the aggregate for the area id."""
+        return ('%s_aggregate:' % self.area_model.__tablename__).encode(
+            'ascii') + base64.b64encode(areaid)
+
+    def load(self, areaids):
+        """
+        Returns a dict mapping each area id to its aggregate or to None
+        if there is no aggregate for the area.
+        """
+        with self.redis_client.pipeline() as pipe:
+            for areaid in areaids:
+                pipe.hgetall(self.key(areaid))
+            values = pipe.execute()
+        result = {}
+        for areaid, value in zip(areaids, values):
+            result[areaid] = AreaAggregate.from_hash(value) if value else None
+        return result
+
+    def store(self, pipe, areaid, aggregate):
+        """Replace the aggregate for the area id."""
+        key = self.key(areaid)
+        pipe.delete(key)
+        pipe.hmset(key, aggregate.to_hash())
+        pipe.expire(key, self.ttl)
+
+    def add_delta(self, pipe, areaid, delta):
+        """
+        Add the changes recorded in the `delta` aggregate to an existing
+        aggregate for the area id.
+        """
+        args = [self.ttl]
+        for field in AreaAggregate.bounds:
+            value = getattr(delta, field)
+            args.append('' if value is None else repr(float(value)))
+        for field, value in sorted(delta.increments().items()):
+            args.extend([field, repr(float(value))])
+        self._delta_script(
+            keys=[self.key(areaid)], args=args, client=pipe)
+
+    def remove(self, pipe, areaids):
+        """Drop the aggregates for the area ids."""
+        for areaid in areaids:
+            pipe.delete(self.key(areaid))
+
 
 class CellAreaUpdater(DataTask):
 
     area_model = CellArea
     cell_model = CellShard
     queue_name = 'update_cellarea'
+    incremental = True  #: Are the cells tracked by area aggregates?
+    scan_batch = 1000  #: Maximum number of areas scanned in one query.
 
     def __init__(self, task, session):
         DataTask.__init__(self, task, session)
-        self.queue = self.task.app.data_queues[self.queue_name]
         self.utcnow = util.utcnow()
+        self.aggregates = None
+        if self.incremental:
+            self.aggregates = AreaAggregates(
+                self.area_model, self.redis_client)
 
     def __call__(self, batch=100):
-        areaids = self.queue.dequeue(batch=batch, json=False)
-        for areaid in set(areaids):
-            self.update_area(areaid)
-
-        if self.queue.enough_data(batch=batch):  # pragma: no cover
-            self.task.apply_async(
-                kwargs={'batch': batch},
-                countdown=2,
-                expires=10)
-
-    def region(self, ctr_lat, ctr_lon, mcc, cells):
-        region = None
-        regions = [cell.region for cell in cells]
-        unique_regions = set(regions)
-        if len(unique_regions) == 1:
-            region = regions[0]
-        else:
-            # Choose the area region based on the majority of cells
-            # inside each region.
-            grouped_regions = defaultdict(int)
-            for reg in regions:
-                grouped_regions[reg] += 1
-            max_count = max(grouped_regions.values())
-            max_regions = sorted([k for k, v in grouped_regions.items()
-                                  if v == max_count])
-            # If we get a tie here, randomly choose the first.
-            region = max_regions[0]
-            if len(max_regions) > 1:
-                # Try to break the tie based on the center of the area,
-                # but keep the randomly chosen region if this fails.
-                area_region = GEOCODER.region_for_cell(
-                    ctr_lat, ctr_lon, mcc)
-                if area_region is not None:
-                    region = area_region
+        queue = self.task.app.data_queues[self.queue_name]
+        areaids = queue.dequeue(batch=batch, json=False)
+        self.update_areas(areaids)
+
+    def update_areas(self, areaids, rescan=False):
+        """
+        Update the areas based on their aggregates. Areas without an
+        aggregate and all areas if `rescan` is true are updated based
+        on a full scan of their cells, which replaces the aggregates.
+        The areas are processed in chunks of up to `scan_batch` areas.
+        """
+        for i in range(0, len(areaids), self.scan_batch):
+            self._update_areas(areaids[i:i + self.scan_batch], rescan)
+
+    def _update_areas(self, areaids, rescan):
+        aggregates = {}
+        if self.aggregates is not None and not rescan:
+            aggregates = self.aggregates.load(areaids)
+
+        scanned = self.scan_areas(
+            [areaid for areaid in areaids if aggregates.get(areaid) is None])
+        aggregates.update(scanned)
+
+        if self.aggregates is not None:
+            with redis_pipeline(self.redis_client) as pipe:
+                for areaid in areaids:
+                    aggregate = aggregates[areaid]
+                    if aggregate.num_cells <= 0:
+                        self.aggregates.remove(pipe, [areaid])
+                    elif areaid in scanned:
+                        self.aggregates.store(pipe, areaid, aggregate)
+
+        self.write_areas(areaids, aggregates)
+
+    def region(self, ctr_lat, ctr_lon, mcc, regions):
+        # Choose the area region based on the majority of cells
+        # inside each region.
+        region_counts = dict([(reg or None, count)
+                              for reg, count in regions.items() if count > 0])
+        if not region_counts:
+            return None
+        max_count = max(region_counts.values())
+        max_regions = sorted([k for k, v in region_counts.items()
+                              if v == max_count], key=lambda reg: reg or '')
+        # If we get a tie here, randomly choose the first.
+        region = max_regions[0]
+        if len(max_regions) > 1:
+            # Try to break the tie based on the center of the area,
+            # but keep the randomly chosen region if this fails.
+            area_region = GEOCODER.region_for_cell(
+                ctr_lat, ctr_lon, mcc)
+            if area_region is not None:
+                region = area_region
 
         return region
 
-    def update_area(self, areaid):
-        # Select all cells in this area and derive a bounding box for them
+    def scan_areas(self, areaids):
+        """
+        Select all cells in these areas, using one query per cell shard,
+        and return a dict mapping each area id to a new aggregate.
+        """
+        result = dict([(areaid, AreaAggregate()) for areaid in areaids])
+        shard_areas = defaultdict(list)
+        for areaid in areaids:
+            radio, mcc, mnc, lac = decode_cellarea(areaid)
+            shard_areas[self.cell_model.shard_model(radio)].append(
+                (radio, mcc, mnc, lac))
+
+        for shard, area_keys in shard_areas.items():
+            area_columns = (shard.radio, shard.mcc, shard.mnc, shard.lac)
+            # MySQL 5.6 only uses the cell index for 'or' criteria,
+            # not for row constructor IN lists
+            criterion = or_(*[
+                and_(*[column == value
+                       for column, value in zip(area_columns, area_key)])
+                for area_key in area_keys])
+            cells = (self.session.query(shard)
+                                 .options(load_only(*(
+                                     ('radio', 'mcc', 'mnc', 'lac') +
+                                     AREA_CELL_FIELDS)))
+                                 .filter(criterion)
+                                 .filter(shard.lat.isnot(None))
+                                 .filter(shard.lon.isnot(None))
+                                 .order_by(*area_columns)).all()
+            self._aggregate_cells(cells, result)
+        return result
+
+    def _aggregate_cells(self, cells, result):
+        # Add the cells, which are sorted by area, to the area aggregates
+        # in the result dict, using grouped array operations.
+        if not cells:
+            return
+
+        areaids = []
+        starts = []
+        values = []
+        for i, cell in enumerate(cells):
+            areaid = encode_cellarea(cell.radio, cell.mcc, cell.mnc, cell.lac)
+            if not areaids or areaids[-1] != areaid:
+                areaids.append(areaid)
+                starts.append(i)
+            result[areaid].regions[cell.region or ''] += 1
+            values.append([numpy.nan if value is None else value for value in (
+                cell.lat, cell.lon, cell.radius,
+                cell.max_lat, cell.max_lon, cell.min_lat, cell.min_lon)])
+
+        values = numpy.array(values, dtype=numpy.double)
+        starts = numpy.array(starts, dtype=numpy.intp)
+        radius = values[:, 2]
+        has_radius = ~numpy.isnan(radius)
+        num_cells = numpy.diff(numpy.append(starts, len(cells)))
+        sum_lat = numpy.add.reduceat(values[:, 0], starts)
+        sum_lon = numpy.add.reduceat(values[:, 1], starts)
+        num_radius = numpy.add.reduceat(has_radius.astype(numpy.intp), starts)
+        sum_radius = numpy.add.reduceat(
+            numpy.where(has_radius, radius, 0.0), starts)
+
+        # the bounds cover the cell positions and their bounding boxes
+        positions = values[:, [0, 1, 3, 4, 5, 6]].reshape(-1, 3, 2)
+        max_positions = numpy.fmax.reduceat(
+            numpy.fmax.reduce(positions, axis=1), starts)
+        min_positions = numpy.fmin.reduceat(
+            numpy.fmin.reduce(positions, axis=1), starts)
+
+        for i, areaid in enumerate(areaids):
+            aggregate = result[areaid]
+            aggregate.num_cells = int(num_cells[i])
+            aggregate.sum_lat = float(sum_lat[i])
+            aggregate.sum_lon = float(sum_lon[i])
+            aggregate.num_radius = int(num_radius[i])
+            aggregate.sum_radius = float(sum_radius[i])
+            aggregate.max_lat, aggregate.max_lon = [
+                float(value) for value in max_positions[i]]
+            aggregate.min_lat, aggregate.min_lon = [
+                float(value) for value in min_positions[i]]
+
+    def area_values(self, areaid, aggregate):
+        """
+        Return a dict of the area column values derived from the
+        aggregate, which has to contain at least one cell.
+        """
         radio, mcc, mnc, lac = decode_cellarea(areaid)
-        load_fields = ('lat', 'lon', 'radius', 'region',
-                       'max_lat', 'max_lon', 'min_lat', 'min_lon')
-
-        shard = self.cell_model.shard_model(radio)
-        cells = (self.session.query(shard)
-                             .options(load_only(*load_fields))
-                             .filter(shard.radio == radio)
-                             .filter(shard.mcc == mcc)
-                             .filter(shard.mnc == mnc)
-                             .filter(shard.lac == lac)
-                             .filter(shard.lat.isnot(None))
-                             .filter(shard.lon.isnot(None))).all()
-
-        area_query = (self.session.query(self.area_model)
-                                  .filter(self.area_model.areaid == areaid))
-
-        if len(cells) == 0:
-            # If there are no more underlying cells, delete the area entry
-            area_query.delete()
-        else:
-            # Otherwise update the area entry based on all the cells
-            area = area_query.first()
-
-            cell_extremes = numpy.array([
-                (numpy.nan if cell.max_lat is None else cell.max_lat,
-                 numpy.nan if cell.max_lon is None else cell.max_lon)
-                for cell in cells] + [
-                (numpy.nan if cell.min_lat is None else cell.min_lat,
-                 numpy.nan if cell.min_lon is None else cell.min_lon)
-                for cell in cells
-            ], dtype=numpy.double)
-
-            max_lat, max_lon = numpy.nanmax(cell_extremes, axis=0)
-            min_lat, min_lon = numpy.nanmin(cell_extremes, axis=0)
-
-            ctr_lat, ctr_lon = centroid(
-                numpy.array([(c.lat, c.lon) for c in cells],
-                            dtype=numpy.double))
-            radius = circle_radius(
-                ctr_lat, ctr_lon, max_lat, max_lon, min_lat, min_lon)
-
-            cell_radii = numpy.array([
-                (numpy.nan if cell.radius is None else cell.radius)
-                for cell in cells
-            ], dtype=numpy.int32)
-            avg_cell_radius = int(round(numpy.nanmean(cell_radii)))
-            num_cells = len(cells)
-            region = self.region(ctr_lat, ctr_lon, mcc, cells)
-
-            if area is None:
-                stmt = self.area_model.__table__.insert(
-                    mysql_on_duplicate='num_cells = num_cells'  # no-op
-                ).values(
-                    areaid=areaid,
-                    radio=radio,
-                    mcc=mcc,
-                    mnc=mnc,
-                    lac=lac,
-                    created=self.utcnow,
-                    modified=self.utcnow,
-                    lat=ctr_lat,
-                    lon=ctr_lon,
-                    radius=radius,
-                    region=region,
-                    avg_cell_radius=avg_cell_radius,
-                    num_cells=num_cells,
-                )
-                self.session.execute(stmt)
+        num_cells = aggregate.num_cells
+        ctr_lat = aggregate.sum_lat / num_cells
+        ctr_lon = aggregate.sum_lon / num_cells
+        radius = circle_radius(
+            ctr_lat, ctr_lon,
+            aggregate.max_lat, aggregate.max_lon,
+            aggregate.min_lat, aggregate.min_lon)
+
+        avg_cell_radius = None
+        if aggregate.num_radius > 0:
+            avg_cell_radius = int(round(
+                float(aggregate.sum_radius) / aggregate.num_radius))
+
+        return {
+            'areaid': areaid,
+            'radio': radio,
+            'mcc': mcc,
+            'mnc': mnc,
+            'lac': lac,
+            'created': self.utcnow,
+            'modified': self.utcnow,
+            'lat': ctr_lat,
+            'lon': ctr_lon,
+            'radius': radius,
+            'region': self.region(ctr_lat, ctr_lon, mcc, aggregate.regions),
+            'avg_cell_radius': avg_cell_radius,
+            'num_cells': num_cells,
+        }
+
+    def write_areas(self, areaids, aggregates):
+        """
+        Write all areas in multi-row upserts and delete the areas without
+        any remaining cells in a single statement.
+        """
+        removed = []
+        rows = []
+        for areaid in areaids:
+            aggregate = aggregates[areaid]
+            if aggregate.num_cells <= 0:
+                removed.append(areaid)
             else:
-                area.modified = self.utcnow
-                area.lat = ctr_lat
-                area.lon = ctr_lon
-                area.radius = radius
-                area.region = region
-                area.avg_cell_radius = avg_cell_radius
-                area.num_cells = num_cells
+                rows.append(self.area_values(areaid, aggregate))
+
+        if removed:
+            (self.session.query(self.area_model)
+                         .filter(self.area_model.areaid.in_(removed))
+                         .delete(synchronize_session=False))
+
+        # keep the creation date of existing areas
+        upsert_rows(self.session, self.area_model, rows,
+                    batch=self.scan_batch, on_duplicate=', '.join([
+                        '`%s` = values(`%s`)' % (name, name)
+                        for name in AREA_UPDATE_FIELDS]))
+
+
+class CellAreaRepair(CellAreaUpdater):
+    """
+    Drop the aggregates of a batch of existing areas and queue the
+    areas, so the area update rescans their cells, correcting any
+    drift, like bounds which should have shrunk. Each run continues
+    after the last area of the previous run and starts over once all
+    areas have been repaired.
+
+    The areas and aggregates are only ever written by the consumer of
+    the area update queue, so the repair doesn't race with it.
+    """
+
+    def cursor_key(self):
+        """Returns the Redis key storing the last repaired area id."""
+        return ('%s_repair:cursor' % self.area_model.__tablename__).encode(
+            'ascii')
+
+    def __call__(self, batch=10000):
+        cursor = self.redis_client.get(self.cursor_key())
+        query = (self.session.query(self.area_model.areaid)
+                             .order_by(self.area_model.areaid))
+        if cursor:
+            query = query.filter(self.area_model.areaid > cursor)
+        areaids = [encode_cellarea(*row.areaid)
+                   for row in query.limit(batch).all()]
+
+        queue = self.task.app.data_queues[self.queue_name]
+        with redis_pipeline(self.redis_client) as pipe:
+            self.aggregates.remove(pipe, areaids)
+            queue.enqueue(areaids, pipe=pipe, json=False)
+
+        if len(areaids) < batch:
+            self.redis_client.delete(self.cursor_key())
+        else:
+            self.redis_client.set(self.cursor_key(), areaids[-1])
+        return len(areaids)
 
 
 class CellAreaOCIDUpdater(CellAreaUpdater):
@@ -154,3 +473,4 @@ class CellAreaOCIDUpdater(CellAreaUpdater):
     area_model = CellAreaOCID
     cell_model = CellOCID
     queue_name = 'update_cellarea_ocid'
+    incremental = False
@@ -1,4 +1,28 @@
-# common base class for all data related task implementations
+# common helpers and base class for all data related task implementations
+
+
+def upsert_rows(session, model, rows, batch=500, on_duplicate=None):
+    """
+    Write the rows in multi-row ``INSERT ... ON DUPLICATE KEY
+    UPDATE`` statements of at most `batch` rows each. All rows need to
+    have the same keys.
+
+    :param on_duplicate: The update clause used for existing rows.
+                         Defaults to updating all non-primary key columns
+                         present in the rows with the new values.
+    """
+    if not rows:
+        return
+    if on_duplicate is None:
+        primary_keys = set(
+            [col.name for col in model.__table__.primary_key.columns])
+        on_duplicate = ', '.join([
+            '`%s` = values(`%s`)' % (name, name)
+            for name in sorted(rows[0].keys()) if name not in primary_keys])
+
+    stmt = model.__table__.insert(mysql_on_duplicate=on_duplicate)
+    for i in range(0, len(rows), batch):
+        session.execute(stmt.values(rows[i:i + batch]))
 
 
 class DataTask(object):
@@ -20,7 +20,6 @@ class DataMapUpdater(DataTask):
         queue = self.task.app.data_queues['update_datamap_' + self.shard_id]
         today = util.utcnow().date()
         grids = queue.dequeue(batch=batch, json=False)
-        grids = list(set(grids))
         if not grids or not self.shard:
             return 0
 
@@ -61,10 +60,4 @@ class DataMapUpdater(DataTask):
             # do a batch update of grids
             self.session.bulk_update_mappings(self.shard, update_values)
 
-        if queue.enough_data(batch=batch):
-            self.task.apply_async(
-                kwargs={'batch': batch, 'shard_id': self.shard_id},
-                countdown=2,
-                expires=10)
-
         return len(grids)
@@ -8,6 +8,7 @@ import simplejson
 from six.moves.urllib.parse import urlparse
 
 from ichnaea.data.base import DataTask
+from ichnaea.queue import enqueue_reports
 from ichnaea import util
 
 MetadataGroup = namedtuple('MetadataGroup', 'api_key email ip nickname')
@@ -59,21 +60,13 @@ class ExportQueue(DataTask):
         self.nickname = nickname
         self.export_queues = task.app.export_queues
 
-    def __call__(self, reports):
-        metadata = {
-            'api_key': self.api_key,
-            'email': self.email,
-            'ip': self.ip,
-            'nickname': self.nickname,
-        }
-        items = []
-        for report in reports:
-            items.append({'report': report, 'metadata': metadata})
-        if items:
-            for name, queue in self.export_queues.items():
-                if queue.export_allowed(self.api_key):
-                    queue_key = queue.queue_key(self.api_key)
-                    queue.enqueue(items, queue_key, pipe=self.pipe)
+    def __call__(self, reports):  # BBB
+        enqueue_reports(
+            self.export_queues, reports, self.pipe,
+            api_key=self.api_key,
+            email=self.email,
+            ip=self.ip,
+            nickname=self.nickname)
 
 
 class ReportExporter(DataTask):
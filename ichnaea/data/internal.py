@@ -148,7 +148,10 @@ class InternalUploader(ReportUploader):
         groups = defaultdict(list)
         for item in simplejson.loads(data):
             group = MetadataGroup(**item['metadata'])
-            report = self._format_report(item['report'])
+            # use the validated and trusted report if there is one
+            report = item.get('internal')
+            if not report:
+                report = self._format_report(item['report'])
             if report:
                 groups[group].append(report)
 
@@ -118,8 +118,42 @@ class QueueSize(object):
         self.stats_client = task.stats_client
 
     def __call__(self):
+        data_queues = dict([(queue.monitor_name, queue)
+                            for queue in self.task.app.data_queues.values()])
         result = {}
         for name in self.task.app.all_queues:
-            result[name] = value = self.redis_client.llen(name)
+            data_queue = data_queues.get(name)
+            if data_queue is not None:
+                value = data_queue.size()
+            else:
+                value = self.redis_client.llen(name)
+            result[name] = value
             self.stats_client.gauge('queue', value, tags=['queue:' + name])
         return result
+
+
+class QueueSweeper(object):
+    """
+    Move items of all reliable data queues, which were claimed but never
+    acknowledged by a consumer, back into their queues or into their
+    dead-letter lists.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.stats_client = task.stats_client
+
+    def __call__(self):
+        result = {}
+        for name, data_queue in self.task.app.data_queues.items():
+            if not data_queue.reliable:
+                continue
+            result[name], dead = data_queue.reclaim()
+            if result[name]:
+                self.stats_client.incr(
+                    'data.queue.reclaim', result[name],
+                    tags=['queue:' + name])
+            if dead:
+                self.stats_client.incr(
+                    'data.queue.dead', dead, tags=['queue:' + name])
+        return result
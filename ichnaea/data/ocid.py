@@ -9,9 +9,11 @@ import boto
 import requests
 from sqlalchemy.sql import text
 
+from ichnaea.data.area import AreaAggregates
 from ichnaea import geocalc
 from ichnaea.models import (
     encode_cellarea,
+    CellArea,
     CellOCID,
     CellShard,
     Radio,
@@ -162,6 +164,7 @@ class ImportBase(object):
             self.cell_model = CellShard
             self.area_queue = task.app.data_queues['update_cellarea']
             self.stat_key = StatKey.unique_cell
+            self.station_filters = task.app.station_filters
 
     @staticmethod
     def make_import_dict(validate, import_spec, row):
@@ -232,6 +235,14 @@ class ImportBase(object):
                 changed_rows = count - len(shard_rows)
                 assert inserted_rows + changed_rows == len(shard_rows)
                 all_inserted_rows += inserted_rows
+
+                if self.cell_type == 'cell':
+                    # remember the cells in the known station filter
+                    station_filter = self.station_filters.get(
+                        'cell_%s' % shard_id)
+                    if station_filter is not None:
+                        station_filter.add(
+                            [row['cellid'] for row in shard_rows], pipe=pipe)
             StatCounter(self.stat_key, today).incr(pipe, all_inserted_rows)
 
         areaids = set()
@@ -268,8 +279,12 @@ class ImportBase(object):
                 if rows:
                     commit_batch(rows)
 
-        self.area_queue.enqueue(
-            [encode_cellarea(*id_) for id_ in areaids], json=False)
+        areaids = [encode_cellarea(*id_) for id_ in areaids]
+        if self.cell_type == 'cell':
+            # the imported cells bypass the running area aggregates
+            AreaAggregates(CellArea, self.task.redis_client).remove(
+                pipe, areaids)
+        self.area_queue.enqueue(areaids, pipe=pipe, json=False)
 
 
 class ImportExternal(ImportBase):
@@ -2,19 +2,88 @@ from collections import defaultdict
 
 from ichnaea.data.base import DataTask
 from ichnaea.models import (
+    CellAggregate,
     CellObservation,
     CellReport,
     CellShard,
     DataMap,
     Report,
-    Score,
+    ScoreCounter,
     ScoreKey,
     User,
+    WifiAggregate,
     WifiObservation,
     WifiReport,
     WifiShard,
 )
 from ichnaea.models.content import encode_datamap_grid
+from ichnaea import util
+
+
+OBSERVATION_TYPES = (
+    ('cell', CellReport, CellObservation),
+    ('wifi', WifiReport, WifiObservation),
+)
+
+
+def validate_report(data):
+    """
+    Validate a report in the internal format.
+
+    Returns a three-tuple of the validated
+    :class:`~ichnaea.models.Report` or None for malformed reports,
+    a dict of lists of validated cell and wifi reports and a dict
+    of the number of malformed cell and wifi entries.
+    """
+    malformed = {'cell': 0, 'wifi': 0}
+    items = {'cell': [], 'wifi': []}
+
+    report = Report.create(**data)
+    if report is None:
+        return (None, items, malformed)
+
+    for name, report_cls, obs_cls in OBSERVATION_TYPES:
+        for item in data.get(name) or ():
+            # validate the cell/wifi specific fields
+            item_report = report_cls.create(**item)
+            if item_report is None:
+                malformed[name] += 1
+                continue
+            items[name].append(item_report)
+
+    return (report, items, malformed)
+
+
+def trusted_report(data):
+    """
+    Validate a report in the internal format and return it in the
+    trusted internal format, which is accepted by the
+    :class:`ReportQueue` without another validation. Returns None
+    for malformed reports.
+    """
+    report, items, malformed = validate_report(data)
+    if report is None:
+        return None
+
+    result = report._to_json_value()
+    result['trusted'] = True
+    result['malformed'] = malformed
+    for name in ('cell', 'wifi'):
+        result[name] = [item._to_json_value() for item in items[name]]
+    return result
+
+
+def load_trusted_report(data):
+    """
+    Load a report in the trusted internal format, returning the same
+    three-tuple as :func:`validate_report`.
+    """
+    report = Report(**data)
+    items = {}
+    for name, report_cls, obs_cls in OBSERVATION_TYPES:
+        items[name] = [report_cls._from_json_value(dict(item))
+                       for item in data.get(name, ())]
+    return (report, items, data['malformed'])
 
 
 class ReportQueue(DataTask):
@@ -28,6 +97,7 @@ class ReportQueue(DataTask):
         self.ip = ip
         self.nickname = nickname
         self.data_queues = self.task.app.data_queues
+        self.station_filters = self.task.app.station_filters
 
     def __call__(self, reports):
         userid = self.process_user(self.nickname, self.email)
@@ -74,16 +144,60 @@ class ReportQueue(DataTask):
 
         shards = defaultdict(list)
         for key in unknown_keys:
-            shards[model.shard_model(key)].append(key)
-
-        for shard, keys in shards.items():
+            shards[model.shard_id(key)].append(key)
+
+        filter_stats = defaultdict(int)
+        for shard_id, keys in shards.items():
+            station_filter = self.station_filters.get(
+                '%s_%s' % (name, shard_id))
+            use_filter = station_filter is not None and station_filter.ready()
+            if use_filter:
+                # only query for stations which might be known
+                found = station_filter.contains(keys)
+                keys = [key for key, known in zip(keys, found) if known]
+                filter_stats['miss'] += len(found) - len(keys)
+                if not keys:
+                    continue
+
+            shard = model.shards()[shard_id]
             key_column = getattr(shard, key_id)
             query = (self.session.query(key_column)
                                  .filter(key_column.in_(keys)))
-            unknown_keys -= set([getattr(r, key_id) for r in query.all()])
+            known_keys = set([getattr(r, key_id) for r in query.all()])
+            unknown_keys -= known_keys
+
+            if use_filter:
+                filter_stats['hit'] += len(known_keys)
+                filter_stats['false_positive'] += len(keys) - len(known_keys)
+
+        for result, count in filter_stats.items():
+            if count > 0:
+                self.stats_client.incr(
+                    'data.station.filter', count,
+                    tags=['type:%s' % name, 'result:%s' % result])
 
         return len(unknown_keys)
 
+    def aggregate_observations(self, name, observations):
+        """
+        Combine all observations of the same station across the
+        entire batch of reports into one aggregate per station.
+        """
+        if name == 'cell':
+            aggregate_cls = CellAggregate
+        elif name == 'wifi':
+            aggregate_cls = WifiAggregate
+
+        aggregates = {}
+        for obs in observations:
+            key = obs.unique_key
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregates[key] = aggregate_cls.from_observation(obs)
+            else:
+                aggregate.add(obs)
+        return aggregates
+
     def process_reports(self, reports, userid=None):
         malformed_reports = 0
         positions = set()
@@ -111,14 +225,11 @@ class ReportQueue(DataTask):
 
         # group by unique station key
         for name in ('cell', 'wifi'):
-            station_keys = set()
-            for obs in observations[name]:
-                if name == 'cell':
-                    station_keys.add(obs.cellid)
-                elif name == 'wifi':
-                    station_keys.add(obs.mac)
+            aggregates = self.aggregate_observations(name, observations[name])
+            observations[name] = list(aggregates.values())
             # determine scores for stations
-            new_station_count[name] += self.new_stations(name, station_keys)
+            new_station_count[name] += self.new_stations(
+                name, set(aggregates.keys()))
 
         if observations['cell']:
             sharded_obs = defaultdict(list)
@@ -147,37 +258,30 @@ class ReportQueue(DataTask):
         )
 
     def process_report(self, data):
-        malformed = {'cell': 0, 'wifi': 0}
-        observations = {'cell': {}, 'wifi': {}}
-
-        report = Report.create(**data)
+        if data.get('trusted'):
+            # the report was already validated by the web frontend
+            report, items, malformed = load_trusted_report(data)
+        else:
+            report, items, malformed = validate_report(data)
         if report is None:
             return (None, None, malformed)
 
-        for name, report_cls, obs_cls in (
-                ('cell', CellReport, CellObservation),
-                ('wifi', WifiReport, WifiObservation)):
+        observations = {}
+        for name, report_cls, obs_cls in OBSERVATION_TYPES:
             observations[name] = {}
 
-            if data.get(name):
-                for item in data[name]:
-                    # validate the cell/wifi specific fields
-                    item_report = report_cls.create(**item)
-                    if item_report is None:
-                        malformed[name] += 1
-                        continue
-
-                    # combine general and specific report data into one
-                    item_obs = obs_cls.combine(report, item_report)
-                    item_key = item_obs.unique_key
+            for item_report in items[name]:
+                # combine general and specific report data into one
+                item_obs = obs_cls.combine(report, item_report)
+                item_key = item_obs.unique_key
 
-                    # if we have better data for the same key, ignore
-                    existing = observations[name].get(item_key)
-                    if existing is not None:
-                        if existing.better(item_obs):
-                            continue
+                # if we have better data for the same key, ignore
+                existing = observations[name].get(item_key)
+                if existing is not None:
+                    if existing.better(item_obs):
+                        continue
 
-                    observations[name][item_key] = item_obs
+                observations[name][item_key] = item_obs
 
         return (
             observations['cell'].values(),
@@ -207,27 +311,13 @@ class ReportQueue(DataTask):
         if userid is None or len(positions) <= 0:
             return
 
-        queue = self.task.app.data_queues['update_score']
-        scores = []
-
-        key = Score.to_hashkey(
-            userid=userid,
-            key=ScoreKey.location,
-            time=None)
-        scores.append({'hashkey': key, 'value': len(positions)})
-
+        counter = ScoreCounter(util.utcnow().date())
+        counter.incr(self.pipe, userid, ScoreKey.location, len(positions))
         for name, score_key in (('cell', ScoreKey.new_cell),
                                 ('wifi', ScoreKey.new_wifi)):
             count = new_station_count[name]
-            if count <= 0:
-                continue
-            key = Score.to_hashkey(
-                userid=userid,
-                key=score_key,
-                time=None)
-            scores.append({'hashkey': key, 'value': count})
-
-        queue.enqueue(scores)
+            if count > 0:
+                counter.incr(self.pipe, userid, score_key, count)
 
     def process_user(self, nickname, email):
         userid = None
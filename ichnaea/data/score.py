@@ -1,53 +1,130 @@
 from collections import defaultdict
+from datetime import timedelta
 
-from sqlalchemy.orm import load_only
+from sqlalchemy import func
 
-from ichnaea.data.base import DataTask
+from ichnaea.data.base import (
+    DataTask,
+    upsert_rows,
+)
+from ichnaea.leaderboard import (
+    Leaderboard,
+    WEEKLY_DAYS,
+)
+from ichnaea.lease import LeaseLost
 from ichnaea.models.content import (
     Score,
+    ScoreCounter,
+    ScoreKey,
+    SCORE_ROLLUP_DAY,
 )
 from ichnaea import util
 
 
 class ScoreUpdater(DataTask):
 
-    def __init__(self, task, session, pipe):
+    def __init__(self, task, session, pipe, lease=None):
         DataTask.__init__(self, task, session)
         self.pipe = pipe
-        self.queue = self.task.app.data_queues['update_score']
+        self.lease = lease
+        self.queue = self.task.app.data_queues['update_score']  # BBB
         self.today = util.utcnow().date()
 
     def __call__(self, batch=1000):
         score_values = defaultdict(int)
+
+        # BBB: scores queued one by one, before the score counters
         for score in self.queue.dequeue(batch=batch):
             key = score['hashkey']
-            if key.time is None:
-                key.time = self.today
-            score_values[key] += score['value']
-
-        score_iter = Score.iterkeys(
-            self.session, list(score_values.keys()),
-            extra=lambda query: query.options(load_only('value', )))
-
-        scores = {}
-        for score in score_iter:
-            scores[score.hashkey()] = score
-
-        for key, value in score_values.items():
-            score = scores.get(key, None)
-            value = int(value)
-            if score is not None:
-                score.value += value
-            else:
-                stmt = Score.__table__.insert(
-                    mysql_on_duplicate='value = value + %s' % value
-                ).values(value=value, **key.__dict__)
-                self.session.execute(stmt)
-
-        if self.queue.enough_data(batch=batch):
-            self.task.apply_async(
-                kwargs={'batch': batch},
-                countdown=2,
-                expires=10)
-
-        return len(scores)
+            score_values[(key.userid, key.key, key.time or self.today)] += (
+                score['value'])
+
+        # include yesterday's increments, which arrived after the
+        # last run of the day
+        for day in (self.today - timedelta(days=1), self.today):
+            counter = ScoreCounter(day)
+            for (userid, score_key), value in counter.swap(
+                    self.redis_client).items():
+                score_values[(userid, score_key, day)] += value
+            # the pipeline is only executed after the database commit
+            counter.remove(self.pipe)
+
+        # write the rows in primary key order
+        rows = [{'key': score_key, 'userid': userid,
+                 'time': day, 'value': int(value)}
+                for (userid, score_key, day), value in sorted(
+                    score_values.items(),
+                    key=lambda item: (item[0][1], item[0][0], item[0][2]))
+                if value]
+
+        if self.lease is not None and not self.lease.renew():
+            # another task might be applying the same counters by now,
+            # roll back and leave them to be returned by the next swap
+            raise LeaseLost(self.lease.name)
+
+        upsert_rows(self.session, Score, rows,
+                    on_duplicate='`value` = `value` + values(`value`)')
+
+        # the pipeline is only executed after the database commit
+        leaderboard = Leaderboard(self.redis_client)
+        for row in rows:
+            leaderboard.add(self.pipe, row['userid'], row['key'],
+                            row['time'], row['value'])
+        return len(rows)
+
+
+class LeaderboardBuilder(DataTask):
+    """
+    Build the leaderboard from the score table and mark it as ready.
+    This also corrects any drift between the two.
+    """
+
+    def __call__(self):
+        today = util.utcnow().date()
+        first_day = today - timedelta(days=WEEKLY_DAYS - 1)
+
+        totals = dict([(score_key, {}) for score_key in ScoreKey])
+        rows = (self.session.query(Score.key, Score.userid,
+                                   func.sum(Score.value))
+                            .group_by(Score.key, Score.userid)).all()
+        for score_key, userid, value in rows:
+            totals[score_key][userid] = int(value)
+
+        day_totals = defaultdict(dict)
+        rows = (self.session.query(Score.key, Score.userid,
+                                   Score.time, Score.value)
+                            .filter(Score.time >= first_day)
+                            .filter(Score.time <= today)).all()
+        for score_key, userid, day, value in rows:
+            day_totals[(score_key, day)][userid] = int(value)
+
+        Leaderboard(self.redis_client).replace(totals, day_totals)
+        return len(rows)
+
+
+class ScoreRollup(DataTask):
+    """
+    Roll up the daily scores of the oldest day before `days` days ago
+    into a single row per user and score key, dated
+    :data:`ichnaea.models.SCORE_ROLLUP_DAY`.
+
+    Only a single day is rolled up at a time, to keep the transactions
+    short while the score updates keep writing to the same table.
+    """
+
+    def __call__(self, days=30):
+        before = util.utcnow().date() - timedelta(days=days)
+        day = (self.session.query(func.min(Score.time))
+                           .filter(Score.time < before)
+                           .filter(Score.time > SCORE_ROLLUP_DAY)).scalar()
+        if day is None:
+            return 0
+
+        query = self.session.query(Score).filter(Score.time == day)
+        rows = query.with_entities(Score.key, Score.userid, Score.value).all()
+        upsert_rows(self.session, Score, [
+            {'key': score_key, 'userid': userid,
+             'time': SCORE_ROLLUP_DAY, 'value': int(value)}
+            for score_key, userid, value in rows],
+            on_duplicate='`value` = `value` + values(`value`)')
+        return query.delete(synchronize_session=False)
@@ -2,18 +2,28 @@ from collections import defaultdict
 
 import numpy
 
-from ichnaea.data.base import DataTask
-from ichnaea.geocalc import (
-    centroid,
-    circle_radius,
-    distance,
+from ichnaea.data.area import (
+    AREA_CELL_FIELDS,
+    AreaAggregate,
+    AreaAggregates,
 )
+from ichnaea.data.base import (
+    DataTask,
+    upsert_rows,
+)
+from ichnaea.geocalc import circle_radius
 from ichnaea.geocode import GEOCODER
+from ichnaea.lease import LeaseLost
 from ichnaea.models import (
+    CellArea,
+    CellShard,
     decode_cellid,
     encode_cellarea,
+    ObservationAggregate,
+    RegionStatCounter,
     StatCounter,
     StatKey,
+    WifiShard,
 )
 from ichnaea.models.constants import (
     CELL_MAX_RADIUS,
@@ -22,6 +32,24 @@ from ichnaea.models.constants import (
 from ichnaea import util
 
 
+EARTH_RADIUS = 6371.0  #: Earth radius in km, as in ichnaea.geocalc.
+
+
+def _box_distances(boxes):
+    """
+    Return an array of the diagonal distances in meters of an array of
+    (max_lat, max_lon, min_lat, min_lon) bounding boxes, using the same
+    haversine calculation as :func:`ichnaea.geocalc.distance`.
+    """
+    lats = numpy.radians(boxes[:, 0::2])
+    half_deltas = numpy.radians(boxes[:, 0:2] - boxes[:, 2:4]) / 2.0
+    a = (numpy.sin(half_deltas[:, 0]) ** 2 +
+         numpy.cos(lats[:, 1]) * numpy.cos(lats[:, 0]) *
+         numpy.sin(half_deltas[:, 1]) ** 2)
+    c = numpy.arcsin(numpy.fmin(1.0, numpy.sqrt(a)))
+    return 1000 * 2 * EARTH_RADIUS * c
+
+
 class StationUpdater(DataTask):
 
     MAX_OLD_OBSERVATIONS = 1000
@@ -29,20 +57,28 @@ class StationUpdater(DataTask):
     station_type = None
     stat_obs_key = None
     stat_station_key = None
+    stat_region_key = None  #: The stations per region counter, if any.
 
-    def __init__(self, task, session, pipe, shard_id=None):
+    def __init__(self, task, session, pipe, shard_id=None, lease=None):
         super(StationUpdater, self).__init__(task, session)
         self.pipe = pipe
         self.shard_id = shard_id
-        self.updated_areas = set()
+        self.lease = lease
+        self.updated_areas = {}
+        self.updated_regions = defaultdict(int)
         self.utcnow = util.utcnow()
         self.today = self.utcnow.date()
         self.data_queues = self.task.app.data_queues
         self.data_queue = None
+        self.station_filter = None
+        settings = self.task.app.settings.get('station_update', {})
+        self.upsert_batch = int(settings.get('upsert_batch', 500))
         if shard_id:
             # BBB, remove if check
             queue_name = self.queue_prefix + shard_id
             self.data_queue = self.data_queues[queue_name]
+            self.station_filter = self.task.app.station_filters.get(
+                '%s_%s' % (self.station_type, shard_id))
 
     def stat_count(self, action, count, reason=None):
         if count > 0:
@@ -54,18 +90,36 @@ class StationUpdater(DataTask):
                 count,
                 tags=tags)
 
-    def add_area_update(self, key):
+    def add_area_update(self, key, shard_station, values):
         pass
 
     def queue_area_updates(self):  # pragma: no cover
         pass
 
+    def add_region_update(self, shard_station, values):
+        if self.stat_region_key is None:
+            return
+        old_region = None
+        if shard_station is not None:
+            old_region = shard_station.region
+        new_region = values.get('region')
+        if old_region != new_region:
+            if old_region:
+                self.updated_regions[old_region] -= 1
+            if new_region:
+                self.updated_regions[new_region] += 1
+
     def emit_stats(self, stats_counter, drop_counter):
         day = self.today
         StatCounter(self.stat_obs_key, day).incr(
             self.pipe, stats_counter['obs'])
         StatCounter(self.stat_station_key, day).incr(
             self.pipe, stats_counter['new_station'])
+        if self.updated_regions:
+            region_counter = RegionStatCounter(self.stat_region_key)
+            for region, amount in self.updated_regions.items():
+                if amount:
+                    region_counter.incr(self.pipe, region, amount)
 
         self.stat_count('insert', stats_counter['obs'])
         for reason, count in drop_counter.items():
@@ -81,10 +135,113 @@ class StationUpdater(DataTask):
     def _base_station_values(self, station_key, observations):
         raise NotImplementedError()
 
-    def station_values(self, station_key, shard_station, observations):
+    def _observation_count(self, observations):
+        count = 0
+        for obs in observations:
+            if isinstance(obs, ObservationAggregate):
+                count += obs.samples
+            else:
+                count += 1
+        return count
+
+    def _observation_summaries(self, observation_lists):
+        """
+        Return a list of five-tuples, one for each list of observations.
+        Each tuple contains the number of observations, the centroid
+        latitude and longitude of all observations, a bounding box
+        tuple of (max_lat, max_lon, min_lat, min_lon) and the diagonal
+        distance of the bounding box in meters.
+
+        Observations can be a mix of single observations and
+        observation aggregates. The values for all lists are
+        calculated at once via grouped NumPy reductions.
+        """
+        # one row of (samples, lat sum, lon sum) per observation
+        sums = []
+        positions = []
+        sum_starts = []
+        position_starts = []
+        for observations in observation_lists:
+            sum_starts.append(len(sums))
+            position_starts.append(len(positions))
+            for obs in observations:
+                if isinstance(obs, ObservationAggregate):
+                    sums.append((obs.samples, obs.lat_sum, obs.lon_sum))
+                    positions.append((obs.max_lat, obs.max_lon))
+                    positions.append((obs.min_lat, obs.min_lon))
+                else:
+                    sums.append((1, obs.lat, obs.lon))
+                    positions.append((obs.lat, obs.lon))
+
+        if not sum_starts:
+            return []
+
+        sums = numpy.add.reduceat(
+            numpy.array(sums, dtype=numpy.double),
+            numpy.array(sum_starts, dtype=numpy.intp), axis=0)
+        centers = sums[:, 1:3] / sums[:, 0:1]
+
+        positions = numpy.array(positions, dtype=numpy.double)
+        position_starts = numpy.array(position_starts, dtype=numpy.intp)
+        boxes = numpy.hstack((
+            numpy.fmax.reduceat(positions, position_starts, axis=0),
+            numpy.fmin.reduceat(positions, position_starts, axis=0)))
+        box_dists = _box_distances(boxes)
+
+        return [(int(count), float(lat), float(lon),
+                 tuple(box), float(box_dist))
+                for count, (lat, lon), box, box_dist in zip(
+                    sums[:, 0], centers, boxes, box_dists)]
+
+    def _station_boxes(self, obs_bboxes, shard_stations):
+        """
+        Return a list of two-tuples of a bounding box tuple and its
+        diagonal distance in meters, extending each observation bounding
+        box by the position and box of the existing shard station.
+        For missing shard stations the entry is None.
+        """
+        if not obs_bboxes:
+            return []
+
+        station_positions = []
+        for station in shard_stations:
+            values = (None, ) * 6
+            if station is not None:
+                values = (station.lat, station.lon,
+                          station.max_lat, station.max_lon,
+                          station.min_lat, station.min_lon)
+            station_positions.append(
+                [numpy.nan if value is None else value for value in values])
+
+        station_positions = numpy.array(
+            station_positions, dtype=numpy.double).reshape(-1, 3, 2)
+        obs_positions = numpy.array(obs_bboxes, dtype=numpy.double)
+        boxes = numpy.hstack((
+            numpy.fmax(obs_positions[:, 0:2],
+                       numpy.fmax.reduce(station_positions, axis=1)),
+            numpy.fmin(obs_positions[:, 2:4],
+                       numpy.fmin.reduce(station_positions, axis=1))))
+        box_dists = _box_distances(boxes)
+
+        result = []
+        for station, box, box_dist in zip(shard_stations, boxes, box_dists):
+            if station is None:
+                result.append(None)
+            else:
+                result.append((tuple(box), float(box_dist)))
+        return result
+
+    def station_values(self, station_key, shard_station, observations,
+                       obs_summary, station_box):
         """
         Return two-tuple of status, value dict where status is one of:
         `new`, `new_moving`, `moving`, `changed`.
+
+        The observations can contain both single observations and
+        pre-aggregated :class:`ichnaea.models.ObservationAggregate`
+        instances. The `obs_summary` is the five-tuple returned by
+        :meth:`_observation_summaries` for the observations and the
+        `station_box` the matching result of :meth:`_station_boxes`.
         """
         # cases:
         # we always get a station key and observations
@@ -99,15 +256,9 @@ class StationUpdater(DataTask):
         created = self.utcnow
         values = self._base_station_values(station_key, observations)
 
-        obs_length = len(observations)
-        obs_positions = numpy.array(
-            [(obs.lat, obs.lon) for obs in observations],
-            dtype=numpy.double)
-        obs_new_lat, obs_new_lon = centroid(obs_positions)
-        obs_max_lat, obs_max_lon = numpy.nanmax(obs_positions, axis=0)
-        obs_min_lat, obs_min_lon = numpy.nanmin(obs_positions, axis=0)
-        obs_box_dist = distance(obs_min_lat, obs_min_lon,
-                                obs_max_lat, obs_max_lon)
+        (obs_length, obs_new_lat, obs_new_lon,
+         obs_bbox, obs_box_dist) = obs_summary
+        obs_max_lat, obs_max_lon, obs_min_lat, obs_min_lon = obs_bbox
 
         if obs_box_dist > self.max_dist_meters:
             # the new observations are already too far apart
@@ -159,23 +310,8 @@ class StationUpdater(DataTask):
             return ('new', values)
         else:
             # shard_station + new observations
-            positions = numpy.append(obs_positions, [
-                (numpy.nan if shard_station.lat is None
-                    else shard_station.lat,
-                 numpy.nan if shard_station.lon is None
-                    else shard_station.lon),
-                (numpy.nan if shard_station.max_lat is None
-                    else shard_station.max_lat,
-                 numpy.nan if shard_station.max_lon is None
-                    else shard_station.max_lon),
-                (numpy.nan if shard_station.min_lat is None
-                    else shard_station.min_lat,
-                 numpy.nan if shard_station.min_lon is None
-                    else shard_station.min_lon),
-            ], axis=0)
-            max_lat, max_lon = numpy.nanmax(positions, axis=0)
-            min_lat, min_lon = numpy.nanmin(positions, axis=0)
-            box_dist = distance(min_lat, min_lon, max_lat, max_lon)
+            station_bbox, box_dist = station_box
+            max_lat, max_lon, min_lat, min_lon = station_bbox
             if box_dist > self.max_dist_meters:
                 # shard_station + disagreeing observations
                 block_count = shard_station.block_count or 0
@@ -267,54 +403,85 @@ class StationUpdater(DataTask):
     def _update_shard(self, shard, shard_values,
                       drop_counter, stats_counter):
         new_data = defaultdict(list)
+        new_keys = []
         blocklist, stations = self._query_stations(shard, shard_values)
 
+        station_keys = []
         for station_key, observations in shard_values.items():
             if blocklist.get(station_key, False):
                 # Drop observations for blocklisted stations.
-                drop_counter['blocklisted'] += len(observations)
+                drop_counter['blocklisted'] += self._observation_count(
+                    observations)
                 continue
-
-            shard_station = stations.get(station_key, None)
+            station_keys.append(station_key)
+
+        # calculate the bounding boxes of all stations at once
+        shard_stations = [stations.get(key, None) for key in station_keys]
+        obs_summaries = self._observation_summaries(
+            [shard_values[key] for key in station_keys])
+        station_boxes = self._station_boxes(
+            [summary[3] for summary in obs_summaries], shard_stations)
+
+        for station_key, shard_station, obs_summary, station_box in zip(
+                station_keys, shard_stations, obs_summaries, station_boxes):
+            observations = shard_values[station_key]
             if shard_station is None:
                 # We discovered an actual new never before seen station.
                 stats_counter['new_station'] += 1
 
             status, result = self.station_values(
-                station_key, shard_station, observations)
+                station_key, shard_station, observations,
+                obs_summary, station_box)
             new_data[status].append(result)
+            if status in ('new', 'new_moving'):
+                new_keys.append(station_key)
 
             if status in ('moving', 'new_moving'):
                 stats_counter['block'] += 1
             else:
-                stats_counter['obs'] += len(observations)
+                stats_counter['obs'] += self._observation_count(
+                    observations)
 
-            # track potential updates to dependent areas
-            self.add_area_update(station_key)
+            # track potential updates to dependent areas and regions
+            self.add_area_update(station_key, shard_station, result)
+            self.add_region_update(shard_station, result)
+
+        if self.lease is not None and not self.lease.renew():
+            # another consumer might be updating the shard by now, roll
+            # back and leave the unacknowledged claim to be reclaimed
+            raise LeaseLost(self.lease.name)
 
         if new_data['new']:
             # do a batch insert of new stations
-            stmt = shard.__table__.insert(
-                mysql_on_duplicate='samples = samples'  # no-op
-            )
-            self.session.execute(stmt.values(new_data['new']))
+            upsert_rows(
+                self.session, shard, new_data['new'],
+                batch=self.upsert_batch,
+                on_duplicate='samples = samples')  # no-op
 
         if new_data['new_moving']:
             # do a batch insert of new moving stations
-            stmt = shard.__table__.insert(
-                mysql_on_duplicate='block_count = block_count'  # no-op
-            )
-            self.session.execute(stmt.values(new_data['new_moving']))
+            upsert_rows(
+                self.session, shard, new_data['new_moving'],
+                batch=self.upsert_batch,
+                on_duplicate='block_count = block_count')  # no-op
 
         if new_data['moving'] or new_data['changed']:
-            # do a batch update of changing and moving stations
-            self.session.bulk_update_mappings(
-                shard, new_data['changed'] + new_data['moving'])
+            # do a batch upsert of changing and moving stations,
+            # both use the exact same keys
+            upsert_rows(
+                self.session, shard,
+                new_data['changed'] + new_data['moving'],
+                batch=self.upsert_batch)
+
+        if new_keys and self.station_filter is not None:
+            # remember the new stations in the known station filter
+            self.station_filter.add(new_keys, pipe=self.pipe)
 
     def __call__(self, batch=10):
-        sharded_obs = self._shard_observations(
-            self.data_queue.dequeue(batch=batch))
+        claim_key, observations = self.data_queue.claim(batch=batch)
+        sharded_obs = self._shard_observations(observations)
         if not sharded_obs:
+            self.data_queue.ack(claim_key, pipe=self.pipe)
             return
 
         drop_counter = defaultdict(int)
@@ -329,11 +496,47 @@ class StationUpdater(DataTask):
 
         self.emit_stats(stats_counter, drop_counter)
 
-        if self.data_queue.enough_data(batch=batch):  # pragma: no cover
-            self.task.apply_async(
-                kwargs={'batch': batch, 'shard_id': self.shard_id},
-                countdown=2,
-                expires=10)
+        # the pipeline is only executed after the database commit
+        self.data_queue.ack(claim_key, pipe=self.pipe)
+
+
+class StationFilterBuilder(DataTask):
+    """
+    Populate the Bloom filter of known stations for one station shard
+    with all stations in the database and mark it as ready.
+    """
+
+    def __init__(self, task, session, station_type, shard_id):
+        super(StationFilterBuilder, self).__init__(task, session)
+        if station_type == 'cell':
+            self.shard = CellShard.shards()[shard_id]
+            self.key_column = self.shard.cellid
+        elif station_type == 'wifi':
+            self.shard = WifiShard.shards()[shard_id]
+            self.key_column = self.shard.mac
+        self.station_filter = self.task.app.station_filters[
+            '%s_%s' % (station_type, shard_id)]
+
+    def __call__(self, batch=10000):
+        if self.station_filter.ready():
+            return 0
+
+        total = 0
+        last_key = None
+        while True:
+            query = self.session.query(self.key_column)
+            if last_key is not None:
+                query = query.filter(self.key_column > last_key)
+            keys = [row[0] for row in
+                    query.order_by(self.key_column).limit(batch).all()]
+            if not keys:
+                break
+            self.station_filter.add(keys)
+            total += len(keys)
+            last_key = keys[-1]
+
+        self.station_filter.mark_ready()
+        return total
 
 
 class CellUpdater(StationUpdater):
@@ -355,12 +558,23 @@ class CellUpdater(StationUpdater):
             cell_queue = self.data_queues['update_cell_' + shard_id]
             cell_queue.enqueue(list(values), pipe=self.pipe)
 
-    def add_area_update(self, key):
-        self.updated_areas.add(encode_cellarea(*decode_cellid(key)[:4]))
+    def add_area_update(self, key, shard_station, values):
+        # record the change of the cell in the running area aggregates
+        areaid = encode_cellarea(*decode_cellid(key)[:4])
+        delta = self.updated_areas.get(areaid)
+        if delta is None:
+            delta = self.updated_areas[areaid] = AreaAggregate()
+        if shard_station is not None:
+            delta.add(dict([(field, getattr(shard_station, field))
+                            for field in AREA_CELL_FIELDS]), sign=-1)
+        delta.add(values)
 
     def queue_area_updates(self):
+        aggregates = AreaAggregates(CellArea, self.redis_client)
+        for areaid, delta in self.updated_areas.items():
+            aggregates.add_delta(self.pipe, areaid, delta)
         data_queue = self.data_queues['update_cellarea']
-        data_queue.enqueue(list(self.updated_areas),
+        data_queue.enqueue(list(self.updated_areas.keys()),
                            pipe=self.pipe, json=False)
 
     def _base_station_values(self, station_key, observations):
@@ -390,6 +604,7 @@ class WifiUpdater(StationUpdater):
     station_type = 'wifi'
     stat_obs_key = StatKey.wifi
     stat_station_key = StatKey.unique_wifi
+    stat_region_key = 'wifi'
 
     def _base_station_values(self, station_key, observations):
         return {
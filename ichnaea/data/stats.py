@@ -1,21 +1,31 @@
+from collections import defaultdict
 from datetime import timedelta
 
 from sqlalchemy import func
 
 from ichnaea.data.base import DataTask
+from ichnaea.lease import LeaseLost
 from ichnaea.models import (
     CellArea,
     RegionStat,
+    RegionStatCounter,
     Stat,
     StatCounter,
     StatKey,
     WifiShard,
 )
+from ichnaea.stats import (
+    StatsCache,
+    STATS_PAGES,
+)
 from ichnaea import util
 
 
 class StatCounterUpdater(DataTask):
 
+    #: The statistics pages showing the updated values.
+    stats_pages = ('stats', 'stats_cell_json', 'stats_wifi_json')
+
     def __init__(self, task, session, pipe):
         DataTask.__init__(self, task, session)
         self.pipe = pipe
@@ -59,8 +69,23 @@ class StatCounterUpdater(DataTask):
 
 
 class StatRegion(DataTask):
+    """
+    Update the number of cells and WiFi networks per region.
+
+    The cell numbers are summed up from the cell areas. The WiFi
+    numbers are updated from the changes tracked by the station
+    updaters, unless a full `recount` of all WiFi shards is requested.
+    """
 
-    def __call__(self):
+    #: The statistics pages showing the updated values.
+    stats_pages = ('stats_regions', )
+
+    def __init__(self, task, session, pipe, lease=None):
+        DataTask.__init__(self, task, session)
+        self.pipe = pipe
+        self.lease = lease
+
+    def __call__(self, recount=False):
         cells = (self.session.query(CellArea.region,
                                     CellArea.radio,
                                     func.sum(CellArea.num_cells))
@@ -74,21 +99,34 @@ class StatRegion(DataTask):
                 stats[region] = default.copy()
             stats[region][radio.name] = int(num)
 
-        for shard in WifiShard.shards().values():
-            wifis = (self.session.query(shard.region, func.count())
-                                 .filter(shard.region.isnot(None))
-                                 .group_by(shard.region)).all()
+        region_stats = dict(self.session.query(RegionStat.region,
+                                               RegionStat).all())
+
+        # the changes are removed after the database commit, a full
+        # recount already includes them
+        wifi_counter = RegionStatCounter('wifi')
+        wifi_changes = wifi_counter.swap(self.redis_client)
+        wifi_counter.remove(self.pipe)
 
-            for region, num in wifis:
+        if recount:
+            wifis = self.count_wifis()
+        else:
+            wifis = dict([(region, stat.wifi or 0)
+                          for region, stat in region_stats.items()])
+            for region, value in wifi_changes.items():
+                wifis[region] = max(wifis.get(region, 0) + value, 0)
+
+        for region, num in wifis.items():
+            if num > 0:
                 if region not in stats:
                     stats[region] = default.copy()
-                stats[region]['wifi'] += int(num)
+                stats[region]['wifi'] = num
 
-        if not stats:
-            return
+        if self.lease is not None and not self.lease.renew():
+            # another task might be applying the same changes by now,
+            # roll back and leave them to be returned by the next swap
+            raise LeaseLost(self.lease.name)
 
-        region_stats = dict(self.session.query(RegionStat.region,
-                                               RegionStat).all())
         for region, values in stats.items():
             if region in region_stats:
                 region_stats[region].gsm = values['gsm']
@@ -109,3 +147,49 @@ class StatRegion(DataTask):
             (self.session.query(RegionStat)
                          .filter(RegionStat.region.in_(obsolete_regions))
              ).delete(synchronize_session=False)
+
+    def count_wifis(self):
+        """
+        Count the WiFi networks per region in all shards, returning
+        a dict mapping regions to counts.
+        """
+        wifis = defaultdict(int)
+        for shard in WifiShard.shards().values():
+            rows = (self.session.query(shard.region, func.count())
+                                .filter(shard.region.isnot(None))
+                                .group_by(shard.region)).all()
+            for region, num in rows:
+                wifis[region] += int(num)
+        return wifis
+
+
+class StatsCacheRefresher(DataTask):
+    """
+    Recompute the stale data of the statistics pages, so the web
+    frontends can keep serving the cached data and never wait on the
+    aggregation queries, see :class:`ichnaea.stats.StatsCache`.
+
+    A lease ensures only a single task recomputes the data at a time.
+    """
+
+    def __init__(self, task, session):
+        DataTask.__init__(self, task, session)
+        self.stats_cache = StatsCache(self.redis_client, self.stats_client)
+
+    def __call__(self, names=None, expire=False):
+        names = sorted(names or STATS_PAGES.keys())
+        if expire:
+            # if the lease is busy, the next scheduled run picks them up
+            self.stats_cache.expire(names)
+
+        refreshed = 0
+        with self.task.lease(StatsCache.lease_name,
+                             timeout=StatsCache.lease_timeout) as lease:
+            if lease is None:
+                return refreshed
+            for name in self.stats_cache.stale(names):
+                self.stats_cache.refresh(name, self.session)
+                refreshed += 1
+                if not lease.renew():  # pragma: no cover
+                    break
+        return refreshed
@@ -14,9 +14,10 @@ from ichnaea.data.internal import InternalUploader
 from ichnaea.data import monitor
 from ichnaea.data import ocid
 from ichnaea.data.report import ReportQueue
-from ichnaea.data.score import ScoreUpdater
+from ichnaea.data import score
 from ichnaea.data import station
 from ichnaea.data import stats
+from ichnaea.lease import LeaseLost
 from ichnaea.models import ApiKey
 
 
@@ -57,6 +58,11 @@ def monitor_queue_size(self):
     return monitor.QueueSize(self)()
 
 
+@celery_app.task(base=BaseTask, bind=True, queue='celery_monitor')
+def sweep_data_queues(self):
+    return monitor.QueueSweeper(self)()
+
+
 @celery_app.task(base=BaseTask, bind=True, queue='celery_export')
 def schedule_export_reports(self):
     return export.ExportScheduler(self, None)(export_reports)
@@ -87,6 +93,7 @@ def insert_reports(self, reports=(),
 @celery_app.task(base=BaseTask, bind=True, queue='celery_reports')
 def queue_reports(self, reports=(),
                   api_key=None, email=None, ip=None, nickname=None):
+    # BBB, the submit views add reports to the export queues directly
     with self.redis_pipeline() as pipe:
         export.ExportQueue(
             self, None, pipe,
@@ -118,56 +125,154 @@ def remove_cell(self, cell_keys):  # pragma: no cover
     pass
 
 
-@celery_app.task(base=BaseTask, bind=True, queue='celery_cell')
-def update_cell(self, batch=1000, shard_id=None):
-    with self.redis_pipeline() as pipe:
-        with self.db_session() as session:
-            updater = station.CellUpdater(
-                self, session, pipe, shard_id=shard_id)
-            if shard_id is None:
-                updater.shard_queues(batch=batch)
-            else:
-                updater(batch=batch)
+@celery_app.task(base=BaseTask, bind=True, queue='celery_consume')
+def update_cell(self, batch=1000, shard_id=None, drain=0):
+    def _update(batch, lease):
+        with self.redis_pipeline() as pipe:
+            with self.db_session() as session:
+                updater = station.CellUpdater(
+                    self, session, pipe, shard_id=shard_id, lease=lease)
+                if shard_id is None:
+                    updater.shard_queues(batch=batch)
+                else:
+                    updater(batch=batch)
 
+    if shard_id is None:  # BBB
+        _update(batch, None)
+        return
+    self.consume('update_cell_' + shard_id, _update, batch,
+                 drain=drain, shard_id=shard_id)
 
-@celery_app.task(base=BaseTask, bind=True, queue='celery_wifi')
-def update_wifi(self, batch=1000, shard_id=None):
-    with self.redis_pipeline() as pipe:
-        with self.db_session() as session:
-            station.WifiUpdater(
-                self, session, pipe, shard_id=shard_id)(batch=batch)
 
+@celery_app.task(base=BaseTask, bind=True, queue='celery_consume')
+def update_wifi(self, batch=1000, shard_id=None, drain=0):
+    def _update(batch, lease):
+        with self.redis_pipeline() as pipe:
+            with self.db_session() as session:
+                station.WifiUpdater(
+                    self, session, pipe, shard_id=shard_id,
+                    lease=lease)(batch=batch)
 
-@celery_app.task(base=BaseTask, bind=True, queue='celery_cell')
-def update_cellarea(self, batch=100):
-    with self.db_session() as session:
-        area.CellAreaUpdater(self, session)(batch=batch)
+    self.consume('update_wifi_' + shard_id, _update, batch,
+                 drain=drain, shard_id=shard_id)
 
 
-@celery_app.task(base=BaseTask, bind=True, queue='celery_ocid')
-def update_cellarea_ocid(self, batch=100):
-    with self.db_session() as session:
-        area.CellAreaOCIDUpdater(self, session)(batch=batch)
+@celery_app.task(base=BaseTask, bind=True)
+def build_station_filters(self):
+    for name, station_filter in self.app.station_filters.items():
+        if not station_filter.ready():
+            station_type, shard_id = name.split('_', 1)
+            build_station_filter.delay(station_type, shard_id)
 
 
 @celery_app.task(base=BaseTask, bind=True)
-def update_datamap(self, batch=1000, shard_id=None):
-    with self.redis_pipeline() as pipe:
+def build_station_filter(self, station_type, shard_id, batch=10000):
+    with self.db_session(commit=False) as session:
+        station.StationFilterBuilder(
+            self, session, station_type, shard_id)(batch=batch)
+
+
+@celery_app.task(base=BaseTask, bind=True, queue='celery_consume')
+def update_cellarea(self, batch=100, drain=0):
+    def _update(batch, lease):
         with self.db_session() as session:
-            DataMapUpdater(self, session, pipe, shard_id=shard_id)(batch=batch)
+            area.CellAreaUpdater(self, session)(batch=batch)
+
+    self.consume('update_cellarea', _update, batch, drain=drain)
+
+
+@celery_app.task(base=BaseTask, bind=True, queue='celery_cell')
+def repair_cellarea(self, batch=10000):
+    with self.db_session(commit=False) as session:
+        return area.CellAreaRepair(self, session)(batch=batch)
+
+
+@celery_app.task(base=BaseTask, bind=True, queue='celery_consume')
+def update_cellarea_ocid(self, batch=100, drain=0):
+    def _update(batch, lease):
+        with self.db_session() as session:
+            area.CellAreaOCIDUpdater(self, session)(batch=batch)
+
+    self.consume('update_cellarea_ocid', _update, batch, drain=drain)
+
+
+@celery_app.task(base=BaseTask, bind=True, queue='celery_consume')
+def update_datamap(self, batch=1000, shard_id=None, drain=0):
+    def _update(batch, lease):
+        with self.redis_pipeline() as pipe:
+            with self.db_session() as session:
+                DataMapUpdater(self, session, pipe, shard_id=shard_id)(
+                    batch=batch)
+
+    self.consume('update_datamap_' + shard_id, _update, batch,
+                 drain=drain, shard_id=shard_id)
 
 
 @celery_app.task(base=BaseTask, bind=True)
 def update_score(self, batch=1000):
-    with self.redis_pipeline() as pipe:
+    # long enough for a whole day of score counters, short enough
+    # to not delay the scores for long if a task died
+    with self.lease('update_score', timeout=300) as lease:
+        if lease is None:
+            # another task is still applying the same score counters
+            return
+        try:
+            with self.redis_pipeline() as pipe:
+                with self.db_session() as session:
+                    score.ScoreUpdater(
+                        self, session, pipe, lease=lease)(batch=batch)
+        except LeaseLost:
+            # the score counters are applied by the next task
+            return
+
+
+@celery_app.task(base=BaseTask, bind=True)
+def build_leaderboard(self):
+    with self.db_session(commit=False) as session:
+        return score.LeaderboardBuilder(self, session)()
+
+
+@celery_app.task(base=BaseTask, bind=True)
+def rollup_scores(self, days=30, max_days=30):
+    # commit after each rolled up day
+    removed = 0
+    for i in range(max_days):
         with self.db_session() as session:
-            ScoreUpdater(self, session, pipe)(batch=batch)
+            count = score.ScoreRollup(self, session)(days=days)
+        if not count:
+            break
+        removed += count
+    return removed
+
+
+@celery_app.task(base=BaseTask, bind=True)
+def refresh_stats_cache(self, names=None, expire=False):
+    with self.db_session(commit=False) as session:
+        return stats.StatsCacheRefresher(self, session)(
+            names=names, expire=expire)
 
 
 @celery_app.task(base=BaseTask, bind=True)
-def update_statregion(self):
-    with self.db_session() as session:
-        stats.StatRegion(self, session)()
+def update_statregion(self, recount=False):
+    # the hourly updates and the daily recount both apply the
+    # same tracked WiFi changes, a recount can take a while
+    with self.lease('update_statregion', timeout=3600) as lease:
+        if lease is None:
+            if (recount and not
+                    self.app.conf.CELERY_ALWAYS_EAGER):  # pragma: no cover
+                # don't skip the daily recount, try again later
+                self.apply_async(kwargs={'recount': True},
+                                 countdown=300, expires=3600)
+            return
+        try:
+            with self.redis_pipeline() as pipe:
+                with self.db_session() as session:
+                    stats.StatRegion(self, session, pipe, lease=lease)(
+                        recount=recount)
+        except LeaseLost:
+            return
+    refresh_stats_cache.delay(
+        names=stats.StatRegion.stats_pages, expire=True)
 
 
 @celery_app.task(base=BaseTask, bind=True)
@@ -175,3 +280,5 @@ def update_statcounter(self, ago=1):
     with self.redis_pipeline() as pipe:
         with self.db_session() as session:
             stats.StatCounterUpdater(self, session, pipe)(ago=ago)
+    refresh_stats_cache.delay(
+        names=stats.StatCounterUpdater.stats_pages, expire=True)
@@ -1,4 +1,9 @@
+from ichnaea.data.area import (
+    AreaAggregate,
+    AreaAggregates,
+)
 from ichnaea.data.tasks import (
+    repair_cellarea,
     update_cellarea,
     update_cellarea_ocid,
 )
@@ -72,6 +77,35 @@ class BaseTest(object):
         self.assertEqual(area.num_cells, 1)
         self.assertEqual(area.avg_cell_radius, 200)
 
+    def test_update_batch(self):
+        area_keys = [(Radio.gsm, 234, 1, 1), (Radio.gsm, 234, 1, 2),
+                     (Radio.wcdma, 234, 1, 1)]
+        cells = {}
+        for radio, mcc, mnc, lac in area_keys:
+            cells[encode_cellarea(radio, mcc, mnc, lac)] = [
+                self.cell_factory(radio=radio, mcc=mcc, mnc=mnc, lac=lac,
+                                  cid=i + 1, lat=51.5 + i * 0.001, lon=-0.1,
+                                  radius=i)
+                for i in range(lac + 1)]
+        self.area_factory(radio=Radio.gsm, mcc=234, mnc=1, lac=3)
+        self.session.commit()
+
+        areaids = sorted(cells.keys()) + [
+            encode_cellarea(Radio.gsm, 234, 1, 3)]
+        self.area_queue.enqueue(areaids, json=False)
+        self.task.delay().get()
+
+        areas = dict([(encode_cellarea(*area.areaid), area) for area in
+                      self.session.query(self.area_model).all()])
+        self.assertEqual(set(areas.keys()), set(cells.keys()))
+        for areaid, area_cells in cells.items():
+            area = areas[areaid]
+            self.assertEqual(area.num_cells, len(area_cells))
+            self.assertAlmostEqual(
+                area.lat, sum([cell.lat for cell in area_cells]) /
+                len(area_cells))
+            self.assertEqual(area.region, 'GB')
+
     def test_update_incomplete_cell(self):
         area = self.area_factory(radius=500)
         area_key = {'radio': area.radio, 'mcc': area.mcc,
@@ -151,6 +185,89 @@ class TestArea(BaseTest, CeleryTestCase):
     def setUp(self):
         super(TestArea, self).setUp()
         self.area_queue = self.celery_app.data_queues['update_cellarea']
+        self.aggregates = AreaAggregates(CellArea, self.redis_client)
+
+    def test_aggregate(self):
+        cell = self.cell_factory(radius=100)
+        self.session.flush()
+        areaid = encode_cellarea(cell.radio, cell.mcc, cell.mnc, cell.lac)
+
+        # the first update scans the cells and stores the aggregate
+        self.area_queue.enqueue([areaid], json=False)
+        self.task.delay().get()
+        aggregate = self.aggregates.load([areaid])[areaid]
+        self.assertEqual(aggregate.num_cells, 1)
+        self.assertAlmostEqual(aggregate.sum_lat, cell.lat)
+        self.assertEqual(dict(aggregate.regions), {'GB': 1})
+
+        # later updates only use the aggregate
+        cell2 = self.cell_factory(
+            lat=cell.lat + 0.002, lon=cell.lon, radius=300,
+            radio=cell.radio, mcc=cell.mcc, mnc=cell.mnc, lac=cell.lac)
+        self.session.flush()
+        self.area_queue.enqueue([areaid], json=False)
+        self.task.delay().get()
+        area = self.session.query(self.area_model).one()
+        self.assertEqual(area.num_cells, 1)
+
+        delta = AreaAggregate()
+        delta.add({'lat': cell2.lat, 'lon': cell2.lon,
+                   'radius': cell2.radius, 'region': cell2.region})
+        with self.redis_client.pipeline() as pipe:
+            self.aggregates.add_delta(pipe, areaid, delta)
+            pipe.execute()
+        self.area_queue.enqueue([areaid], json=False)
+        self.task.delay().get()
+
+        self.session.refresh(area)
+        self.assertEqual(area.num_cells, 2)
+        self.assertAlmostEqual(area.lat, cell.lat + 0.001)
+        self.assertEqual(area.avg_cell_radius, 200)
+        self.assertTrue(area.radius > 0)
+
+    def test_aggregate_delta_missing(self):
+        delta = AreaAggregate()
+        delta.add({'lat': 1.0, 'lon': 1.0, 'radius': 10, 'region': 'GB'})
+        with self.redis_client.pipeline() as pipe:
+            self.aggregates.add_delta(pipe, b'1234567', delta)
+            pipe.execute()
+        # deltas don't create partial aggregates
+        self.assertEqual(self.aggregates.load([b'1234567']),
+                         {b'1234567': None})
+
+    def test_repair(self):
+        cells = [self.cell_factory(radio=Radio.gsm, mcc=234, mnc=1, lac=lac)
+                 for lac in (1, 2)]
+        areaids = [encode_cellarea(cell.radio, cell.mcc, cell.mnc, cell.lac)
+                   for cell in cells]
+        self.session.flush()
+        self.area_queue.enqueue(areaids, json=False)
+        self.task.delay().get()
+
+        # corrupt the first aggregate
+        aggregate = self.aggregates.load(areaids[:1])[areaids[0]]
+        aggregate.num_cells = 3
+        with self.redis_client.pipeline() as pipe:
+            self.aggregates.store(pipe, areaids[0], aggregate)
+            pipe.execute()
+
+        self.assertEqual(repair_cellarea.delay(batch=1).get(), 1)
+        # the repair leaves the rescan to the area update
+        self.assertEqual(self.aggregates.load(areaids[:1]),
+                         {areaids[0]: None})
+        self.assertEqual(self.area_queue.size(), 1)
+        self.task.delay().get()
+        self.assertEqual(
+            self.aggregates.load(areaids[:1])[areaids[0]].num_cells, 1)
+
+        self.assertEqual(repair_cellarea.delay(batch=1).get(), 1)
+        # all areas have been repaired, start over
+        self.assertEqual(repair_cellarea.delay(batch=1).get(), 0)
+        self.assertEqual(repair_cellarea.delay(batch=1).get(), 1)
+        self.task.delay().get()
+
+        for area in self.session.query(self.area_model).all():
+            self.assertEqual(area.num_cells, 1)
 
 
 class TestAreaOCID(BaseTest, CeleryTestCase):
@@ -9,10 +9,14 @@ from ichnaea.data.tests.test_export import BaseExportTest
 from ichnaea.models import (
     ApiKey,
     CellShard,
+    ScoreCounter,
     ScoreKey,
     User,
+    WifiAggregate,
     WifiShard,
 )
+from ichnaea.tests.factories import WifiShardFactory
+from ichnaea import util
 
 
 class TestUploader(BaseExportTest):
@@ -161,6 +165,36 @@ class TestUploader(BaseExportTest):
         self.assertEqual(len(wifis), 1)
         self.assertEqual(wifis[0].samples, 1)
 
+    def test_wifi_aggregated(self):
+        mac = '000000123456'
+        self.add_reports(3, cell_factor=0, wifi_factor=1,
+                         wifi_key=mac, lat=51.5, lon=-0.1)
+        schedule_export_reports.delay().get()
+
+        # one aggregate per station is queued for the entire batch
+        queue = self.celery_app.data_queues[
+            'update_wifi_' + WifiShard.shard_id(mac)]
+        self.assertEqual(queue.size(), 1)
+        aggregate = queue.dequeue()[0]
+        self.assertTrue(isinstance(aggregate, WifiAggregate))
+        self.assertEqual(aggregate.mac, mac)
+        self.assertEqual(aggregate.samples, 3)
+        self.assertAlmostEqual(aggregate.lat, 51.5)
+        self.assertEqual(aggregate.signal, -88)
+        queue.enqueue([aggregate])
+
+        for shard_id in WifiShard.shards().keys():
+            update_wifi.delay(shard_id=shard_id).get()
+
+        wifis = self.session.query(WifiShard.shard_model(mac)).all()
+        self.assertEqual(len(wifis), 1)
+        self.assertEqual(wifis[0].samples, 3)
+        self.assertAlmostEqual(wifis[0].lat, 51.5)
+        self.check_stats(counter=[
+            ('data.observation.insert', 1, 3, ['type:wifi']),
+            ('data.observation.upload', 1, 3, ['type:wifi', 'key:test']),
+        ])
+
     def test_wifi_invalid(self):
         self.add_reports(cell_factor=0, wifi_factor=1, wifi_key='abcd')
         self._update_all()
@@ -210,24 +244,43 @@ class TestUploader(BaseExportTest):
         self.add_reports(wifi_factor=0, nickname=self.nickname)
         schedule_export_reports.delay().get()
 
-        queue = self.celery_app.data_queues['update_score']
-        self.assertEqual(queue.size(), 2)
-        scores = queue.dequeue()
-        score_keys = set([score['hashkey'].key for score in scores])
-        self.assertEqual(
-            score_keys, set([ScoreKey.location, ScoreKey.new_cell]))
+        scores = ScoreCounter(util.utcnow().date()).swap(self.redis_client)
+        self.assertEqual(set([key for userid, key in scores.keys()]),
+                         set([ScoreKey.location, ScoreKey.new_cell]))
 
         users = self.session.query(User).all()
         self.assertEqual(len(users), 1)
         self.assertEqual(users[0].nickname, self.nickname)
         self.assertEqual(users[0].email, '')
 
+    def test_station_filter(self):
+        wifi = WifiShardFactory()
+        self.session.commit()
+        station_filter = self.celery_app.station_filters[
+            'wifi_' + WifiShard.shard_id(wifi.mac)]
+        station_filter.add([wifi.mac])
+        station_filter.mark_ready()
+
+        self.add_reports(1, cell_factor=0, wifi_factor=1,
+                         nickname=self.nickname)
+        self.add_reports(1, cell_factor=0, wifi_factor=1,
+                         nickname=self.nickname, wifi_key=wifi.mac)
+        schedule_export_reports.delay().get()
+
+        scores = ScoreCounter(util.utcnow().date()).swap(self.redis_client)
+        new_wifi = [value for (userid, key), value in scores.items()
+                    if key == ScoreKey.new_wifi]
+        self.assertEqual(new_wifi, [1])
+        self.check_stats(counter=[
+            ('data.station.filter', 1, 1, ['type:wifi', 'result:hit']),
+        ])
+
     def test_nickname_too_short(self):
         self.add_reports(nickname=u'a')
         schedule_export_reports.delay().get()
 
-        queue = self.celery_app.data_queues['update_score']
-        self.assertEqual(queue.size(), 0)
+        scores = ScoreCounter(util.utcnow().date()).swap(self.redis_client)
+        self.assertEqual(scores, {})
         self.assertEqual(self.session.query(User).count(), 0)
 
     def test_email_header_update(self):
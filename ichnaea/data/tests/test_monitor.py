@@ -7,6 +7,7 @@ from ichnaea.data.tasks import (
     monitor_api_users,
     monitor_ocid_import,
     monitor_queue_size,
+    sweep_data_queues,
 )
 from ichnaea.tests.base import CeleryTestCase
 from ichnaea.tests.factories import CellOCIDFactory
@@ -101,8 +102,14 @@ class TestMonitorTasks(CeleryTestCase):
         for name in self.celery_app.all_queues:
             data[name] = randint(1, 10)
 
+        data_queues = dict([(queue.monitor_name, queue) for queue in
+                            self.celery_app.data_queues.values()])
         for k, v in data.items():
-            self.redis_client.lpush(k, *range(v))
+            if k in data_queues:
+                data_queues[k].enqueue(
+                    [str(i) for i in range(v)], json=False)
+            else:
+                self.redis_client.lpush(k, *range(v))
 
         result = monitor_queue_size.delay().get()
 
@@ -111,6 +118,26 @@ class TestMonitorTasks(CeleryTestCase):
         )
         self.assertEqual(result, data)
 
+    def test_sweep_data_queues(self):
+        queue = self.celery_app.data_queues['update_wifi_0']
+        queue.enqueue([1, 2, 3])
+        queue.claim(batch=2)
+        result = sweep_data_queues.delay().get()
+        self.assertEqual(result['update_wifi_0'], 0)
+        self.assertFalse('update_score' in result)
+
+        queue.processing_timeout = -10
+        try:
+            queue.claim(batch=1)
+        finally:
+            del queue.processing_timeout
+        result = sweep_data_queues.delay().get()
+        self.assertEqual(result['update_wifi_0'], 1)
+        self.assertEqual(queue.size(), 1)
+        self.check_stats(counter=[
+            ('data.queue.reclaim', 1, 1, ['queue:update_wifi_0']),
+        ])
+
 
 class TestMonitorAPIUsersTasks(CeleryTestCase):
 
@@ -15,6 +15,7 @@ from ichnaea.data.ocid import (
     ImportLocal,
     write_stations_to_csv,
 )
+from ichnaea.data.report import ReportQueue
 from ichnaea.data.tasks import (
     cell_export_full,
     cell_export_diff,
@@ -201,6 +202,26 @@ class TestImport(CeleryAppTestCase):
         update_statcounter.delay(ago=0).get()
         self.check_stat(StatKey.unique_cell, 9)
 
+    def test_import_local_cell_filter(self):
+        station_filters = self.celery_app.station_filters
+        for name, station_filter in station_filters.items():
+            if name.startswith('cell_'):
+                station_filter.mark_ready()
+
+        self.import_csv(cell_type='cell')
+        cells = self.session.query(CellShard.shards()['wcdma']).all()
+        cellids = [cell.cellid for cell in cells]
+        self.assertEqual(len(cellids), 9)
+        self.assertEqual(
+            station_filters['cell_wcdma'].contains(cellids), [True] * 9)
+
+        with redis_pipeline(self.redis_client) as pipe:
+            queue = ReportQueue(update_cellarea, self.session, pipe)
+            self.assertEqual(queue.new_stations('cell', cellids), 0)
+        self.check_stats(counter=[
+            ('data.station.filter', 1, 9, ['type:cell', 'result:hit']),
+        ])
+
     def test_import_local_ocid(self):
         self.import_csv()
         cells = self.session.query(CellOCID).all()
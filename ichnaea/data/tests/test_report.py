@@ -0,0 +1,52 @@
+from ichnaea.data.report import (
+    load_trusted_report,
+    trusted_report,
+    validate_report,
+)
+from ichnaea.models import Radio
+from ichnaea.tests.base import TestCase
+from ichnaea.tests.factories import (
+    CellShardFactory,
+    WifiShardFactory,
+)
+
+
+class TestTrustedReport(TestCase):
+
+    def _report(self, **kw):
+        cell = CellShardFactory.build()
+        wifis = WifiShardFactory.build_batch(2)
+        report = {
+            'lat': cell.lat,
+            'lon': cell.lon,
+            'accuracy': 10.0,
+            'cell': [{'radio': cell.radio.name, 'mcc': cell.mcc,
+                      'mnc': cell.mnc, 'lac': cell.lac, 'cid': cell.cid,
+                      'signal': -70}],
+            'wifi': [{'key': wifi.mac, 'signal': -80} for wifi in wifis] +
+                    [{'key': 'invalid'}],
+        }
+        report.update(kw)
+        return report
+
+    def test_roundtrip(self):
+        data = self._report()
+        report, items, malformed = validate_report(data)
+        self.assertEqual(malformed, {'cell': 0, 'wifi': 1})
+        self.assertEqual(len(items['wifi']), 2)
+
+        trusted = trusted_report(data)
+        self.assertTrue(trusted['trusted'])
+        self.assertEqual(trusted['cell'][0]['radio'], int(Radio.gsm))
+
+        loaded_report, loaded_items, loaded_malformed = \
+            load_trusted_report(trusted)
+        self.assertEqual(loaded_report, report)
+        self.assertEqual(loaded_items, items)
+        self.assertEqual(loaded_malformed, malformed)
+        self.assertTrue(type(loaded_items['cell'][0].radio) is Radio)
+
+    def test_malformed(self):
+        data = self._report(lat=None)
+        self.assertEqual(validate_report(data)[0], None)
+        self.assertEqual(trusted_report(data), None)
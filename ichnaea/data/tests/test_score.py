@@ -1,8 +1,18 @@
 from datetime import timedelta
 
-from ichnaea.data.tasks import update_score
+import mock
+
+from ichnaea.data.tasks import (
+    build_leaderboard,
+    rollup_scores,
+    update_score,
+)
+from ichnaea.leaderboard import Leaderboard
+from ichnaea.lease import Lease
 from ichnaea.models.content import (
     Score,
+    SCORE_ROLLUP_DAY,
+    ScoreCounter,
     ScoreKey,
     User,
 )
@@ -32,12 +42,12 @@ class TestScore(CeleryTestCase):
                 userid=userid, key=key, time=time, value=value))
         self.session.flush()
 
-    def _queue(self, triples):
-        scores = [{'hashkey': Score.to_hashkey(userid=userid,
-                                               key=key,
-                                               time=None),
-                   'value': value} for userid, key, value in triples]
-        self.queue.enqueue(scores)
+    def _queue(self, triples, day=None):
+        counter = ScoreCounter(day or self.today)
+        with self.redis_client.pipeline() as pipe:
+            for userid, key, value in triples:
+                counter.incr(pipe, userid, key, value)
+            pipe.execute()
 
     def test_empty(self):
         update_score.delay().get()
@@ -55,6 +65,29 @@ class TestScore(CeleryTestCase):
         self.assertEqual(scores[0].time, self.today)
         self.assertEqual(scores[0].value, 3)
 
+    def test_lease(self):
+        users = self._add_nicks([u'nick1'])
+        self._queue([(users[u'nick1'].id, ScoreKey.location, 3)])
+        lease = Lease('update_score', self.redis_client, self.stats_client)
+        self.assertTrue(lease.acquire())
+        # another task holds the lease, nothing is done
+        update_score.delay().get()
+        self.assertEqual(self.session.query(Score).count(), 0)
+
+        lease.release()
+        update_score.delay().get()
+        self.assertEqual(self.session.query(Score).one().value, 3)
+
+    def test_lease_lost(self):
+        users = self._add_nicks([u'nick1'])
+        self._queue([(users[u'nick1'].id, ScoreKey.location, 3)])
+        with mock.patch.object(Lease, 'renew', return_value=False):
+            update_score.delay().get()
+        # nothing was written and the counters are applied later
+        self.assertEqual(self.session.query(Score).count(), 0)
+        update_score.delay().get()
+        self.assertEqual(self.session.query(Score).one().value, 3)
+
     def test_update(self):
         users = self._add_nicks([u'nick1'])
         self._add([(users[u'nick1'].id, ScoreKey.location, self.today, 2)])
@@ -99,3 +132,118 @@ class TestScore(CeleryTestCase):
             (users['nick2'].id, ScoreKey.location): 11,
             (users['nick2'].id, ScoreKey.new_cell): 13,
         })
+
+    def test_yesterday(self):
+        users = self._add_nicks([u'nick1'])
+        self._queue([(users[u'nick1'].id, ScoreKey.location, 3)],
+                    day=self.yesterday)
+        self._queue([(users[u'nick1'].id, ScoreKey.location, 2)])
+        update_score.delay().get()
+
+        scores = dict([(score.time, score.value)
+                       for score in self.session.query(Score).all()])
+        self.assertEqual(scores, {self.yesterday: 3, self.today: 2})
+
+    def test_swap(self):
+        counter = ScoreCounter(self.today)
+        self._queue([(1, ScoreKey.location, 3), (1, ScoreKey.location, 1)])
+        self.assertEqual(counter.swap(self.redis_client),
+                         {(1, ScoreKey.location): 4})
+
+        # unprocessed increments are returned again
+        self._queue([(2, ScoreKey.new_cell, 1)])
+        self.assertEqual(counter.swap(self.redis_client),
+                         {(1, ScoreKey.location): 4})
+
+        with self.redis_client.pipeline() as pipe:
+            counter.remove(pipe)
+            pipe.execute()
+        self.assertEqual(counter.swap(self.redis_client),
+                         {(2, ScoreKey.new_cell): 1})
+
+    def test_queued(self):
+        # BBB
+        users = self._add_nicks([u'nick1'])
+        self.queue.enqueue([{
+            'hashkey': Score.to_hashkey(
+                userid=users[u'nick1'].id, key=ScoreKey.location, time=None),
+            'value': 2}])
+        self._queue([(users[u'nick1'].id, ScoreKey.location, 3)])
+        update_score.delay().get()
+
+        score = self.session.query(Score).one()
+        self.assertEqual(score.time, self.today)
+        self.assertEqual(score.value, 5)
+        self.assertEqual(self.queue.size(), 0)
+
+    def test_leaderboard(self):
+        users = self._add_nicks([u'nick1', u'nick2'])
+        self._queue([
+            (users['nick1'].id, ScoreKey.location, 3),
+            (users['nick2'].id, ScoreKey.location, 1),
+            (users['nick2'].id, ScoreKey.new_wifi, 2),
+        ])
+        update_score.delay().get()
+
+        leaderboard = Leaderboard(self.redis_client)
+        self.assertEqual(leaderboard.top(ScoreKey.location),
+                         [(users['nick1'].id, 3), (users['nick2'].id, 1)])
+        self.assertEqual(
+            leaderboard.top_days(ScoreKey.new_wifi, self.today, 8, 10),
+            [(users['nick2'].id, 2)])
+
+    def test_build_leaderboard(self):
+        old_day = self.today - timedelta(days=10)
+        self._add([
+            (1, ScoreKey.location, old_day, 5),
+            (1, ScoreKey.location, self.today, 2),
+            (2, ScoreKey.location, self.yesterday, 4),
+            (2, ScoreKey.new_cell, old_day, 3),
+            (2, ScoreKey.new_cell, self.today, 1),
+        ])
+        self.session.commit()
+        leaderboard = Leaderboard(self.redis_client)
+        self.assertFalse(leaderboard.ready())
+
+        build_leaderboard.delay().get()
+        self.assertTrue(leaderboard.ready())
+        self.assertEqual(leaderboard.top(ScoreKey.location), [(1, 7), (2, 4)])
+        self.assertEqual(leaderboard.top(ScoreKey.new_cell), [(2, 4)])
+        self.assertEqual(
+            leaderboard.top_days(ScoreKey.new_cell, self.today, 8, 10),
+            [(2, 1)])
+
+    def test_rollup(self):
+        old_day = self.today - timedelta(days=31)
+        self._add([
+            (1, ScoreKey.location, old_day, 5),
+            (1, ScoreKey.location, old_day - timedelta(days=1), 2),
+            (1, ScoreKey.location, SCORE_ROLLUP_DAY, 10),
+            (1, ScoreKey.location, self.today, 1),
+            (2, ScoreKey.new_wifi, old_day, 3),
+        ])
+        self.session.commit()
+
+        self.assertEqual(rollup_scores.delay(days=30).get(), 3)
+        scores = dict([((score.userid, score.key, score.time), score.value)
+                       for score in self.session.query(Score).all()])
+        self.assertEqual(scores, {
+            (1, ScoreKey.location, SCORE_ROLLUP_DAY): 17,
+            (1, ScoreKey.location, self.today): 1,
+            (2, ScoreKey.new_wifi, SCORE_ROLLUP_DAY): 3,
+        })
+        self.assertEqual(rollup_scores.delay(days=30).get(), 0)
+
+    def test_rollup_max_days(self):
+        old_day = self.today - timedelta(days=31)
+        self._add([(1, ScoreKey.location, old_day - timedelta(days=i), 1)
+                   for i in range(3)])
+        self.session.commit()
+
+        # the oldest days are rolled up first
+        self.assertEqual(rollup_scores.delay(days=30, max_days=2).get(), 2)
+        self.assertEqual(
+            self.session.query(Score.time).filter(
+                Score.time > SCORE_ROLLUP_DAY).all(), [(old_day, )])
+        self.assertEqual(rollup_scores.delay(days=30, max_days=2).get(), 1)
+        self.assertEqual(self.session.query(Score).one().value, 3)
@@ -1,21 +1,37 @@
 from collections import defaultdict
 from datetime import timedelta
+import time
+
+import mock
 
 from ichnaea.constants import (
     PERMANENT_BLOCKLIST_THRESHOLD,
     TEMPORARY_BLOCKLIST_DURATION,
 )
+from ichnaea.data.area import AreaAggregates
+from ichnaea.data.base import upsert_rows
 from ichnaea.data.tasks import (
+    build_station_filters,
     update_cell,
+    update_cellarea,
     update_wifi,
 )
+from ichnaea.lease import Lease
 from ichnaea.models import (
+    CellArea,
     CellShard,
+    encode_cellarea,
+    RegionStatCounter,
     StatCounter,
     StatKey,
+    WifiAggregate,
     WifiShard,
 )
-from ichnaea.tests.base import CeleryTestCase
+from ichnaea.tests.base import (
+    CeleryTestCase,
+    GB_LAT,
+    GB_LON,
+)
 from ichnaea.tests.factories import (
     CellObservationFactory,
     CellShardFactory,
@@ -232,6 +248,35 @@ class TestCell(StationTest):
         self.assertAlmostEqual(found.lat, expected_lat, 7)
         self.assertAlmostEqual(found.lon, expected_lon, 7)
 
+    def test_area_aggregate(self):
+        cell = CellShardFactory(samples=3)
+        self.session.flush()
+        areaid = encode_cellarea(cell.radio, cell.mcc, cell.mnc, cell.lac)
+        self.celery_app.data_queues['update_cellarea'].enqueue(
+            [areaid], json=False)
+        update_cellarea.delay().get()
+
+        obs = CellObservationFactory.build(
+            radio=cell.radio, mcc=cell.mcc, mnc=cell.mnc,
+            lac=cell.lac, cid=cell.cid,
+            lat=cell.lat + 0.004, lon=cell.lon)
+        self._queue_and_update([obs])
+
+        # the cell change is applied to the area aggregate
+        shard = CellShard.shard_model(cell.cellid)
+        found = (self.session.query(shard)
+                             .filter(shard.cellid == cell.cellid)).one()
+        aggregate = AreaAggregates(CellArea, self.redis_client).load(
+            [areaid])[areaid]
+        self.assertEqual(aggregate.num_cells, 1)
+        self.assertAlmostEqual(aggregate.sum_lat, found.lat)
+        self.assertAlmostEqual(aggregate.max_lat, found.max_lat)
+
+        update_cellarea.delay().get()
+        area = self.session.query(CellArea).one()
+        self.assertAlmostEqual(area.lat, found.lat)
+        self.assertEqual(area.num_cells, 1)
+
     def test_max_min_radius_update(self):
         cell = CellShardFactory(radius=150, samples=3)
         cell_lat = cell.lat
@@ -302,6 +347,145 @@ class TestWifi(StationTest):
         self.assertEqual(wifi.block_last, None)
         self.assertEqual(wifi.block_count, None)
 
+    def test_region_stats(self):
+        wifi = WifiShardFactory(region='DE', samples=1)
+        self.session.commit()
+        obs = [WifiObservationFactory.build(),
+               WifiObservationFactory.build(
+                   mac=wifi.mac, lat=wifi.lat, lon=wifi.lon)]
+        self._queue_and_update(obs)
+
+        # the new wifi and the wifi moved into the correct region
+        self.assertEqual(
+            RegionStatCounter('wifi').swap(self.redis_client),
+            {'DE': -1, 'GB': 2})
+
+    def test_ack(self):
+        obs = WifiObservationFactory.build()
+        self._queue_and_update([obs])
+        queue = self.celery_app.data_queues[
+            'update_wifi_' + WifiShard.shard_id(obs.mac)]
+        self.assertEqual(queue.size(), 0)
+        self.assertEqual(self.redis_client.zcard(queue.claims_key()), 0)
+        self.assertEqual(self.redis_client.keys('update_wifi_*'), [])
+
+    def test_lease(self):
+        obs = WifiObservationFactory.build()
+        shard_id = WifiShard.shard_id(obs.mac)
+        lease = Lease('update_wifi_' + shard_id,
+                      self.redis_client, self.stats_client)
+        self.assertTrue(lease.acquire())
+        # another consumer holds the lease, nothing is done
+        self._queue_and_update([obs])
+        queue = self.celery_app.data_queues['update_wifi_' + shard_id]
+        self.assertEqual(queue.size(), 1)
+
+        lease.release()
+        update_wifi.delay(shard_id=shard_id).get()
+        self.assertEqual(queue.size(), 0)
+        self.assertEqual(self.session.query(
+            WifiShard.shard_model(obs.mac)).count(), 1)
+        self.check_stats(counter=[
+            ('lease.acquire', 1,
+             ['lease:update_wifi_' + shard_id, 'result:busy']),
+        ], timer=[
+            ('lease.idle', 1, ['lease:update_wifi_' + shard_id]),
+            ('lease.work', 2, ['lease:update_wifi_' + shard_id]),
+        ])
+
+    def test_lease_lost(self):
+        obs = WifiObservationFactory.build()
+        shard_id = WifiShard.shard_id(obs.mac)
+        queue = self.celery_app.data_queues['update_wifi_' + shard_id]
+        queue.enqueue([obs])
+        with mock.patch.object(Lease, 'renew', return_value=False):
+            update_wifi.delay(shard_id=shard_id).get()
+        # the claim wasn't acknowledged and is reclaimed later
+        self.assertEqual(queue.size(), 0)
+        self.assertEqual(self.redis_client.zcard(queue.claims_key()), 1)
+        self.assertEqual(queue.reclaim(now=time.time() + 3600), (1, 0))
+        self.assertEqual(queue.size(), 1)
+
+    def test_drain(self):
+        shard_id = '6'
+        obs = [WifiObservationFactory.build(mac='a8206600000%s' % i)
+               for i in range(5)]
+        queue = self.celery_app.data_queues['update_wifi_' + shard_id]
+        queue.enqueue(obs)
+        update_wifi.delay(batch=2, shard_id=shard_id, drain=2).get()
+        self.assertEqual(queue.size(), 0)
+        self.assertEqual(self.session.query(
+            WifiShard.shards()[shard_id]).count(), 5)
+        # a single task processed all batches
+        self.check_stats(counter=[
+            ('lease.acquire', 1,
+             ['lease:update_wifi_' + shard_id, 'result:success']),
+        ], timer=[
+            ('lease.work', 1, ['lease:update_wifi_' + shard_id]),
+        ])
+
+    def test_aggregate(self):
+        wifi = WifiShardFactory(samples=2)
+        lat, lon = (wifi.lat, wifi.lon)
+        obs = [
+            WifiObservationFactory.build(
+                key=wifi.mac, lat=lat + 0.0002, lon=lon, signal=-80),
+            WifiObservationFactory.build(
+                key=wifi.mac, lat=lat - 0.0004, lon=lon, signal=-70),
+        ]
+        aggregate = WifiAggregate.from_observation(obs[0])
+        aggregate.add(obs[1])
+        self.assertEqual(aggregate.samples, 2)
+        self.assertEqual(aggregate.signal, -70)
+        self.assertAlmostEqual(aggregate.lat, lat - 0.0001)
+        self.assertAlmostEqual(aggregate.max_lat, lat + 0.0002)
+        self.assertAlmostEqual(aggregate.min_lat, lat - 0.0004)
+        self.session.commit()
+
+        # an aggregate and a single observation are combined
+        extra = WifiObservationFactory.build(key=wifi.mac, lat=lat, lon=lon)
+        self._queue_and_update([aggregate, extra])
+
+        shard = WifiShard.shard_model(wifi.mac)
+        found = self.session.query(shard).one()
+        self.assertAlmostEqual(found.lat, lat - 0.00004)
+        self.assertAlmostEqual(found.max_lat, lat + 0.0002)
+        self.assertAlmostEqual(found.min_lat, lat - 0.0004)
+        self.assertEqual(found.samples, 5)
+        self.check_statcounter(StatKey.wifi, 3)
+
+    def test_batch(self):
+        # stations in one batch don't influence each others values
+        wifis = [WifiShardFactory(lat=GB_LAT + i * 0.01, samples=1)
+                 for i in range(3)]
+        macs = [wifi.mac for wifi in wifis] + [
+            wifi.mac for wifi in WifiShardFactory.build_batch(2)]
+        self.session.commit()
+
+        obs = []
+        for i, mac in enumerate(macs):
+            for offset in (0.0001, -0.0002, 0.0003):
+                obs.append(WifiObservationFactory.build(
+                    key=mac, lat=GB_LAT + i * 0.01 + offset,
+                    lon=GB_LON - offset))
+        self._queue_and_update(obs)
+
+        for i, mac in enumerate(macs):
+            shard = WifiShard.shard_model(mac)
+            found = (self.session.query(shard)
+                                 .filter(shard.mac == mac)).one()
+            self.assertEqual(found.samples, 4 if i < 3 else 3)
+            self.assertAlmostEqual(found.max_lat, GB_LAT + i * 0.01 + 0.0003)
+            self.assertAlmostEqual(found.min_lat, GB_LAT + i * 0.01 - 0.0002)
+            self.assertAlmostEqual(found.max_lon, GB_LON + 0.0002)
+            self.assertAlmostEqual(found.min_lon, GB_LON - 0.0003)
+            if i >= 3:
+                # new stations are placed at the centroid
+                self.assertAlmostEqual(
+                    found.lat, GB_LAT + i * 0.01 + 0.0002 / 3)
+                self.assertAlmostEqual(found.lon, GB_LON - 0.0002 / 3)
+        self.check_statcounter(StatKey.wifi, 15)
+
     def test_update(self):
         utcnow = util.utcnow()
         obs = []
@@ -559,3 +743,73 @@ class TestWifi(StationTest):
         wifi2 = self.session.query(wifi2.__class__).get(wifi2.mac)
         self.assertEqual(wifi1.block_count, 0)
         self.assertEqual(wifi2.region, 'CH')
+
+    def test_station_filter(self):
+        obs = WifiObservationFactory.build()
+        station_filter = self.celery_app.station_filters[
+            'wifi_' + WifiShard.shard_id(obs.mac)]
+        self.assertEqual(station_filter.contains([obs.mac]), [False])
+        self._queue_and_update([obs])
+        self.assertEqual(station_filter.contains([obs.mac]), [True])
+
+
+class TestUpsertRows(StationTest):
+
+    def test_upsert(self):
+        # all stations are in the same shard
+        wifis = [WifiShardFactory(mac='a8206600000%s' % i, samples=1)
+                 for i in range(3)]
+        self.session.commit()
+        shard = WifiShard.shard_model(wifis[0].mac)
+        rows = [{'mac': wifi.mac, 'samples': 2, 'radius': 10}
+                for wifi in wifis]
+        new_mac = 'a82066000009'
+        rows.append({'mac': new_mac, 'samples': 1, 'radius': 5})
+        # all rows are written, in more than one statement
+        upsert_rows(self.session, shard, rows, batch=3)
+        self.session.commit()
+
+        found = dict([(wifi.mac, wifi) for wifi in
+                      self.session.query(shard).all()])
+        self.assertEqual(set(found.keys()),
+                         set([wifi.mac for wifi in wifis] + [new_mac]))
+        for wifi in wifis:
+            self.assertEqual(found[wifi.mac].samples, 2)
+            self.assertEqual(found[wifi.mac].radius, 10)
+            self.assertEqual(found[wifi.mac].lat, wifi.lat)
+        self.assertEqual(found[new_mac].samples, 1)
+
+    def test_on_duplicate(self):
+        wifi = WifiShardFactory(samples=3)
+        self.session.commit()
+        shard = WifiShard.shard_model(wifi.mac)
+        upsert_rows(
+            self.session, shard, [{'mac': wifi.mac, 'samples': 1}],
+            on_duplicate='samples = samples')
+        self.session.commit()
+        self.assertEqual(self.session.query(shard).one().samples, 3)
+
+    def test_empty(self):
+        upsert_rows(self.session, WifiShard.shards()['0'], [])
+
+
+class TestStationFilter(StationTest):
+
+    def test_build(self):
+        cells = CellShardFactory.create_batch(3)
+        wifis = WifiShardFactory.create_batch(3)
+        self.session.commit()
+
+        station_filters = self.celery_app.station_filters
+        build_station_filters.delay().get()
+        for station_filter in station_filters.values():
+            self.assertTrue(station_filter.ready())
+
+        for cell in cells:
+            station_filter = station_filters[
+                'cell_' + CellShard.shard_id(cell.cellid)]
+            self.assertEqual(station_filter.contains([cell.cellid]), [True])
+        for wifi in wifis:
+            station_filter = station_filters[
+                'wifi_' + WifiShard.shard_id(wifi.mac)]
+            self.assertEqual(station_filter.contains([wifi.mac]), [True])
@@ -2,16 +2,20 @@ from datetime import timedelta
 
 from ichnaea.cache import redis_pipeline
 from ichnaea.data.tasks import (
+    refresh_stats_cache,
     update_statcounter,
     update_statregion,
 )
+from ichnaea.lease import Lease
 from ichnaea.models import (
     Radio,
     RegionStat,
+    RegionStatCounter,
     Stat,
     StatCounter,
     StatKey,
 )
+from ichnaea.stats import StatsCache
 from ichnaea.tests.base import CeleryTestCase
 from ichnaea.tests.factories import (
     CellAreaFactory,
@@ -111,7 +115,7 @@ class TestStatRegion(CeleryTestCase):
         stats = self.session.query(RegionStat).all()
         self.assertEqual(stats, [])
 
-    def test_update(self):
+    def test_recount(self):
         area = CellAreaFactory(radio=Radio.gsm, num_cells=1)
         area.region = None
         CellAreaFactory(radio=Radio.gsm, region='DE', num_cells=1)
@@ -127,7 +131,7 @@ class TestStatRegion(CeleryTestCase):
         self.session.add(RegionStat(region='TW', wifi=1))
         self.session.flush()
 
-        update_statregion.delay().get()
+        update_statregion.delay(recount=True).get()
         stats = self.session.query(RegionStat).all()
         self.assertEqual(len(stats), 3)
 
@@ -139,3 +143,101 @@ class TestStatRegion(CeleryTestCase):
                 self.assertEqual(values, (2, 0, 4, 0))
             elif stat.region == 'US':
                 self.assertEqual(values, (0, 0, 0, 6))
+
+    def test_update(self):
+        CellAreaFactory(radio=Radio.gsm, region='DE', num_cells=1)
+        # the wifis are only counted in a recount
+        WifiShardFactory.create_batch(5, region='DE')
+        self.session.add(RegionStat(region='DE', gsm=3, wifi=2))
+        self.session.add(RegionStat(region='TW', wifi=1))
+        self.session.add(RegionStat(region='US', wifi=1))
+        self.session.flush()
+
+        counter = RegionStatCounter('wifi')
+        with redis_pipeline(self.redis_client) as pipe:
+            counter.incr(pipe, 'DE', 3)
+            counter.incr(pipe, 'DE', -2)
+            counter.incr(pipe, 'TW', -1)
+            counter.incr(pipe, 'FR', 2)
+
+        update_statregion.delay().get()
+        stats = dict([(stat.region, (stat.gsm, stat.wifi))
+                      for stat in self.session.query(RegionStat).all()])
+        self.assertEqual(stats, {'DE': (1, 3), 'FR': (0, 2), 'US': (0, 1)})
+        self.assertEqual(counter.swap(self.redis_client), {})
+
+    def test_lease(self):
+        counter = RegionStatCounter('wifi')
+        with redis_pipeline(self.redis_client) as pipe:
+            counter.incr(pipe, 'DE', 2)
+        lease = Lease('update_statregion',
+                      self.redis_client, self.stats_client)
+        self.assertTrue(lease.acquire())
+        # another update or recount holds the lease, nothing is done
+        update_statregion.delay().get()
+        update_statregion.delay(recount=True).get()
+        self.assertEqual(self.session.query(RegionStat).count(), 0)
+
+        lease.release()
+        update_statregion.delay().get()
+        self.assertEqual(self.session.query(RegionStat).one().wifi, 2)
+
+
+class TestStatsCache(CeleryTestCase):
+
+    def setUp(self):
+        super(TestStatsCache, self).setUp()
+        self.stats_cache = StatsCache(self.redis_client, self.stats_client)
+        self.yesterday = util.utcnow().date() - timedelta(1)
+
+    def test_refresh(self):
+        self.assertEqual(refresh_stats_cache.delay().get(), 6)
+        self.assertEqual(self.stats_cache.stale(['stats', 'leaders']), [])
+        # fresh data isn't recomputed
+        self.assertEqual(refresh_stats_cache.delay().get(), 0)
+
+        self.stats_cache.expire(['leaders'])
+        self.assertEqual(self.stats_cache.stale(['stats', 'leaders']),
+                         ['leaders'])
+        self.assertEqual(refresh_stats_cache.delay().get(), 1)
+
+    def test_refresh_busy(self):
+        refresh_stats_cache.delay().get()
+        lease = Lease('refresh_stats_cache',
+                      self.redis_client, self.stats_client)
+        self.assertTrue(lease.acquire())
+        # another task holds the lease, the data is left stale
+        self.assertEqual(refresh_stats_cache.delay(
+            names=['stats'], expire=True).get(), 0)
+        self.assertEqual(self.stats_cache.stale(['stats']), ['stats'])
+
+        lease.release()
+        self.assertEqual(refresh_stats_cache.delay().get(), 1)
+
+    def test_update_statcounter(self):
+        refresh_stats_cache.delay().get()
+        stats = self.stats_cache.get('stats', None)
+        self.assertEqual(stats['metrics2'][0]['value'], '0.00')
+
+        self.session.add(Stat(key=StatKey.unique_wifi,
+                              time=self.yesterday - timedelta(1),
+                              value=3000000))
+        self.session.flush()
+        update_statcounter.delay(ago=1).get()
+
+        stats = self.stats_cache.get('stats', None)
+        self.assertEqual(stats['metrics2'][0]['value'], '3.00')
+        self.assertEqual(self.stats_cache.stale(['stats', 'stats_regions']),
+                         [])
+
+    def test_update_statregion(self):
+        refresh_stats_cache.delay().get()
+        self.assertEqual(self.stats_cache.get('stats_regions', None), [])
+
+        CellAreaFactory(radio=Radio.gsm, region='DE', num_cells=1)
+        self.session.flush()
+        update_statregion.delay().get()
+
+        regions = self.stats_cache.get('stats_regions', None)
+        self.assertEqual([(region['code'], region['gsm'])
+                          for region in regions], [('DE', 1)])
@@ -0,0 +1,177 @@
+"""
+A compact, versioned binary format for cell and wifi observations
+and their pre-aggregated form.
+This format is used inside the Redis data queues but is not suitable
+for any external communication with third party systems.
+
+Each item consists of a fixed header with the format version, the
+observation type and a bitmask of the fields present in the item,
+followed by the values of all present fields in a fixed order.
+"""
+
+import binascii
+import struct
+
+from ichnaea.models.cell import Radio
+from ichnaea.models.observation import (
+    CellAggregate,
+    CellObservation,
+    WifiAggregate,
+    WifiObservation,
+)
+
+BINARY_VERSION = 1  #: Current version of the binary format.
+HEADER = struct.Struct('!BBH')  #: Version, observation type, field mask.
+
+_REPORT_FIELDS = (
+    ('lat', 'd', float, float),
+    ('lon', 'd', float, float),
+    ('accuracy', 'd', float, float),
+    ('altitude', 'd', float, float),
+    ('altitude_accuracy', 'd', float, float),
+    ('heading', 'd', float, float),
+    ('speed', 'd', float, float),
+)
+
+_AGGREGATE_FIELDS = (
+    ('samples', 'I', int, int),
+    ('lat_sum', 'd', float, float),
+    ('lon_sum', 'd', float, float),
+    ('max_lat', 'd', float, float),
+    ('min_lat', 'd', float, float),
+    ('max_lon', 'd', float, float),
+    ('min_lon', 'd', float, float),
+)
+
+
+def _dump_mac(value):
+    return binascii.unhexlify(value)
+
+
+def _load_mac(value):
+    return binascii.hexlify(value).decode('ascii')
+
+
+class BinaryFormat(object):
+    """
+    A BinaryFormat describes the binary layout of one observation type.
+
+    :param type_id: A unique single byte id for the observation type.
+    :param klass: The observation class.
+    :param fields: A sequence of tuples of field name, struct format,
+                   a function to convert the value into its binary
+                   form and a function to convert it back.
+    """
+
+    def __init__(self, type_id, klass, fields):
+        self.type_id = type_id
+        self.klass = klass
+        self.fields = fields
+        self._structs = {}
+
+    def _struct(self, mask):
+        value = self._structs.get(mask)
+        if value is None:
+            fmt = '!'
+            for i, field in enumerate(self.fields):
+                if mask & (1 << i):
+                    fmt += field[1]
+            self._structs[mask] = value = struct.Struct(fmt)
+        return value
+
+    def dumps(self, obj):
+        mask = 0
+        values = []
+        for i, (name, fmt, dump, load) in enumerate(self.fields):
+            value = getattr(obj, name, None)
+            if value is not None:
+                mask |= 1 << i
+                values.append(dump(value))
+        return (HEADER.pack(BINARY_VERSION, self.type_id, mask) +
+                self._struct(mask).pack(*values))
+
+    def loads(self, mask, data):
+        values = self._struct(mask).unpack(data)
+        kw = {}
+        pos = 0
+        for i, (name, fmt, dump, load) in enumerate(self.fields):
+            if mask & (1 << i):
+                kw[name] = load(values[pos])
+                pos += 1
+        return self.klass(**kw)
+
+
+_CELL_FIELDS = (
+    ('radio', 'B', int, Radio),
+    ('mcc', 'H', int, int),
+    ('mnc', 'H', int, int),
+    ('lac', 'I', int, int),
+    ('cid', 'I', int, int),
+    ('psc', 'H', int, int),
+    ('asu', 'h', int, int),
+    ('signal', 'h', int, int),
+    ('ta', 'h', int, int),
+)
+
+_WIFI_FIELDS = (
+    ('key', '6s', _dump_mac, _load_mac),
+    ('channel', 'H', int, int),
+    ('signal', 'h', int, int),
+    ('snr', 'h', int, int),
+)
+
+CELL_FORMAT = BinaryFormat(
+    1, CellObservation,
+    _CELL_FIELDS + _REPORT_FIELDS)  #: Binary format of a cell observation.
+
+WIFI_FORMAT = BinaryFormat(
+    2, WifiObservation,
+    _WIFI_FIELDS + _REPORT_FIELDS)  #: Binary format of a wifi observation.
+
+CELL_AGGREGATE_FORMAT = BinaryFormat(
+    3, CellAggregate,
+    _CELL_FIELDS + _AGGREGATE_FIELDS)  #: Binary format of a cell aggregate.
+
+WIFI_AGGREGATE_FORMAT = BinaryFormat(
+    4, WifiAggregate,
+    _WIFI_FIELDS + _AGGREGATE_FIELDS)  #: Binary format of a wifi aggregate.
+
+FORMATS = dict([(fmt.type_id, fmt) for fmt in (
+    CELL_FORMAT, WIFI_FORMAT, CELL_AGGREGATE_FORMAT, WIFI_AGGREGATE_FORMAT)])
+_CLASS_FORMATS = dict([(fmt.klass, fmt) for fmt in FORMATS.values()])
+
+
+def binary_dumps(obj):
+    """
+    Dump an observation into the binary format.
+
+    Raises a :exc:`TypeError` for unsupported objects and a
+    :exc:`ValueError` if a field value doesn't fit the format.
+    """
+    fmt = _CLASS_FORMATS.get(type(obj))
+    if fmt is None:
+        raise TypeError('%r has no binary format.' % obj)
+    try:
+        return fmt.dumps(obj)
+    except (binascii.Error, struct.error, TypeError) as exc:
+        raise ValueError(str(exc))
+
+
+def binary_loads(value):
+    """
+    Load an observation from a bytes object in the binary format.
+    """
+    version, type_id, mask = HEADER.unpack(value[:HEADER.size])
+    if version != BINARY_VERSION:
+        raise ValueError('Unsupported binary version: %s' % version)
+    return FORMATS[type_id].loads(mask, value[HEADER.size:])
+
+
+def is_binary(value):
+    """
+    Does the bytes object use the binary format?
+
+    Items in the internal JSON format always start with an opening
+    brace, while all binary items start with a version byte.
+    """
+    return value[:1] not in (b'{', u'{')
@@ -0,0 +1,116 @@
+"""
+Redis backed leaderboards, which are updated together with the user
+scores, so showing them doesn't require summing up the score table.
+"""
+
+from datetime import timedelta
+
+WEEKLY_DAYS = 8  #: Number of days, including today, in a weekly total.
+
+
+class Leaderboard(object):
+    """
+    The score totals of all users in Redis sorted sets, one per score
+    key, with the user ids as members.
+
+    Next to the all-time totals, there is a set per score key and day,
+    which are combined into the totals of the last days on demand.
+
+    The leaderboard is only used once it has been marked as ready,
+    which happens after it has been built from the score table.
+
+    :param redis_client: A Redis client.
+    """
+
+    day_ttl = 9 * 86400  #: Time in seconds after which day sets expire.
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def key(self, score_key, day=None):
+        """
+        Returns the Redis key of the all-time totals for the score key
+        or the key of the totals of a single day.
+        """
+        key = 'leaders:%s' % score_key.name
+        if day is not None:
+            key += ':' + day.strftime('%Y%m%d')
+        return key.encode('ascii')
+
+    def ready_key(self):
+        """Returns the Redis key marking the leaderboard as built."""
+        return b'leaders:ready'
+
+    def ready(self):
+        """Returns `True` if the leaderboard has been built."""
+        return bool(self.redis_client.exists(self.ready_key()))
+
+    def add(self, pipe, userid, score_key, day, value):
+        """Add a score value of a user on the given day."""
+        pipe.zincrby(self.key(score_key), userid, value)
+        day_key = self.key(score_key, day)
+        pipe.zincrby(day_key, userid, value)
+        pipe.expire(day_key, self.day_ttl)
+
+    def replace(self, totals, day_totals):
+        """
+        Replace the leaderboard and mark it as ready.
+
+        :param totals: A dict mapping score keys to dicts of user ids
+                       and their all-time totals.
+        :param day_totals: A dict mapping (score key, day) tuples to
+                           dicts of user ids and their totals that day.
+        """
+        values = [(self.key(score_key), scores, None)
+                  for score_key, scores in totals.items()]
+        values.extend([(self.key(score_key, day), scores, self.day_ttl)
+                       for (score_key, day), scores in day_totals.items()])
+
+        with self.redis_client.pipeline() as pipe:
+            for key, scores, ttl in values:
+                # build the new sets aside and switch over at once
+                pipe.delete(key + b':new')
+                items = []
+                for userid, value in scores.items():
+                    items.extend([value, userid])
+                for i in range(0, len(items), 2000):
+                    pipe.zadd(key + b':new', *items[i:i + 2000])
+            pipe.execute()
+
+            for key, scores, ttl in values:
+                if not scores:
+                    pipe.delete(key)
+                    continue
+                pipe.rename(key + b':new', key)
+                if ttl:
+                    pipe.expire(key, ttl)
+            pipe.set(self.ready_key(), b'1')
+            pipe.execute()
+
+    def _scores(self, values):
+        return [(int(userid), int(value)) for userid, value in values]
+
+    def top(self, score_key, min_value=1):
+        """
+        Returns a list of (user id, value) tuples of all users with an
+        all-time total of at least `min_value`, sorted by descending
+        value.
+        """
+        return self._scores(self.redis_client.zrevrangebyscore(
+            self.key(score_key), '+inf', min_value, withscores=True))
+
+    def top_days(self, score_key, day, days, limit):
+        """
+        Returns a list of (user id, value) tuples of the `limit` users
+        with the highest totals over the `days` days up to and including
+        the given day, sorted by descending value.
+        """
+        day_keys = [self.key(score_key, day - timedelta(days=i))
+                    for i in range(days)]
+        union_key = self.key(score_key) + b':union'
+        with self.redis_client.pipeline() as pipe:
+            pipe.zunionstore(union_key, day_keys)
+            pipe.zrevrange(union_key, 0, limit - 1, withscores=True)
+            pipe.delete(union_key)
+            values = pipe.execute()[1]
+        return self._scores(values)
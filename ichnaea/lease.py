@@ -0,0 +1,114 @@
+"""
+Redis based leases, used to make sure only a single consumer works
+on a shared resource like a database table shard at any time.
+"""
+
+import time
+import uuid
+
+# Only touch the lease if it is still held by the given token.
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('set', KEYS[2], ARGV[2], 'EX', tonumber(ARGV[3]))
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLost(Exception):
+    """
+    Raised by a consumer noticing that its lease has expired and might
+    be held by another consumer, before it writes any changes.
+    """
+
+
+class Lease(object):
+    """
+    A lease on a named resource, which can be held by a single
+    consumer at a time. The lease expires after `timeout` seconds,
+    unless it is renewed, so a crashed consumer can't block the
+    resource forever.
+
+    The lease emits metrics about contention and the time the
+    resource was worked on or left idle between two leases.
+
+    :param name: The name of the leased resource.
+    :param redis_client: A Redis client.
+    :param stats_client: A stats client.
+    :param timeout: The lease duration in seconds.
+    """
+
+    released_ttl = 86400  #: How long to remember the last release time.
+
+    def __init__(self, name, redis_client, stats_client, timeout=60):
+        self.name = name
+        self.redis_client = redis_client
+        self.stats_client = stats_client
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        self.acquired = None
+        self._renew_script = redis_client.register_script(_RENEW_SCRIPT)
+        self._release_script = redis_client.register_script(_RELEASE_SCRIPT)
+
+    def key(self):
+        """Returns the Redis key of the lease."""
+        return ('lease:%s' % self.name).encode('ascii')
+
+    def released_key(self):
+        """Returns the Redis key storing the time of the last release."""
+        return ('lease:%s:released' % self.name).encode('ascii')
+
+    def _tags(self, result=None):
+        tags = ['lease:' + self.name]
+        if result:
+            tags.append('result:' + result)
+        return tags
+
+    def acquire(self):
+        """Try to acquire the lease, returns `True` on success."""
+        acquired = self.redis_client.set(
+            self.key(), self.token, nx=True, ex=self.timeout)
+        if not acquired:
+            self.stats_client.incr('lease.acquire', tags=self._tags('busy'))
+            return False
+
+        self.acquired = now = time.time()
+        self.stats_client.incr('lease.acquire', tags=self._tags('success'))
+        released = self.redis_client.get(self.released_key())
+        if released is not None:
+            idle = max(now - float(released), 0.0)
+            self.stats_client.timing(
+                'lease.idle', int(idle * 1000), tags=self._tags())
+        return True
+
+    def renew(self):
+        """
+        Extend the lease by another `timeout` seconds. Returns `False`
+        if the lease has been lost in the meantime.
+        """
+        renewed = bool(self._renew_script(
+            keys=[self.key()], args=[self.token, self.timeout]))
+        if not renewed:
+            self.stats_client.incr('lease.renew', tags=self._tags('lost'))
+        return renewed
+
+    def release(self):
+        """Release the lease, if it is still held by this consumer."""
+        if self.acquired is None:
+            return
+        now = time.time()
+        self._release_script(
+            keys=[self.key(), self.released_key()],
+            args=[self.token, repr(now), self.released_ttl])
+        self.stats_client.timing(
+            'lease.work', int((now - self.acquired) * 1000),
+            tags=self._tags())
+        self.acquired = None
@@ -20,7 +20,10 @@ from ichnaea.models.cell import (  # NOQA
 from ichnaea.models.content import (  # NOQA
     DataMap,
     RegionStat,
+    RegionStatCounter,
     Score,
+    SCORE_ROLLUP_DAY,
+    ScoreCounter,
     ScoreKey,
     Stat,
     StatCounter,
@@ -28,9 +31,12 @@ from ichnaea.models.content import (  # NOQA
     User,
 )
 from ichnaea.models.observation import (  # NOQA
+    CellAggregate,
     CellObservation,
     CellReport,
+    ObservationAggregate,
     Report,
+    WifiAggregate,
     WifiObservation,
     WifiReport,
 )
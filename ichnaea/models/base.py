@@ -36,6 +36,8 @@ class JSONMixin(object):
     via our internal JSON format back into an instance of the class.
     """
 
+    __slots__ = ()
+
     @property
     def _dottedname(self):
         """"Returns a fully qualified import path to this class."""
@@ -78,6 +80,8 @@ class ValidationMixin(object):
     A mixin to tie a class and its valid colander schema together.
     """
 
+    __slots__ = ()
+
     _valid_schema = None  #:
 
     @classmethod
@@ -101,6 +105,8 @@ class CreationMixin(ValidationMixin):
     keyword arguments before creating an instance of the class.
     """
 
+    __slots__ = ()
+
     @classmethod
     def create(cls, _raise_invalid=False, **kw):
         """
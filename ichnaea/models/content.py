@@ -1,4 +1,5 @@
 import base64
+from datetime import date
 import struct
 
 from enum import IntEnum
@@ -38,6 +39,24 @@ latitude and longitude each moved to the positive space by adding
 
 DATAMAP_SHARDS = {}
 
+SCORE_ROLLUP_DAY = date(1970, 1, 1)
+"""
+The day of the score rows, into which the daily scores of each user
+are rolled up once they are old enough.
+"""
+
+# Move the counter hash aside for processing, unless the hash of an
+# earlier run is still waiting there, and return its fields and values.
+_HASH_SWAP_SCRIPT = """
+if redis.call('exists', KEYS[2]) == 0 then
+    if redis.call('exists', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('rename', KEYS[1], KEYS[2])
+end
+return redis.call('hgetall', KEYS[2])
+"""
+
 
 class ScoreKey(IntEnum):
     location = 0
@@ -229,7 +248,7 @@ class ScoreHashKey(HashKey):
         return cls(**data)
 
     def _to_json_value(self):
-        value = self.__dict__.copy()
+        value = self._asdict()
         value['key'] = int(value['key'])
         return value
 
@@ -274,6 +293,91 @@ class StatCounter(object):
         pipe.expire(self.redis_key, 172800)  # 2 days
 
 
+class HashCounter(object):
+    """
+    Increments summed up in a Redis hash, until they are moved into
+    the database. Subclasses define the `redis_key`.
+    """
+
+    redis_key = None  #:
+
+    @property
+    def processing_key(self):
+        return self.redis_key + ':processing'
+
+    def _incr(self, pipe, field, amount):
+        pipe.hincrby(self.redis_key, field, amount)
+
+    def _swap(self, redis_client):
+        script = redis_client.register_script(_HASH_SWAP_SCRIPT)
+        values = script(keys=[self.redis_key, self.processing_key])
+        return [(values[i], int(values[i + 1]))
+                for i in range(0, len(values), 2)]
+
+    def swap(self, redis_client):
+        """
+        Atomically move the current increments aside and return them,
+        as a dict mapping the hash fields to values.
+
+        The increments are returned again by later calls, until they
+        are removed via :meth:`remove`.
+        """
+        return dict(self._swap(redis_client))
+
+    def remove(self, pipe):
+        """Remove the increments returned by :meth:`swap`."""
+        pipe.delete(self.processing_key)
+
+
+class RegionStatCounter(HashCounter):
+    """
+    Changes to the number of stations of one type in each region,
+    with one hash field per region.
+    """
+
+    def __init__(self, stat_key):
+        self.stat_key = stat_key
+        self.redis_key = 'statregion_{key}'.format(key=stat_key)
+
+    def incr(self, pipe, region, amount):
+        self._incr(pipe, region, amount)
+
+    def swap(self, redis_client):
+        """
+        Returns a dict mapping regions to changes, see
+        :meth:`HashCounter.swap`.
+        """
+        return dict([(region.decode('ascii'), value)
+                     for region, value in self._swap(redis_client)])
+
+
+class ScoreCounter(HashCounter):
+    """
+    The score increments of a single day, with one hash field per
+    user id and score key.
+    """
+
+    def __init__(self, day):
+        self.day = day
+        self.redis_key = 'scorecounter_{date}'.format(
+            date=day.strftime('%Y%m%d'))
+
+    def incr(self, pipe, userid, score_key, amount):
+        self._incr(pipe, '%s:%s' % (userid, int(score_key)), amount)
+        pipe.expire(self.redis_key, 172800)  # 2 days
+
+    def swap(self, redis_client):
+        """
+        Returns a dict mapping (userid, score key) tuples to values,
+        see :meth:`HashCounter.swap`.
+        """
+        result = {}
+        for field, value in self._swap(redis_client):
+            userid, score_key = field.split(b':')
+            result[(int(userid), ScoreKey(int(score_key)))] = value
+        return result
+
+
 class Stat(_Model):
     """Stat model."""
 
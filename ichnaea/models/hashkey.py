@@ -2,7 +2,10 @@
 Classes representing unique hashable keys and related database query helpers.
 """
 
-from six import string_types
+from six import (
+    add_metaclass,
+    string_types,
+)
 from sqlalchemy.sql import and_, or_
 
 from ichnaea.models.base import JSONMixin
@@ -10,24 +13,64 @@ from ichnaea.models.base import JSONMixin
 _sentinel = object()
 
 
+class HashKeyField(object):
+    """
+    A descriptor giving access to a single value of a hashkey,
+    based on the position of the field in the classes _fields.
+    """
+
+    __slots__ = ('index', )
+
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        return obj._values[self.index]
+
+    def __set__(self, obj, value):
+        obj._values[self.index] = value
+        # invalidate the cached hash
+        obj._hash = None
+
+
+class HashKeyMeta(type):
+    """
+    A metaclass adding a :class:`HashKeyField` for each of the names
+    in the classes _fields. It also adds empty __slots__ to all
+    subclasses, so their instances don't get an instance dictionary.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        namespace.setdefault('__slots__', ())
+        for index, field in enumerate(namespace.get('_fields', ())):
+            namespace[field] = HashKeyField(index)
+        return super(HashKeyMeta, mcs).__new__(mcs, name, bases, namespace)
+
+
+@add_metaclass(HashKeyMeta)
 class HashKey(JSONMixin):
     """
     A class representing a unique combination of fields, much like a
     namedtuple. Instances of this class can be used as dictionary keys.
+
+    All values are stored in a single list slot in the order of the
+    _fields definition. Only the base class defines non-empty slots,
+    so subclasses can still be combined via multiple inheritance.
     """
 
+    __slots__ = ('_values', '_hash')
     _fields = ()  #:
 
     def __init__(self, **kw):
-        for field in self._fields:
-            if field in kw:
-                setattr(self, field, kw[field])
-            else:
-                setattr(self, field, None)
+        self._values = [kw.get(field) for field in self._fields]
+        self._hash = None
 
     def __eq__(self, other):
         if isinstance(other, HashKey):
-            return self.__dict__ == other.__dict__
+            return (self._values == other._values and
+                    self._fields == other._fields)
         return False
 
     def __ne__(self, other):
@@ -36,15 +79,23 @@ class HashKey(JSONMixin):
     def __hash__(self):
         """
         Returns a hash of a tuple of the instance values in the same
-        order as the _fields definition.
+        order as the _fields definition. The hash is cached until
+        one of the values changes.
         """
-        value = ()
-        for field in self._fields:
-            value += (getattr(self, field, None), )
-        return hash(value)
+        if self._hash is None:
+            self._hash = hash(tuple(self._values))
+        return self._hash
 
     def __repr__(self):
-        return '{cls}: {data}'.format(cls=self._dottedname, data=self.__dict__)
+        return '{cls}: {data}'.format(cls=self._dottedname,
+                                      data=self._asdict())
+
+    def _asdict(self):
+        """Returns a new dict mapping field names to their values."""
+        return dict(zip(self._fields, self._values))
+
+    def _to_json_value(self):
+        return self._asdict()
 
 
 class HashKeyQueryMixin(object):
@@ -112,7 +163,9 @@ class HashKeyQueryMixin(object):
 
         key_filters = []
         for key in keys:
-            # create a list of 'and' criteria for each hash key component
+            # create a list of 'and' criteria for each hash key component,
+            # which MySQL 5.6 resolves as index range lookups, unlike
+            # row constructor IN lists
             key_filters.append(and_(*cls.joinkey(key)))
         return session.query(cls).filter(or_(*key_filters))
 
@@ -91,7 +91,7 @@ class Report(HashKey, CreationMixin, ValidationMixin):
     def combine(cls, *reports):
         values = {}
         for report in reports:
-            values.update(report.__dict__)
+            values.update(report._asdict())
         return cls(**values)
 
 
@@ -248,3 +248,77 @@ class WifiObservation(WifiReport, Report):
 
     _valid_schema = ValidWifiObservationSchema()
     _fields = WifiReport._fields + Report._fields
+
+
+class ObservationAggregate(object):
+    """
+    A mixin for a pre-aggregated set of observations of a single station.
+
+    The aggregate keeps the number of observations, the sums of their
+    positions and their bounding box. The station specific fields
+    like the signal strength are taken from the latest observation.
+    """
+
+    __slots__ = ()
+
+    _aggregate_fields = (
+        'samples',
+        'lat_sum',
+        'lon_sum',
+        'max_lat',
+        'min_lat',
+        'max_lon',
+        'min_lon',
+    )
+
+    @classmethod
+    def from_observation(cls, obs):
+        """Start a new aggregate based on a single observation."""
+        values = {}
+        for field in cls._fields:
+            values[field] = getattr(obs, field, None)
+        values.update({
+            'samples': 1,
+            'lat_sum': obs.lat,
+            'lon_sum': obs.lon,
+            'max_lat': obs.lat,
+            'min_lat': obs.lat,
+            'max_lon': obs.lon,
+            'min_lon': obs.lon,
+        })
+        return cls(**values)
+
+    def add(self, obs):
+        """Add another observation of the same station."""
+        for field in self._fields:
+            if field not in self._aggregate_fields:
+                value = getattr(obs, field, None)
+                if value is not None:
+                    setattr(self, field, value)
+        self.samples += 1
+        self.lat_sum += obs.lat
+        self.lon_sum += obs.lon
+        self.max_lat = max(self.max_lat, obs.lat)
+        self.min_lat = min(self.min_lat, obs.lat)
+        self.max_lon = max(self.max_lon, obs.lon)
+        self.min_lon = min(self.min_lon, obs.lon)
+
+    @property
+    def lat(self):
+        return self.lat_sum / self.samples
+
+    @property
+    def lon(self):
+        return self.lon_sum / self.samples
+
+
+class CellAggregate(CellReport, ObservationAggregate):
+    """A class for pre-aggregated cell observations."""
+
+    _fields = CellReport._fields + ObservationAggregate._aggregate_fields
+
+
+class WifiAggregate(WifiReport, ObservationAggregate):
+    """A class for pre-aggregated wifi observations."""
+
+    _fields = WifiReport._fields + ObservationAggregate._aggregate_fields
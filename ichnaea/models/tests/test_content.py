@@ -1,3 +1,5 @@
+import mock
+
 from ichnaea.models.content import (
     decode_datamap_grid,
     encode_datamap_grid,
@@ -162,6 +164,27 @@ class TestScore(DBTestCase):
         self.assertEqual(int(result.key), 0)
         self.assertEqual(result.key.name, 'location')
 
+    def test_iterkeys(self):
+        utcday = util.utcnow().date()
+        for userid in range(1, 5):
+            for key in (ScoreKey.location, ScoreKey.new_cell):
+                self.session.add(Score(
+                    key=key, userid=userid, time=utcday, value=userid))
+        self.session.flush()
+
+        keys = [Score.to_hashkey(key=ScoreKey.location,
+                                 userid=userid, time=utcday)
+                for userid in range(1, 7)]
+        # keys with missing values don't match any rows
+        keys.append(Score.to_hashkey(
+            key=ScoreKey.new_cell, userid=4, time=None))
+        with mock.patch.object(Score, '_query_batch', 2):
+            scores = list(Score.iterkeys(self.session, keys))
+        self.assertEqual(
+            sorted([score.userid for score in scores]), [1, 2, 3, 4])
+        self.assertEqual(
+            set([score.key for score in scores]), set([ScoreKey.location]))
+
 
 class TestStat(DBTestCase):
 
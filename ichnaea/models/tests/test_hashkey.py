@@ -88,6 +88,24 @@ class TestHashKey(TestCase):
         self.assertNotEqual(empty, {})
         self.assertNotEqual(empty, object())
 
+    def test_slots(self):
+        double = Double(one=1)
+        self.assertFalse(hasattr(double, '__dict__'))
+        with self.assertRaises(AttributeError):
+            double.three = 3
+
+    def test_hash_changes(self):
+        double = Double(one=1)
+        self.assertEqual(hash(double), hash((1, None)))
+        double.two = 2
+        self.assertEqual(hash(double), hash((1, 2)))
+        self.assertEqual(double, Double(one=1, two=2))
+
+    def test_asdict(self):
+        double = Double(one=1)
+        self.assertEqual(double._asdict(), {'one': 1, 'two': None})
+        self.assertEqual(double._to_json_value(), {'one': 1, 'two': None})
+
     def test_json(self):
         double = Double(one=1.1, two='two')
         new_double = internal_loads(internal_dumps(double))
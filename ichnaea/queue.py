@@ -3,10 +3,17 @@ Functionality related to custom Redis based queues.
 """
 
 import re
+import time
+import uuid
 
 from six.moves.urllib.parse import urlparse
 
 from ichnaea.cache import redis_pipeline
+from ichnaea.internalbinary import (
+    binary_dumps,
+    binary_loads,
+    is_binary,
+)
 from ichnaea.internaljson import (
     internal_dumps,
     internal_loads,
@@ -15,11 +22,181 @@ from ichnaea.internaljson import (
 EXPORT_QUEUE_PREFIX = 'queue_export_'
 WHITESPACE = re.compile('\s', flags=re.UNICODE)
 
+# Atomically move up to ARGV[1] items from the head of the queue list
+# into a processing list and register the processing list with its
+# deadline in the sorted set of active claims.
+_CLAIM_SCRIPT = """
+local items = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+local count = #items
+if count > 0 then
+    redis.call('ltrim', KEYS[1], count, -1)
+    for i = 1, count do
+        redis.call('rpush', KEYS[2], items[i])
+    end
+    redis.call('expire', KEYS[2], tonumber(ARGV[3]))
+    redis.call('zadd', KEYS[3], tonumber(ARGV[2]), KEYS[2])
+end
+return items
+"""
+
+# Move all items of a processing list back to the head of the queue
+# list, keeping their order, and remove the claim. The reclaims of
+# each item are counted in a hash and items reclaimed ARGV[2] times
+# are moved to the dead-letter list instead.
+_RECLAIM_SCRIPT = """
+local items = redis.call('lrange', KEYS[2], 0, -1)
+local requeue = {}
+local dead = 0
+for i = 1, #items do
+    local attempts = redis.call('hincrby', KEYS[4], items[i], 1)
+    if attempts >= tonumber(ARGV[2]) then
+        redis.call('hdel', KEYS[4], items[i])
+        redis.call('rpush', KEYS[5], items[i])
+        dead = dead + 1
+    else
+        requeue[#requeue + 1] = items[i]
+    end
+end
+for i = #requeue, 1, -1 do
+    redis.call('lpush', KEYS[1], requeue[i])
+end
+if #requeue > 0 then
+    redis.call('expire', KEYS[1], tonumber(ARGV[1]))
+    redis.call('expire', KEYS[4], tonumber(ARGV[1]))
+end
+if dead > 0 then
+    redis.call('expire', KEYS[5], tonumber(ARGV[3]))
+end
+redis.call('del', KEYS[2])
+redis.call('zrem', KEYS[3], KEYS[2])
+return {#requeue, dead}
+"""
+
+# Forget the reclaim counts of the items of a processing list and
+# remove the claim.
+_ACK_SCRIPT = """
+if redis.call('exists', KEYS[3]) == 1 then
+    local items = redis.call('lrange', KEYS[1], 0, -1)
+    for i = 1, #items do
+        redis.call('hdel', KEYS[3], items[i])
+    end
+end
+redis.call('del', KEYS[1])
+redis.call('zrem', KEYS[2], KEYS[1])
+return 1
+"""
+
+# Add all items in ARGV[3:] to the sorted set, unless they are already
+# in it, using the time in ARGV[1] as their score. Then signal waiting
+# consumers via a list holding at most one element.
+_UNIQUE_PUSH_SCRIPT = """
+local added = 0
+for i = 3, #ARGV do
+    if not redis.call('zscore', KEYS[1], ARGV[i]) then
+        added = added + redis.call('zadd', KEYS[1], ARGV[1], ARGV[i])
+    end
+end
+redis.call('expire', KEYS[1], tonumber(ARGV[2]))
+redis.call('lpush', KEYS[2], 1)
+redis.call('ltrim', KEYS[2], 0, 0)
+redis.call('expire', KEYS[2], tonumber(ARGV[2]))
+return added
+"""
+
+# Atomically remove and return up to ARGV[1] of the oldest items,
+# or all items if ARGV[1] is 0.
+_UNIQUE_POP_SCRIPT = """
+local items = redis.call('zrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('zremrangebyrank', KEYS[1], 0, #items - 1)
+end
+return items
+"""
+
+
+class JSONCodec(object):
+    """A codec storing queue items in the internal JSON format."""
+
+    def encode(self, item):
+        return str(internal_dumps(item))
+
+    def decode(self, value):
+        return internal_loads(value)
+
+
+class BinaryCodec(JSONCodec):
+    """
+    A codec storing observations in the compact internal binary format.
+
+    Other items and observations with values not supported by the
+    binary format are stored in the internal JSON format. Both formats
+    are transparently decoded.
+    """
+
+    def encode(self, item):
+        try:
+            return binary_dumps(item)
+        except (TypeError, ValueError):
+            return super(BinaryCodec, self).encode(item)
+
+    def decode(self, value):
+        if is_binary(value):
+            return binary_loads(value)
+        return super(BinaryCodec, self).decode(value)
+
+
+CODECS = {
+    'binary': BinaryCodec(),
+    'json': JSONCodec(),
+}  #: Available queue item codecs, keyed by name.
+
+
+def enqueue_reports(export_queues, reports, pipe, api_key=None,
+                    email=None, ip=None, nickname=None, internal=None):
+    """
+    Add the reports together with their metadata to all export queues,
+    which accept reports for the given API key.
+
+    :param export_queues: A dict of :class:`ExportQueue` instances.
+    :param pipe: A Redis pipeline used for all queue operations.
+    :param api_key: The valid API key string the reports were sent with.
+    :param internal: An optional list with one already validated report
+                     in the trusted internal format or None per report.
+                     These are only added to internal export queues.
+    """
+    metadata = {
+        'api_key': api_key,
+        'email': email,
+        'ip': ip,
+        'nickname': nickname,
+    }
+    items = []
+    for report in reports:
+        items.append({'report': report, 'metadata': metadata})
+
+    internal_items = items
+    if internal is not None:
+        internal_items = []
+        for item, value in zip(items, internal):
+            if value is not None:
+                item = dict(item, internal=value)
+            internal_items.append(item)
+
+    if items:
+        for queue in export_queues.values():
+            if queue.export_allowed(api_key):
+                queue_items = items
+                if queue.scheme == 'internal':
+                    queue_items = internal_items
+                queue.enqueue(
+                    queue_items, queue.queue_key(api_key), pipe=pipe)
+
 
 class BaseQueue(object):
     """
     A Redis based queue which stores items formatted via internaljson
-    in lists.
+    in lists. Queues can use a different codec, for example the
+    compact binary format from :mod:`ichnaea.internalbinary`.
 
     The lists maintain a TTL value corresponding to the time data has
     been last put into the queue.
@@ -32,9 +209,10 @@ class BaseQueue(object):
     queue_ttl = 86400  #: Maximum TTL value for the Redis list.
     queue_max_age = 3600  #: Maximum age that data can sit in the queue.
 
-    def __init__(self, name, redis_client):
+    def __init__(self, name, redis_client, codec='json'):
         self.name = name
         self.redis_client = redis_client
+        self.codec = CODECS[codec]
 
     def _dequeue(self, queue_key, batch, json=True):
         with self.redis_client.pipeline() as pipe:
@@ -47,7 +225,7 @@ class BaseQueue(object):
                 pipe.ltrim(queue_key, 1, 0)
             result = pipe.execute()[0]
             if json:
-                result = [internal_loads(item) for item in result]
+                result = [self.codec.decode(item) for item in result]
         return result
 
     def _push(self, pipe, items, queue_key, batch=100):
@@ -60,7 +238,7 @@ class BaseQueue(object):
 
     def _enqueue(self, items, queue_key, batch=100, pipe=None, json=True):
         if json:
-            data = [str(internal_dumps(item)) for item in items]
+            data = [self.codec.encode(item) for item in items]
         else:
             # make a copy, since _push is modifying the list in-place
             data = list(items)
@@ -70,10 +248,13 @@ class BaseQueue(object):
             with redis_pipeline(self.redis_client) as pipe:
                 self._push(pipe, data, queue_key, batch=batch)
 
+    def _size(self, pipe, queue_key):
+        pipe.llen(queue_key)
+
     def _size_age(self, queue_key):
         with self.redis_client.pipeline() as pipe:
             pipe.ttl(queue_key)
-            pipe.llen(queue_key)
+            self._size(pipe, queue_key)
             ttl, size = pipe.execute()
         if ttl < 0:
             age = -1
@@ -83,10 +264,34 @@ class BaseQueue(object):
 
 
 class DataQueue(BaseQueue):
+    """
+    A named data queue.
+
+    A reliable queue doesn't remove items on dequeue. Instead
+    :meth:`claim` atomically moves them into a processing list unique
+    to each consumer. The consumer has to :meth:`ack` the claim once
+    it has processed the items. Claims which weren't acknowledged in
+    time, for example because the consumer died, are moved back into
+    the queue by :meth:`reclaim`. This allows multiple consumers per
+    queue without the risk of losing items. Items which were reclaimed
+    :attr:`max_attempts` times are moved to a dead-letter list, so a
+    single bad item can't fail its batches forever.
+    """
 
-    def __init__(self, name, redis_client, queue_key):
-        super(DataQueue, self).__init__(name, redis_client)
+    processing_timeout = 600  #: Time in seconds to acknowledge a claim.
+    max_attempts = 5  #: Number of claims before an item is given up.
+    dead_ttl = 7 * 86400  #: Maximum TTL value for the dead-letter list.
+
+    def __init__(self, name, redis_client, queue_key,
+                 codec='json', reliable=False):
+        super(DataQueue, self).__init__(name, redis_client, codec=codec)
         self._queue_key = queue_key
+        self.reliable = reliable
+        if reliable:
+            self._claim_script = redis_client.register_script(_CLAIM_SCRIPT)
+            self._reclaim_script = redis_client.register_script(
+                _RECLAIM_SCRIPT)
+            self._ack_script = redis_client.register_script(_ACK_SCRIPT)
 
     @property
     def monitor_name(self):
@@ -95,9 +300,81 @@ class DataQueue(BaseQueue):
     def queue_key(self):
         return self._queue_key
 
+    def claims_key(self):
+        """Returns the key of the sorted set of active claims."""
+        return self._queue_key + ':claims'
+
+    def attempts_key(self):
+        """Returns the key of the hash counting the item reclaims."""
+        return self._queue_key + ':attempts'
+
+    def dead_key(self):
+        """Returns the key of the dead-letter list."""
+        return self._queue_key + ':dead'
+
     def dequeue(self, batch=100, json=True):
         return self._dequeue(self.queue_key(), batch, json=json)
 
+    def claim(self, batch=100, json=True):
+        """
+        Claim up to `batch` items. For non-reliable queues this is the
+        same as :meth:`dequeue`.
+
+        Returns a two-tuple of a claim key, which needs to be passed to
+        :meth:`ack`, and the list of items.
+        """
+        if not self.reliable:
+            return (None, self.dequeue(batch=batch, json=json))
+
+        claim_key = '%s:processing:%s' % (self._queue_key, uuid.uuid4().hex)
+        result = self._claim_script(
+            keys=[self.queue_key(), claim_key, self.claims_key()],
+            args=[batch, int(time.time()) + self.processing_timeout,
+                  self.queue_ttl])
+        if json:
+            result = [self.codec.decode(item) for item in result]
+        return (claim_key, result)
+
+    def ack(self, claim_key, pipe=None):
+        """
+        Acknowledge that all items of the claim have been processed.
+
+        :param pipe: An optional Redis pipeline, which should only be
+                     executed after all changes based on the items have
+                     been committed.
+        """
+        if claim_key is None:
+            return
+        if pipe is None:
+            with redis_pipeline(self.redis_client) as pipe:
+                self.ack(claim_key, pipe=pipe)
+            return
+        self._ack_script(
+            keys=[claim_key, self.claims_key(), self.attempts_key()],
+            client=pipe)
+
+    def reclaim(self, now=None):
+        """
+        Move the items of all claims past their deadline back into the
+        queue, or into the dead-letter list once they have been claimed
+        :attr:`max_attempts` times. Returns a two-tuple of the number of
+        requeued and of dead items.
+        """
+        if not self.reliable:
+            return (0, 0)
+        if now is None:
+            now = int(time.time())
+        requeued = dead = 0
+        for claim_key in self.redis_client.zrangebyscore(
+                self.claims_key(), '-inf', now):
+            counts = self._reclaim_script(
+                keys=[self.queue_key(), claim_key, self.claims_key(),
+                      self.attempts_key(), self.dead_key()],
+                args=[self.queue_ttl, self.max_attempts, self.dead_ttl])
+            requeued += counts[0]
+            dead += counts[1]
+        return (requeued, dead)
+
     def enqueue(self, items, batch=100, pipe=None, json=True):
         self._enqueue(items, self.queue_key(),
                       batch=batch, pipe=pipe, json=json)
@@ -106,6 +383,18 @@ class DataQueue(BaseQueue):
         size, age = self.size_age()
         return bool(size > 0 and (size >= batch or age >= self.queue_max_age))
 
+    def wait(self, timeout=1):
+        """
+        Block for up to `timeout` seconds until the queue contains
+        items and return `True` if it does.
+
+        No items are removed. Redis has no blocking peek, so the last
+        item is rotated to the front of the queue instead.
+        """
+        key = self.queue_key()
+        return self.redis_client.brpoplpush(
+            key, key, timeout=timeout) is not None
+
     def size(self):
         return self._size_age(self.queue_key())[0]
 
@@ -113,6 +402,91 @@ class DataQueue(BaseQueue):
         return self._size_age(self.queue_key())
 
 
+class UniqueDataQueue(DataQueue):
+    """
+    A named data queue, which holds each distinct item only once.
+
+    The items are stored in a Redis sorted set, scored by the time they
+    were first added. Adding an item which is already queued is a no-op
+    and items are dequeued oldest first. This suits queues of keys, like
+    cell areas or data map grids, which are added far more often than
+    they need to be processed.
+
+    The queue is never reliable, as the processing of a single key can
+    always be repeated.
+
+    BBB: Items left in the list of a former plain data queue under
+    `legacy_key` are dequeued first and included in the queue size.
+    """
+
+    def __init__(self, name, redis_client, queue_key, codec='json',
+                 legacy_key=None):
+        super(UniqueDataQueue, self).__init__(
+            name, redis_client, queue_key, codec=codec)
+        self.legacy_key = legacy_key  # BBB
+        self._push_script = redis_client.register_script(
+            _UNIQUE_PUSH_SCRIPT)
+        self._pop_script = redis_client.register_script(_UNIQUE_POP_SCRIPT)
+
+    @property
+    def monitor_name(self):
+        return self.name
+
+    def signal_key(self):
+        """Returns the key of the list used to wake up consumers."""
+        return self._queue_key + ':signal'
+
+    def dequeue(self, batch=100, json=True):
+        if self.legacy_key:  # BBB
+            items = BaseQueue._dequeue(
+                self, self.legacy_key, batch, json=False)
+            if items:
+                # the list can contain duplicates
+                unique_items = []
+                for item in items:
+                    if item not in unique_items:
+                        unique_items.append(item)
+                if json:
+                    unique_items = [self.codec.decode(item)
+                                    for item in unique_items]
+                return unique_items
+        return super(UniqueDataQueue, self).dequeue(batch=batch, json=json)
+
+    def _dequeue(self, queue_key, batch, json=True):
+        result = self._pop_script(keys=[queue_key], args=[batch])
+        if json:
+            result = [self.codec.decode(item) for item in result]
+        return result
+
+    def _push(self, pipe, items, queue_key, batch=100):
+        now = repr(time.time())
+        while items:
+            self._push_script(
+                keys=[queue_key, self.signal_key()],
+                args=[now, self.queue_ttl] + items[:batch],
+                client=pipe)
+            items = items[batch:]
+
+    def _size(self, pipe, queue_key):
+        pipe.zcard(queue_key)
+
+    def size(self):
+        size = super(UniqueDataQueue, self).size()
+        if self.legacy_key:  # BBB
+            size += self.redis_client.llen(self.legacy_key)
+        return size
+
+    def wait(self, timeout=1):
+        """
+        Block for up to `timeout` seconds until the queue contains
+        items and return `True` if it does.
+        """
+        if self.size():
+            return True
+        signal = self.redis_client.brpop(self.signal_key(), timeout=timeout)
+        return signal is not None and self.size() > 0
+
+
 class ExportQueue(BaseQueue):
 
     def __init__(self, name, redis_client, settings):
@@ -0,0 +1,331 @@
+"""
+Replay a corpus of locate queries against a local database and report
+latency, throughput, database and accuracy statistics.
+"""
+
+import argparse
+from contextlib import contextmanager
+import json
+import os.path
+import sys
+import time
+
+from gevent.local import local
+from gevent.pool import Pool
+import numpy
+from sqlalchemy import event
+
+from ichnaea.api.locate.locate_v2.schema import LOCATE_V2_SCHEMA
+from ichnaea.api.locate.query import Query
+from ichnaea.api.locate.searcher import configure_position_searcher
+from ichnaea.cache import configure_redis
+from ichnaea.config import read_config
+from ichnaea.db import (
+    configure_db,
+    db_worker_session,
+)
+from ichnaea.geoip import configure_geoip
+from ichnaea.log import (
+    configure_logging,
+    DebugRavenClient,
+    DebugStatsClient,
+)
+from ichnaea.models.api import ApiKey
+from ichnaea import util
+
+#: Percentiles reported for latencies and accuracies.
+PERCENTILES = (50, 95, 99)
+
+
+class QueryCounter(object):
+    """
+    A QueryCounter counts the SQL statements executed on a database
+    engine and the number of rows they returned, separately for
+    each greenlet.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._local = local()
+
+    def _count(self, conn, cursor, statement, parameters,
+               context, executemany):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+        if cursor.rowcount > 0:
+            self._local.rows = getattr(self._local, 'rows', 0) + \
+                cursor.rowcount
+
+    def __enter__(self):
+        event.listen(self.engine, 'after_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'after_cursor_execute', self._count)
+
+    def reset(self):
+        self._local.count = 0
+        self._local.rows = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    @property
+    def rows(self):
+        return getattr(self._local, 'rows', 0)
+
+
+def load_corpus(filename):
+    """
+    Load a corpus of geolocate request bodies, one JSON document per
+    line. Files ending in `.gz` are transparently decompressed.
+    """
+    if filename.endswith('.gz'):
+        opener = util.gzip_open
+    else:
+        opener = open
+
+    corpus = []
+    with opener(filename, 'r') as fd:
+        for line in fd:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if line:
+                corpus.append(json.loads(line))
+    return corpus
+
+
+def load_query_log(filename):
+    """
+    Load a corpus of request bodies from a file written by the
+    :class:`~ichnaea.api.locate.querylog.QueryLog`.
+    """
+    return [record['query'] for record in load_corpus(filename)]
+
+
+def write_corpus(filename, corpus):
+    """Write a corpus of request bodies to a JSON lines file."""
+    with open(filename, 'w') as fd:
+        for body in corpus:
+            fd.write(json.dumps(body, sort_keys=True) + '\n')
+
+
+def generate_corpus(session, count, wifis=5, cells=1):
+    """
+    Create matching cell and wifi stations in the database session
+    and return a synthetic corpus of `count` geolocate request bodies.
+    """
+    # the factories pull in test-only dependencies
+    from ichnaea.tests.factories import (
+        CellShardFactory,
+        WifiShardFactory,
+    )
+
+    corpus = []
+    for i in range(count):
+        center = WifiShardFactory.build()
+        body = {'cellTowers': [], 'wifiAccessPoints': []}
+        for j in range(cells):
+            cell = CellShardFactory(
+                lat=center.lat, lon=center.lon, _session=session)
+            body['cellTowers'].append({
+                'radioType': cell.radio.name,
+                'mobileCountryCode': cell.mcc,
+                'mobileNetworkCode': cell.mnc,
+                'locationAreaCode': cell.lac,
+                'cellId': cell.cid,
+                'signalStrength': -70 - j,
+            })
+        for j in range(wifis):
+            wifi = WifiShardFactory(
+                lat=center.lat + j * 0.00001,
+                lon=center.lon + j * 0.000012,
+                _session=session)
+            body['wifiAccessPoints'].append({
+                'macAddress': wifi.mac,
+                'signalStrength': -60 - j,
+            })
+        corpus.append(body)
+    return corpus
+
+
+def decode_corpus(corpus):
+    """Validate request bodies and convert them into our internal format."""
+    return [LOCATE_V2_SCHEMA.deserialize(body) for body in corpus]
+
+
+@contextmanager
+def query_session(db, _session=None):
+    """
+    Return a read-only database session usable as a context manager.
+
+    :param _session: Test-only hook to provide a database session.
+    """
+    if _session is not None:
+        yield _session
+    else:
+        with db_worker_session(db, commit=False) as session:
+            yield session
+
+
+def replay(db, searcher, queries, concurrency=1,
+           geoip_db=None, stats_client=None, _session=None):
+    """
+    Run all queries through the searcher, using `concurrency`
+    greenlets, and return a list of samples.
+
+    Each sample is a tuple of duration in milliseconds, the number of
+    database queries and the result accuracy, or None for a miss.
+
+    :param _session: Test-only hook to provide a database session.
+    """
+    counter = QueryCounter(db.engine)
+    # never use the external fallback and don't emit query metrics
+    api_key = ApiKey(
+        valid_key=None, allow_fallback=False,
+        log_locate=False, log_region=False, log_submit=False)
+
+    def _run(data):
+        counter.reset()
+        with query_session(db, _session=_session) as session:
+            query = Query(
+                fallback=data.get('fallbacks'),
+                cell=data.get('cell'),
+                wifi=data.get('wifi'),
+                api_key=api_key,
+                api_type='locate',
+                session=session,
+                geoip_db=geoip_db,
+                stats_client=stats_client,
+            )
+            start = time.time()
+            result = searcher.search(query)
+            duration = (time.time() - start) * 1000.0
+        accuracy = result['accuracy'] if result else None
+        return (duration, counter.count, accuracy)
+
+    with counter:
+        pool = Pool(concurrency)
+        return list(pool.imap(_run, queries))
+
+
+def percentiles(values):
+    """Return a dict of the configured percentiles of the values."""
+    if not len(values):
+        return dict((str(pct), None) for pct in PERCENTILES)
+    return dict((str(pct), round(float(numpy.percentile(values, pct)), 2))
+                for pct in PERCENTILES)
+
+
+def summarize(samples, elapsed):
+    """Summarize the samples of a single replay run into a dict."""
+    durations = numpy.array([sample[0] for sample in samples])
+    db_queries = numpy.array([sample[1] for sample in samples])
+    accuracies = numpy.array(
+        [sample[2] for sample in samples if sample[2] is not None])
+
+    return {
+        'requests': len(samples),
+        'hits': len(accuracies),
+        'qps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': percentiles(durations),
+        'db_queries': {
+            'mean': round(float(db_queries.mean()), 2) if len(samples) else 0,
+            'max': int(db_queries.max()) if len(samples) else 0,
+        },
+        'accuracy': percentiles(accuracies),
+    }
+
+
+def run(db, searcher, queries, concurrency=(1,), repeat=1,
+        geoip_db=None, stats_client=None, _session=None):
+    """
+    Replay the queries once per concurrency level and return
+    a dict of summaries keyed by concurrency level.
+    """
+    report = {}
+    for level in concurrency:
+        samples = []
+        start = time.time()
+        for i in range(repeat):
+            samples.extend(replay(
+                db, searcher, queries, concurrency=level,
+                geoip_db=geoip_db, stats_client=stats_client,
+                _session=_session))
+        report[str(level)] = summarize(samples, time.time() - start)
+    return report
+
+
+def main(argv, _db_rw=None, _db_ro=None, _geoip_db=None,
+         _redis_client=None, _stats_client=None):
+    parser = argparse.ArgumentParser(
+        prog=argv[0], description='Benchmark locate queries.')
+    parser.add_argument('--corpus',
+                        help='Path to a JSON lines file of request bodies.')
+    parser.add_argument('--generate', type=int, default=0,
+                        help='Create stations and a synthetic corpus of '
+                             'this many queries, written to --corpus.')
+    parser.add_argument('--querylog', action='store_true',
+                        help='Read the corpus from a sampled query log.')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Number of concurrent greenlets.')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of times to replay the corpus.')
+    parser.add_argument('--output',
+                        help='Path to write the JSON report to.')
+
+    args = parser.parse_args(argv[1:])
+    if not args.corpus:
+        parser.print_help()
+        return 1
+
+    filename = os.path.abspath(args.corpus)
+    if not args.generate and not os.path.isfile(filename):
+        print('File not found.')
+        return 1
+
+    configure_logging()
+    app_config = read_config()
+    db_rw = configure_db(app_config.get('database', 'rw_url'), _db=_db_rw)
+    db_ro = configure_db(app_config.get('database', 'ro_url'), _db=_db_ro)
+    geoip_db = configure_geoip(
+        app_config.get('geoip', 'db_path'), _client=_geoip_db)
+    redis_client = configure_redis(
+        app_config.get('cache', 'cache_url'), _client=_redis_client)
+    raven_client = DebugRavenClient()
+    stats_client = _stats_client or DebugStatsClient()
+
+    if args.generate:
+        with db_worker_session(db_rw) as session:
+            corpus = generate_corpus(session, args.generate)
+        write_corpus(filename, corpus)
+    elif args.querylog:
+        corpus = load_query_log(filename)
+    else:
+        corpus = load_corpus(filename)
+
+    searcher = configure_position_searcher(
+        app_config, geoip_db=geoip_db, raven_client=raven_client,
+        redis_client=redis_client, stats_client=stats_client)
+
+    concurrency = [1]
+    if args.concurrency > 1:
+        concurrency.append(args.concurrency)
+
+    report = run(db_ro, searcher, decode_corpus(corpus),
+                 concurrency=concurrency, repeat=args.repeat,
+                 geoip_db=geoip_db, stats_client=stats_client)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output + '\n')
+    print(output)
+    return 0
+
+
+def console_entry():  # pragma: no cover
+    from gevent import monkey
+    monkey.patch_all()
+    sys.exit(main(sys.argv))
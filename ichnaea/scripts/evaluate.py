@@ -0,0 +1,244 @@
+"""
+Evaluate the accuracy and cost of the locate data sources, using
+GPS-tagged submit reports as ground truth.
+"""
+
+import argparse
+import json
+import os.path
+import sys
+import time
+
+import numpy
+import six
+
+from ichnaea.api.locate.cell import OCIDPositionSource
+from ichnaea.api.locate.internal import InternalPositionSource
+from ichnaea.api.locate.locate_v2.schema import LOCATE_V2_SCHEMA
+from ichnaea.api.locate.query import Query
+from ichnaea.api.locate.result import ResultList
+from ichnaea.config import read_config
+from ichnaea.db import configure_db
+from ichnaea.geocalc import distance
+from ichnaea.log import (
+    configure_logging,
+    DebugRavenClient,
+    DebugStatsClient,
+)
+from ichnaea.models.api import ApiKey
+from ichnaea.scripts.benchmark import (
+    percentiles,
+    query_session,
+    QueryCounter,
+)
+from ichnaea import util
+
+if six.PY2:  # pragma: no cover
+    cpu_time = time.clock
+else:  # pragma: no cover
+    cpu_time = time.process_time
+
+#: Data sources which can be evaluated, keyed by their settings name.
+SOURCES = {
+    'internal': InternalPositionSource,
+    'ocid': OCIDPositionSource,
+}
+
+CELL_FIELDS = (
+    'radioType', 'mobileCountryCode', 'mobileNetworkCode',
+    'locationAreaCode', 'cellId', 'age', 'signalStrength', 'timingAdvance',
+)
+WIFI_FIELDS = (
+    'macAddress', 'age', 'channel', 'frequency',
+    'signalStrength', 'signalToNoiseRatio', 'ssid',
+)
+
+
+def load_reports(filename):
+    """
+    Load geosubmit v2 reports from a file, as written by the bucket
+    export. Each line is either a single report or a document with an
+    `items` list of reports. Files ending in `.gz` are decompressed.
+    """
+    if filename.endswith('.gz'):
+        opener = util.gzip_open
+    else:
+        opener = open
+
+    reports = []
+    with opener(filename, 'r') as fd:
+        for line in fd:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if 'items' in data:
+                reports.extend(data['items'])
+            else:
+                reports.append(data)
+    return reports
+
+
+def report_to_query(report):
+    """
+    Convert a report into a tuple of its GPS position and
+    a geolocate request body.
+
+    Returns None, if the report has no position or no networks.
+    """
+    position = report.get('position') or {}
+    lat = position.get('latitude')
+    lon = position.get('longitude')
+    if lat is None or lon is None:
+        return None
+
+    body = {'considerIp': False, 'cellTowers': [], 'wifiAccessPoints': []}
+    for cell in report.get('cellTowers') or ():
+        entry = dict((field, cell[field])
+                     for field in CELL_FIELDS if field in cell)
+        if 'primaryScramblingCode' in cell:
+            entry['psc'] = cell['primaryScramblingCode']
+        body['cellTowers'].append(entry)
+    for wifi in report.get('wifiAccessPoints') or ():
+        body['wifiAccessPoints'].append(
+            dict((field, wifi[field])
+                 for field in WIFI_FIELDS if field in wifi))
+
+    if not (body['cellTowers'] or body['wifiAccessPoints']):
+        return None
+    return ((lat, lon), body)
+
+
+def evaluate(db, source, cases, _session=None):
+    """
+    Run all cases through a single data source and return a list of
+    samples.
+
+    Each sample is a tuple of the error distance in meters or None
+    for a miss, the number of database rows fetched, the number of
+    database queries and the CPU time in milliseconds.
+
+    :param _session: Test-only hook to provide a database session.
+    """
+    counter = QueryCounter(db.engine)
+    api_key = ApiKey(
+        valid_key=None, allow_fallback=False,
+        log_locate=False, log_region=False, log_submit=False)
+
+    samples = []
+    with counter:
+        for (lat, lon), data in cases:
+            counter.reset()
+            with query_session(db, _session=_session) as session:
+                query = Query(
+                    fallback=data.get('fallbacks'),
+                    cell=data.get('cell'),
+                    wifi=data.get('wifi'),
+                    api_key=api_key,
+                    api_type='locate',
+                    session=session,
+                )
+                start = cpu_time()
+                error = None
+                results = ResultList(source.result_type())
+                if source.should_search(query, results):
+                    result = source.search(query)
+                    if not result.empty():
+                        error = distance(lat, lon, result.lat, result.lon)
+                duration = (cpu_time() - start) * 1000.0
+            samples.append((error, counter.rows, counter.count, duration))
+    return samples
+
+
+def summarize(samples):
+    """Summarize the samples of a single data source into a dict."""
+    errors = numpy.array(
+        [sample[0] for sample in samples if sample[0] is not None])
+    rows = numpy.array([sample[1] for sample in samples])
+    db_queries = numpy.array([sample[2] for sample in samples])
+    durations = numpy.array([sample[3] for sample in samples])
+
+    return {
+        'queries': len(samples),
+        'hits': len(errors),
+        'error_m': percentiles(errors),
+        'db_rows': percentiles(rows),
+        'db_queries': percentiles(db_queries),
+        'cpu_ms': percentiles(durations),
+    }
+
+
+def run(db, sources, reports, _session=None):
+    """
+    Evaluate all data sources against the reports and return
+    a dict of summaries keyed by source name.
+    """
+    cases = []
+    for report in reports:
+        case = report_to_query(report)
+        if case is not None:
+            position, body = case
+            cases.append((position, LOCATE_V2_SCHEMA.deserialize(body)))
+
+    report = {}
+    for name, source in sources:
+        samples = evaluate(db, source, cases, _session=_session)
+        report[name] = summarize(samples)
+    return report
+
+
+def main(argv, _db_ro=None, _stats_client=None):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description='Evaluate locate accuracy against submit reports.')
+    parser.add_argument('filenames', nargs='*',
+                        help='Paths to geosubmit v2 report files.')
+    parser.add_argument('--source', action='append',
+                        choices=sorted(SOURCES.keys()),
+                        help='Data source to evaluate, defaults to all.')
+    parser.add_argument('--output',
+                        help='Path to write the JSON report to.')
+
+    args = parser.parse_args(argv[1:])
+    if not args.filenames:
+        parser.print_help()
+        return 1
+
+    reports = []
+    for filename in args.filenames:
+        filename = os.path.abspath(filename)
+        if not os.path.isfile(filename):
+            print('File not found: %s' % filename)
+            return 1
+        reports.extend(load_reports(filename))
+
+    configure_logging()
+    app_config = read_config()
+    db = configure_db(app_config.get('database', 'ro_url'), _db=_db_ro)
+    raven_client = DebugRavenClient()
+    stats_client = _stats_client or DebugStatsClient()
+
+    sources = []
+    for name in args.source or sorted(SOURCES.keys()):
+        sources.append((name, SOURCES[name](
+            settings=app_config.get_map('locate:%s' % name, {}),
+            geoip_db=None,
+            raven_client=raven_client,
+            redis_client=None,
+            stats_client=stats_client,
+        )))
+
+    report = run(db, sources, reports)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output + '\n')
+    print(output)
+    return 0
+
+
+def console_entry():  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -0,0 +1,406 @@
+"""
+Micro-benchmarks for performance sensitive parts of the data pipeline.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from ichnaea.log import configure_logging
+
+BENCHMARKS = {}  #: Registered benchmark functions, keyed by name.
+
+
+def benchmark(name):
+    """Register the decorated function as a named benchmark."""
+    def wrapper(func):
+        BENCHMARKS[name] = func
+        return func
+    return wrapper
+
+
+def rate(func, items, repeat=3):
+    """
+    Call func once for each item and return the best achieved
+    number of calls per second over `repeat` runs.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for item in items:
+            func(item)
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    if not best:  # pragma: no cover
+        return None
+    return round(len(items) / best, 1)
+
+
+@benchmark('codec')
+def codec_benchmark(size=10000):
+    """Compare the JSON and binary codecs for queued observations."""
+    # the factories pull in test-only dependencies
+    from ichnaea.queue import CODECS
+    from ichnaea.tests.factories import (
+        CellObservationFactory,
+        WifiObservationFactory,
+    )
+
+    observations = {
+        'cell': CellObservationFactory.build_batch(
+            size, accuracy=10.0, signal=-70),
+        'wifi': WifiObservationFactory.build_batch(
+            size, accuracy=10.0, signal=-80),
+    }
+
+    result = {}
+    for obs_type, items in observations.items():
+        for name, codec in sorted(CODECS.items()):
+            encoded = [codec.encode(item) for item in items]
+            result['%s.%s' % (obs_type, name)] = {
+                'bytes_per_item': round(
+                    float(sum([len(value) for value in encoded])) / size, 1),
+                'encode_per_second': rate(codec.encode, items),
+                'decode_per_second': rate(codec.decode, encoded),
+            }
+    return result
+
+
+def _public_reports(size):
+    # the factories pull in test-only dependencies
+    from ichnaea.tests.factories import (
+        CellShardFactory,
+        WifiShardFactory,
+    )
+
+    reports = []
+    for i in range(size):
+        cell = CellShardFactory.build()
+        report = {
+            'timestamp': 1443000000000 + i,
+            'position': {
+                'latitude': cell.lat,
+                'longitude': cell.lon,
+                'accuracy': 10.0,
+            },
+            'cellTowers': [{
+                'radioType': cell.radio.name,
+                'mobileCountryCode': cell.mcc,
+                'mobileNetworkCode': cell.mnc,
+                'locationAreaCode': cell.lac,
+                'cellId': cell.cid,
+                'signalStrength': -70,
+            }],
+            'wifiAccessPoints': [
+                {'macAddress': wifi.mac, 'signalStrength': -80}
+                for wifi in WifiShardFactory.build_batch(5)],
+        }
+        reports.append(report)
+    return reports
+
+
+@benchmark('report')
+def report_benchmark(size=1000):
+    """
+    Compare the CPU cost per report of validating reports in the
+    workers with validating them once in the web frontend.
+    """
+    from ichnaea.data.internal import InternalTransform
+    from ichnaea.data.report import (
+        load_trusted_report,
+        trusted_report,
+        validate_report,
+    )
+
+    transform = InternalTransform()
+    reports = [transform(report) for report in _public_reports(size)]
+    trusted = [trusted_report(report) for report in reports]
+
+    return {
+        'validate_per_second': rate(validate_report, reports),
+        'trust_per_second': rate(trusted_report, reports),
+        'load_trusted_per_second': rate(load_trusted_report, trusted),
+    }
+
+
+@benchmark('hashkey')
+def hashkey_benchmark(size=10000):
+    """
+    Measure the construction and hashing rates and the memory use of
+    the hashkey based observation and lookup classes.
+    """
+    from ichnaea.api.locate.schema import (
+        CellLookup,
+        WifiLookup,
+    )
+    from ichnaea.models import (
+        CellObservation,
+        WifiObservation,
+    )
+    from ichnaea.tests.factories import (
+        CellObservationFactory,
+        WifiObservationFactory,
+    )
+
+    cell_values = [obs._asdict() for obs in CellObservationFactory.build_batch(
+        size, accuracy=10.0, signal=-70)]
+    wifi_values = [obs._asdict() for obs in WifiObservationFactory.build_batch(
+        size, accuracy=10.0, signal=-80)]
+    wifi_lookup_values = [{'mac': value['key'], 'signal': value['signal']}
+                          for value in wifi_values]
+
+    result = {}
+    for klass, values in (
+            (CellObservation, cell_values),
+            (WifiObservation, wifi_values),
+            (CellLookup, cell_values),
+            (WifiLookup, wifi_lookup_values)):
+        instances = [klass(**value) for value in values]
+        result[klass.__name__] = {
+            'bytes_per_item': round(float(sum(
+                [sys.getsizeof(inst) + sys.getsizeof(inst._values)
+                 for inst in instances])) / size, 1),
+            'construct_per_second': rate(
+                lambda value: klass(**value), values),
+            'hash_per_second': rate(hash, instances),
+            'equal_per_second': rate(
+                lambda inst: inst == inst, instances),
+        }
+    return result
+
+
+def _write_rows(session, shard, func, rows):
+    # return the number of rows written per second
+    start = time.time()
+    func(session, shard, rows)
+    session.flush()
+    duration = time.time() - start
+    if not duration:  # pragma: no cover
+        return None
+    return round(len(rows) / duration, 1)
+
+
+@benchmark('upsert')
+def upsert_benchmark(size=1000, _session=None):
+    """
+    Compare the number of station rows updated per second in the
+    configured database, using one UPDATE statement per row or
+    multi-row upsert statements. All changes are rolled back.
+
+    :param _session: Test-only hook to provide a database session.
+    """
+    from ichnaea.config import read_config
+    from ichnaea.data.base import upsert_rows
+    from ichnaea.db import (
+        configure_db,
+        db_worker_session,
+    )
+    from ichnaea.models import WifiShard
+    from ichnaea import util
+
+    # all mac addresses are in the same shard
+    shard = WifiShard.shards()['0']
+    now = util.utcnow()
+    rows = [{'mac': '%012x' % i, 'lat': 51.5, 'lon': -0.1, 'radius': 10,
+             'samples': 1, 'created': now, 'modified': now}
+            for i in range(size)]
+
+    def _update(session, shard, rows):
+        session.bulk_update_mappings(shard, rows)
+
+    def _upsert(batch):
+        def _func(session, shard, rows):
+            upsert_rows(session, shard, rows, batch=batch)
+        return _func
+
+    def _run(session):
+        upsert_rows(session, shard, rows, batch=size)
+        result = {}
+        for name, func in (('update', _update),
+                           ('upsert_50', _upsert(50)),
+                           ('upsert_500', _upsert(500))):
+            for row in rows:
+                row['samples'] += 1
+            result[name] = {
+                'rows_per_second': _write_rows(session, shard, func, rows),
+            }
+        return result
+
+    if _session is not None:
+        return _run(_session)
+
+    db = configure_db(read_config().get('database', 'rw_url'))
+    with db_worker_session(db, commit=False) as session:
+        return _run(session)
+
+
+@benchmark('iterkeys')
+def iterkeys_benchmark(size=10000, _session=None):
+    """
+    Compare the number of score rows loaded per second by their
+    hashkeys from the configured database, using the ``iterkeys``
+    queries for chunks of 30, 100 or 500 keys. Uses 1000 keys and
+    `size` keys. All changes are rolled back.
+
+    :param _session: Test-only hook to provide a database session.
+    """
+    from ichnaea.config import read_config
+    from ichnaea.data.base import upsert_rows
+    from ichnaea.db import (
+        configure_db,
+        db_worker_session,
+    )
+    from ichnaea.models import (
+        Score,
+        ScoreKey,
+    )
+    from ichnaea import util
+
+    today = util.utcnow().date()
+    rows = [{'key': ScoreKey.location, 'userid': userid,
+             'time': today, 'value': 1} for userid in range(1, size + 1)]
+    keys = [Score.to_hashkey(key=row['key'], userid=row['userid'],
+                             time=row['time']) for row in rows]
+
+    def _iterkeys(session, keys, batch):
+        for i in range(0, len(keys), batch):
+            query = Score._querykeys(session, keys[i:i + batch])
+            for score in query.all():
+                yield score
+
+    def _run(session):
+        upsert_rows(session, Score, rows, batch=1000)
+        session.flush()
+        result = {}
+        for num in sorted(set([min(size, 1000), size])):
+            result['keys_%s' % num] = value = {}
+            for batch in (30, 100, 500):
+                start = time.time()
+                found = len(list(_iterkeys(session, keys[:num], batch)))
+                duration = time.time() - start
+                value['batch_%s_per_second' % batch] = (
+                    round(found / duration, 1) if duration else None)
+                # drop the loaded rows, to load them again next time
+                session.expunge_all()
+        return result
+
+    if _session is not None:
+        return _run(_session)
+
+    db = configure_db(read_config().get('database', 'rw_url'))
+    with db_worker_session(db, commit=False) as session:
+        return _run(session)
+
+
+class _BenchmarkTask(object):
+    # the task attributes used by the data task classes
+    shortname = 'microbench'
+    raven_client = None
+    redis_client = None
+    stats_client = None
+
+
+@benchmark('cellarea')
+def cellarea_benchmark(size=1000, _session=None):
+    """
+    Measure the number of cell areas recomputed per second from all
+    their cells in the configured database, updating batches of 100
+    or 1000 areas at once. All changes are rolled back.
+
+    :param _session: Test-only hook to provide a database session.
+    """
+    from ichnaea.config import read_config
+    from ichnaea.data.area import CellAreaOCIDUpdater
+    from ichnaea.data.base import upsert_rows
+    from ichnaea.db import (
+        configure_db,
+        db_worker_session,
+    )
+    from ichnaea.models import (
+        CellOCID,
+        encode_cellarea,
+        encode_cellid,
+        Radio,
+    )
+    from ichnaea import util
+
+    # each area has five cells
+    now = util.utcnow()
+    rows = []
+    for lac in range(1, size + 1):
+        for cid in range(1, 6):
+            lat = 51.5 + cid * 0.001
+            lon = -0.1 + cid * 0.001
+            rows.append({
+                'cellid': encode_cellid(Radio.gsm, 234, 1, lac, cid),
+                'radio': Radio.gsm, 'mcc': 234, 'mnc': 1,
+                'lac': lac, 'cid': cid, 'lat': lat, 'lon': lon,
+                'max_lat': lat, 'min_lat': lat, 'max_lon': lon,
+                'min_lon': lon, 'radius': 1000, 'region': 'GB',
+                'samples': 1, 'created': now, 'modified': now})
+    areaids = [encode_cellarea(Radio.gsm, 234, 1, lac)
+               for lac in range(1, size + 1)]
+
+    def _run(session):
+        upsert_rows(session, CellOCID, rows, batch=size)
+        updater = CellAreaOCIDUpdater(_BenchmarkTask(), session)
+        result = {}
+        for batch in (100, 1000):
+            start = time.time()
+            for i in range(0, size, batch):
+                updater.update_areas(areaids[i:i + batch])
+            session.flush()
+            duration = time.time() - start
+            result['batch_%s' % batch] = {
+                'areas_per_second': (
+                    round(size / duration, 1) if duration else None),
+            }
+        return result
+
+    if _session is not None:
+        return _run(_session)
+
+    db = configure_db(read_config().get('database', 'rw_url'))
+    with db_worker_session(db, commit=False) as session:
+        return _run(session)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0], description='Run micro-benchmarks.')
+    parser.add_argument('names', nargs='*',
+                        help='Benchmarks to run, defaults to all. '
+                             'One of: %s.' % ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--size', type=int, default=None,
+                        help='Number of items used in each benchmark.')
+    parser.add_argument('--output',
+                        help='Path to write the JSON report to.')
+
+    args = parser.parse_args(argv[1:])
+    names = args.names or sorted(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark: %s' % name)
+            return 1
+
+    configure_logging()
+    kw = {}
+    if args.size:
+        kw['size'] = args.size
+
+    report = {}
+    for name in names:
+        report[name] = BENCHMARKS[name](**kw)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output + '\n')
+    print(output)
+    return 0
+
+
+def console_entry():  # pragma: no cover
+    sys.exit(main(sys.argv))
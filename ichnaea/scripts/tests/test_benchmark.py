@@ -0,0 +1,78 @@
+import os.path
+
+from ichnaea.scripts.benchmark import (
+    decode_corpus,
+    generate_corpus,
+    load_corpus,
+    load_query_log,
+    main,
+    run,
+    summarize,
+    write_corpus,
+)
+from ichnaea.tests.base import (
+    APITestCase,
+    TestCase,
+)
+from ichnaea import util
+
+
+class TestCorpus(TestCase):
+
+    def test_roundtrip(self):
+        corpus = [
+            {'wifiAccessPoints': [{'macAddress': 'a82066000001'}]},
+            {'cellTowers': [{'radioType': 'gsm', 'cellId': 1}]},
+        ]
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = os.path.join(temp_dir, 'corpus.json')
+            write_corpus(filename, corpus)
+            self.assertEqual(load_corpus(filename), corpus)
+
+    def test_query_log(self):
+        records = [
+            {'path': 'v1.geolocate', 'source': 'internal',
+             'query': {'wifiAccessPoints': [{'macAddress': 'a82066000001'}]}},
+        ]
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = os.path.join(temp_dir, 'query.log')
+            write_corpus(filename, records)
+            self.assertEqual(load_query_log(filename), [records[0]['query']])
+
+    def test_summarize(self):
+        samples = [(10.0, 2, 50.0), (20.0, 4, None), (30.0, 3, 150.0)]
+        result = summarize(samples, 2.0)
+        self.assertEqual(result['requests'], 3)
+        self.assertEqual(result['hits'], 2)
+        self.assertEqual(result['qps'], 1.5)
+        self.assertEqual(result['latency_ms']['50'], 20.0)
+        self.assertEqual(result['db_queries'], {'mean': 3.0, 'max': 4})
+        self.assertEqual(result['accuracy']['50'], 100.0)
+
+    def test_summarize_empty(self):
+        result = summarize([], 0.0)
+        self.assertEqual(result['requests'], 0)
+        self.assertEqual(result['qps'], None)
+        self.assertEqual(result['latency_ms']['99'], None)
+
+    def test_main_no_corpus(self):
+        self.assertEqual(main(['bin/location_benchmark']), 1)
+
+
+class TestReplay(APITestCase):
+
+    def test_run(self):
+        corpus = generate_corpus(self.session, 3, wifis=3, cells=1)
+        self.session.flush()
+        self.assertEqual(len(corpus), 3)
+        self.assertEqual(len(corpus[0]['wifiAccessPoints']), 3)
+
+        report = run(self.db_rw, self.position_searcher,
+                     decode_corpus(corpus), concurrency=(1, 2),
+                     stats_client=self.stats_client, _session=self.session)
+        self.assertEqual(set(report.keys()), set(['1', '2']))
+        for summary in report.values():
+            self.assertEqual(summary['requests'], 3)
+            self.assertEqual(summary['hits'], 3)
+            self.assertTrue(summary['db_queries']['mean'] >= 1)
+            self.assertTrue(summary['accuracy']['50'] > 0)
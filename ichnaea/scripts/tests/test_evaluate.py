@@ -0,0 +1,99 @@
+import os.path
+
+import simplejson
+
+from ichnaea.api.locate.internal import InternalPositionSource
+from ichnaea.scripts.evaluate import (
+    load_reports,
+    main,
+    report_to_query,
+    run,
+)
+from ichnaea.tests.base import (
+    DBTestCase,
+    TestCase,
+)
+from ichnaea.tests.factories import (
+    CellShardFactory,
+    WifiShardFactory,
+)
+from ichnaea import util
+
+
+class TestReports(TestCase):
+
+    def test_load(self):
+        reports = [{'position': {'latitude': 1.0, 'longitude': 2.0}}]
+        with util.selfdestruct_tempdir() as temp_dir:
+            filename = os.path.join(temp_dir, 'reports.json.gz')
+            with util.gzip_open(filename, 'w') as fd:
+                fd.write(simplejson.dumps({'items': reports}))
+            self.assertEqual(load_reports(filename), reports)
+
+    def test_report_to_query(self):
+        report = {
+            'position': {'latitude': 1.0, 'longitude': 2.0, 'accuracy': 10},
+            'cellTowers': [{
+                'radioType': 'gsm', 'mobileCountryCode': 234,
+                'mobileNetworkCode': 30, 'locationAreaCode': 1,
+                'cellId': 2, 'primaryScramblingCode': 5, 'asu': 20,
+            }],
+            'wifiAccessPoints': [{'macAddress': 'a82066000001', 'ssid': 'x'}],
+        }
+        position, body = report_to_query(report)
+        self.assertEqual(position, (1.0, 2.0))
+        self.assertEqual(body['cellTowers'], [{
+            'radioType': 'gsm', 'mobileCountryCode': 234,
+            'mobileNetworkCode': 30, 'locationAreaCode': 1,
+            'cellId': 2, 'psc': 5,
+        }])
+        self.assertEqual(body['wifiAccessPoints'],
+                         [{'macAddress': 'a82066000001', 'ssid': 'x'}])
+        self.assertFalse(body['considerIp'])
+
+    def test_report_to_query_invalid(self):
+        self.assertEqual(report_to_query({}), None)
+        self.assertEqual(report_to_query(
+            {'position': {'latitude': 1.0, 'longitude': 2.0}}), None)
+
+    def test_main_no_files(self):
+        self.assertEqual(main(['bin/location_evaluate']), 1)
+
+
+class TestEvaluate(DBTestCase):
+
+    def test_run(self):
+        cell = CellShardFactory()
+        wifis = WifiShardFactory.create_batch(
+            3, lat=cell.lat + 0.001, lon=cell.lon)
+        self.session.flush()
+
+        reports = [{
+            'position': {'latitude': cell.lat, 'longitude': cell.lon},
+            'cellTowers': [{
+                'radioType': cell.radio.name,
+                'mobileCountryCode': cell.mcc,
+                'mobileNetworkCode': cell.mnc,
+                'locationAreaCode': cell.lac,
+                'cellId': cell.cid,
+            }],
+            'wifiAccessPoints': [{'macAddress': wifi.mac} for wifi in wifis],
+        }, {
+            'position': {'latitude': cell.lat, 'longitude': cell.lon},
+            'wifiAccessPoints': [{'macAddress': 'a82066000001'},
+                                 {'macAddress': 'a82066000002'}],
+        }, {
+            'cellTowers': [{'radioType': 'gsm'}],
+        }]
+        source = InternalPositionSource(
+            settings=None, geoip_db=None, raven_client=self.raven_client,
+            redis_client=None, stats_client=self.stats_client)
+
+        report = run(self.db_rw, [('internal', source)], reports,
+                     _session=self.session)
+        summary = report['internal']
+        self.assertEqual(summary['queries'], 2)
+        self.assertEqual(summary['hits'], 1)
+        self.assertTrue(100.0 < summary['error_m']['50'] < 120.0)
+        self.assertTrue(summary['db_rows']['99'] >= 3)
+        self.assertTrue(summary['db_queries']['50'] >= 1)
@@ -0,0 +1,70 @@
+from ichnaea.models import CellAreaOCID
+from ichnaea.scripts.microbench import (
+    BENCHMARKS,
+    main,
+    rate,
+)
+from ichnaea.tests.base import (
+    DBTestCase,
+    TestCase,
+)
+
+
+class TestMicrobench(TestCase):
+
+    def test_rate(self):
+        self.assertTrue(rate(lambda item: item, list(range(1000))) > 0)
+
+    def test_unknown(self):
+        self.assertEqual(main(['bin/location_microbench', 'unknown']), 1)
+
+    def test_codec(self):
+        result = BENCHMARKS['codec'](size=10)
+        self.assertEqual(set(result.keys()), set([
+            'cell.binary', 'cell.json', 'wifi.binary', 'wifi.json']))
+        for name in ('cell', 'wifi'):
+            self.assertTrue(result[name + '.binary']['bytes_per_item'] <
+                            result[name + '.json']['bytes_per_item'])
+            self.assertTrue(result[name + '.binary']['decode_per_second'] > 0)
+
+    def test_report(self):
+        result = BENCHMARKS['report'](size=5)
+        self.assertEqual(set(result.keys()), set([
+            'load_trusted_per_second', 'trust_per_second',
+            'validate_per_second']))
+        for value in result.values():
+            self.assertTrue(value > 0)
+
+    def test_hashkey(self):
+        result = BENCHMARKS['hashkey'](size=5)
+        self.assertEqual(set(result.keys()), set([
+            'CellLookup', 'CellObservation', 'WifiLookup', 'WifiObservation']))
+        for value in result.values():
+            self.assertTrue(value['bytes_per_item'] > 0)
+            self.assertTrue(value['construct_per_second'] > 0)
+
+
+class TestDBBenchmark(DBTestCase):
+
+    def test_upsert(self):
+        result = BENCHMARKS['upsert'](size=5, _session=self.session)
+        self.assertEqual(set(result.keys()), set([
+            'update', 'upsert_50', 'upsert_500']))
+        for value in result.values():
+            self.assertTrue(value['rows_per_second'] > 0)
+
+    def test_iterkeys(self):
+        result = BENCHMARKS['iterkeys'](size=5, _session=self.session)
+        self.assertEqual(set(result.keys()), set(['keys_5']))
+        self.assertEqual(set(result['keys_5'].keys()), set([
+            'batch_30_per_second', 'batch_100_per_second',
+            'batch_500_per_second']))
+        for value in result['keys_5'].values():
+            self.assertTrue(value > 0)
+
+    def test_cellarea(self):
+        result = BENCHMARKS['cellarea'](size=5, _session=self.session)
+        self.assertEqual(set(result.keys()), set(['batch_100', 'batch_1000']))
+        for value in result.values():
+            self.assertTrue(value['areas_per_second'] > 0)
+        self.assertEqual(self.session.query(CellAreaOCID).count(), 5)
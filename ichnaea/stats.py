@@ -0,0 +1,369 @@
+"""
+The data of the statistics and leaderboard pages, computed by the
+background tasks and served by the website views.
+"""
+
+from calendar import timegm
+from copy import deepcopy
+from datetime import date, timedelta
+from operator import itemgetter
+
+import genc
+from sqlalchemy import func
+
+from ichnaea.internaljson import internal_dumps, internal_loads
+from ichnaea.leaderboard import (
+    Leaderboard,
+    WEEKLY_DAYS,
+)
+from ichnaea.lease import Lease
+from ichnaea.models.content import (
+    RegionStat,
+    Score,
+    ScoreKey,
+    Stat,
+    StatKey,
+    User,
+)
+from ichnaea import util
+
+transliterate_mapping = {
+    231: 'c', 244: 'o', 8217: "'",
+}
+
+
+def transliterate(string):
+    # optimize for the common case of ascii-only
+    non_ascii = any([ord(char) > 127 for char in string])
+    if not non_ascii:
+        return string
+
+    result = []
+    for char in string:
+        if ord(char) > 127:
+            result.append(transliterate_mapping.get(ord(char), char))
+        else:
+            result.append(char)
+
+    return ''.join(result)
+
+
+def global_stats(session):
+    today = util.utcnow().date()
+    yesterday = today - timedelta(1)
+    stat_keys = (
+        StatKey.cell,
+        StatKey.wifi,
+        StatKey.unique_cell,
+        StatKey.unique_cell_ocid,
+        StatKey.unique_wifi,
+    )
+    rows = session.query(Stat.key, Stat.value).filter(
+        Stat.key.in_(stat_keys)).filter(
+        Stat.time == yesterday)
+
+    stats = {}
+    for row in rows.all():
+        if row[1]:
+            stats[row[0]] = int(row[1])
+
+    result = {}
+    for stat_key in stat_keys:
+        name = stat_key.name
+        try:
+            result[name] = stats[stat_key]
+        except KeyError:
+            # no stats entry available, maybe closely after midnight
+            # and task hasn't run yet, take latest value
+            row = session.query(Stat.value).filter(
+                Stat.key == stat_key).order_by(
+                Stat.time.desc()).limit(1).first()
+            if row is not None:
+                result[name] = row[0]
+            else:
+                result[name] = 0
+
+    for k, v in result.items():
+        # show as millions
+        result[k] = '%.2f' % ((v // 10000) / 100.0)
+
+    return result
+
+
+def histogram(session, stat_key, days=365):
+    today = util.utcnow().date()
+    start = today - timedelta(days=days)
+    month_key = (func.year(Stat.time), func.month(Stat.time))
+    rows = session.query(func.max(Stat.value), *month_key).filter(
+        Stat.key == stat_key).filter(
+        Stat.time >= start).filter(
+        Stat.time < today).group_by(
+        *month_key).order_by(
+        *month_key
+    )
+    result = []
+    for num, year, month in rows.all():
+        # use first of August to plot the highest result for July
+        if month == 12:  # pragma: no cover
+            next_month = date(year + 1, 1, 1)
+        else:
+            next_month = date(year, month + 1, 1)
+        if next_month >= today:
+            # we restrict dates to be at most yesterday
+            next_month = today - timedelta(days=1)
+        day = timegm(next_month.timetuple()) * 1000
+        result.append([day, num])
+    return [result]
+
+
+def _nicknames(session, userids):
+    users = {}
+    if userids:
+        users = dict(session.query(User.id, User.nickname).filter(
+            User.id.in_(userids)).all())
+    result = {}
+    for userid in userids:
+        nickname = users.get(userid, 'anonymous')
+        if len(nickname) > 24:
+            nickname = nickname[:24] + u'...'
+        result[userid] = nickname
+    return result
+
+
+def leaders(session, redis_client=None):
+    leaderboard = None
+    if redis_client is not None:
+        leaderboard = Leaderboard(redis_client)
+    if leaderboard is not None and leaderboard.ready():
+        score_rows = leaderboard.top(ScoreKey.location, min_value=10)
+    else:
+        score_rows = session.query(
+            Score.userid, func.sum(Score.value)).filter(
+            Score.key == ScoreKey.location).group_by(
+            Score.userid).having(func.sum(Score.value) >= 10).all()
+        # sort descending by value
+        score_rows.sort(key=itemgetter(1), reverse=True)
+
+    nicknames = _nicknames(session, [s[0] for s in score_rows])
+    return [{'nickname': nicknames[userid], 'num': int(value)}
+            for userid, value in score_rows]
+
+
+def leaders_weekly(session, redis_client=None, batch=20):
+    today = util.utcnow().date()
+    one_week = today - timedelta(WEEKLY_DAYS - 1)
+    leaderboard = None
+    if redis_client is not None:
+        leaderboard = Leaderboard(redis_client)
+    ready = leaderboard is not None and leaderboard.ready()
+
+    score_rows = {}
+    userids = set()
+    for name in ('new_cell', 'new_wifi'):
+        if ready:
+            score_rows[name] = leaderboard.top_days(
+                ScoreKey[name], today, WEEKLY_DAYS, batch)
+        else:
+            score_rows[name] = session.query(
+                Score.userid, func.sum(Score.value)).filter(
+                Score.key == ScoreKey[name]).filter(
+                Score.time >= one_week).order_by(
+                func.sum(Score.value).desc()).group_by(
+                Score.userid).limit(batch).all()
+        userids.update(set([s[0] for s in score_rows[name]]))
+
+    nicknames = _nicknames(session, list(userids))
+    result = {}
+    for name, value in score_rows.items():
+        result[name] = [{'nickname': nicknames[userid], 'num': int(num)}
+                        for userid, num in value]
+    return result
+
+
+def regions(session):
+    rows = session.query(RegionStat).all()
+    regions = {}
+    for row in rows:
+        code = row.region
+        name = genc.region_by_alpha2(code).name
+        gsm = int(row.gsm or 0)
+        wcdma = int(row.wcdma or 0)
+        lte = int(row.lte or 0)
+        cell = sum((gsm, wcdma, lte))
+        wifi = int(row.wifi or 0)
+        regions[code] = {
+            'code': code,
+            'name': name,
+            'order': transliterate(name[:10]).lower(),
+            'gsm': gsm,
+            'wcdma': wcdma,
+            'lte': lte,
+            'cell': cell,
+            'wifi': wifi,
+        }
+    return sorted(regions.values(), key=itemgetter('cell'), reverse=True)
+
+
+def leaders_page(session, redis_client):
+    return [{
+        'pos': pos + 1,
+        'num': value['num'],
+        'nickname': value['nickname'],
+        'anchor': value['nickname'],
+    } for pos, value in enumerate(leaders(session, redis_client))]
+
+
+def leaders_weekly_page(session, redis_client):
+    data = {
+        'new_cell': {'leaders1': [], 'leaders2': []},
+        'new_wifi': {'leaders1': [], 'leaders2': []},
+    }
+    for name, value in leaders_weekly(session, redis_client).items():
+        value = [{
+            'pos': pos + 1,
+            'num': l['num'],
+            'nickname': l['nickname'],
+        } for pos, l in enumerate(value)]
+        half = len(value) // 2 + len(value) % 2
+        data[name] = {
+            'leaders1': value[:half],
+            'leaders2': value[half:],
+        }
+    return data
+
+
+def stats_page(session, redis_client):
+    data = {
+        'leaders': [],
+        'metrics1': [],
+        'metrics2': [],
+    }
+    metrics = global_stats(session)
+    metric_names = [
+        (StatKey.unique_cell.name, 'MLS Cells'),
+        (StatKey.unique_cell_ocid.name, 'OpenCellID Cells'),
+        (StatKey.cell.name, 'MLS Cell Observations'),
+        (StatKey.unique_wifi.name, 'Wifi Networks'),
+        (StatKey.wifi.name, 'Wifi Observations'),
+    ]
+    for mid, name in metric_names[:3]:
+        data['metrics1'].append({'name': name, 'value': metrics[mid]})
+    for mid, name in metric_names[3:]:
+        data['metrics2'].append({'name': name, 'value': metrics[mid]})
+    return data
+
+
+def stats_regions_page(session, redis_client):
+    return regions(session)
+
+
+def stats_cell_json_page(session, redis_client):
+    mls_data = histogram(session, StatKey.unique_cell)
+    ocid_data = histogram(session, StatKey.unique_cell_ocid)
+    return [
+        {'title': 'MLS Cells', 'data': mls_data[0]},
+        {'title': 'OCID Cells', 'data': ocid_data[0]},
+    ]
+
+
+def stats_wifi_json_page(session, redis_client):
+    return histogram(session, StatKey.unique_wifi)
+
+
+#: Maps the cache key names of the statistics pages to the functions
+#: computing their data.
+STATS_PAGES = {
+    'leaders': leaders_page,
+    'leaders_weekly': leaders_weekly_page,
+    'stats': stats_page,
+    'stats_regions': stats_regions_page,
+    'stats_cell_json': stats_cell_json_page,
+    'stats_wifi_json': stats_wifi_json_page,
+}
+
+#: Maps the cache key names of the statistics pages to the empty data
+#: shown until the data has been computed for the first time.
+EMPTY_STATS_PAGES = {
+    'leaders': [],
+    'leaders_weekly': {
+        'new_cell': {'leaders1': [], 'leaders2': []},
+        'new_wifi': {'leaders1': [], 'leaders2': []},
+    },
+    'stats': {'leaders': [], 'metrics1': [], 'metrics2': []},
+    'stats_regions': [],
+    'stats_cell_json': [],
+    'stats_wifi_json': [[]],
+}
+
+
+class StatsCache(object):
+    """
+    The cached data of the statistics pages.
+
+    Cached data is served even after it has become stale, while a
+    background task refreshes it, see
+    :class:`ichnaea.data.stats.StatsCacheRefresher`. Only a cold cache
+    is filled in by the caller, while holding the same lease as the
+    background task.
+
+    :param redis_client: A Redis client.
+    :param stats_client: A stats client.
+    """
+
+    fresh_ttl = 3600  #: Time in seconds after which data becomes stale.
+    stale_ttl = 7 * 86400  #: Time in seconds after which data is dropped.
+    lease_name = 'refresh_stats_cache'  #: Name of the refresh lease.
+    lease_timeout = 300  #: Duration of the refresh lease in seconds.
+
+    def __init__(self, redis_client, stats_client):
+        self.redis_client = redis_client
+        self.stats_client = stats_client
+
+    def key(self, name):
+        """Returns the Redis key of the named page's data."""
+        return self.redis_client.cache_keys[name]
+
+    def fresh_key(self, name):
+        """Returns the Redis key marking the named page's data as fresh."""
+        return self.key(name) + b':fresh'
+
+    def get(self, name, session):
+        """
+        Returns the cached data of the named page, regardless of its
+        age. Only if there is no data at all, it's computed using the
+        session and stored. If the data is already being computed
+        elsewhere, empty data is returned instead.
+        """
+        cached = self.redis_client.get(self.key(name))
+        if cached:
+            return internal_loads(cached)
+
+        lease = Lease(self.lease_name, self.redis_client,
+                      self.stats_client, timeout=self.lease_timeout)
+        if not lease.acquire():
+            return deepcopy(EMPTY_STATS_PAGES[name])
+        try:
+            return self.refresh(name, session)
+        finally:
+            lease.release()
+
+    def stale(self, names):
+        """Returns the subset of the page names with stale data."""
+        with self.redis_client.pipeline() as pipe:
+            for name in names:
+                pipe.exists(self.fresh_key(name))
+            fresh = pipe.execute()
+        return [name for name, exists in zip(names, fresh) if not exists]
+
+    def expire(self, names):
+        """Mark the data of the named pages as stale."""
+        self.redis_client.delete(*[self.fresh_key(name) for name in names])
+
+    def refresh(self, name, session):
+        """Compute, store and return the data of the named page."""
+        data = STATS_PAGES[name](session, self.redis_client)
+        with self.redis_client.pipeline() as pipe:
+            pipe.set(self.key(name), internal_dumps(data), ex=self.stale_ttl)
+            pipe.set(self.fresh_key(name), b'1', ex=self.fresh_ttl)
+            pipe.execute()
+        return data
@@ -85,6 +85,10 @@ TEST_CONFIG = DummyConfig({
         'ratelimit_interval': '5',
         'cache_expire': '60',
     },
+    'station_filter': {
+        'cell_capacity': '3000',
+        'wifi_capacity': '16000',
+    },
 })
 
 GEOIP_DATA = {
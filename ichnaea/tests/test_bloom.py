@@ -0,0 +1,61 @@
+from ichnaea.bloom import (
+    BloomFilter,
+    MAX_BITS,
+)
+from ichnaea.tests.base import (
+    RedisTestCase,
+    TestCase,
+)
+from ichnaea.tests.factories import WifiShardFactory
+
+
+class TestBloomFilterSize(TestCase):
+
+    def test_size(self):
+        bloom = BloomFilter('test', None, capacity=1000, error_rate=0.01)
+        self.assertEqual(bloom.num_bits, 9586)
+        self.assertEqual(bloom.num_hashes, 7)
+        self.assertEqual(bloom.key(), b'bloom:test:9586:7')
+        self.assertEqual(bloom.ready_key(), b'bloom:test:9586:7:ready')
+
+    def test_max_size(self):
+        bloom = BloomFilter('test', None, capacity=10 ** 10)
+        self.assertEqual(bloom.num_bits, MAX_BITS)
+
+    def test_offsets(self):
+        bloom = BloomFilter('test', None, capacity=1000)
+        offsets = bloom.offsets(u'a82066000001')
+        self.assertEqual(len(offsets), bloom.num_hashes)
+        self.assertEqual(offsets, bloom.offsets(b'a82066000001'))
+        self.assertTrue(max(offsets) < bloom.num_bits)
+
+
+class TestBloomFilter(RedisTestCase):
+
+    def test_contains(self):
+        bloom = BloomFilter('test', self.redis_client, capacity=1000)
+        keys = [wifi.mac for wifi in WifiShardFactory.build_batch(100)]
+        self.assertEqual(bloom.contains(keys[:3]), [False] * 3)
+        self.assertEqual(bloom.contains([]), [])
+
+        bloom.add(keys[:50])
+        self.assertEqual(bloom.contains(keys[:50]), [True] * 50)
+        # allow for some false positives
+        self.assertTrue(sum(bloom.contains(keys[50:])) < 5)
+
+    def test_add_pipe(self):
+        bloom = BloomFilter('test', self.redis_client, capacity=1000)
+        with self.redis_client.pipeline() as pipe:
+            bloom.add([u'a82066000001'], pipe=pipe)
+            self.assertEqual(bloom.contains([u'a82066000001']), [False])
+            pipe.execute()
+        self.assertEqual(bloom.contains([u'a82066000001']), [True])
+
+    def test_ready(self):
+        bloom = BloomFilter('test', self.redis_client, capacity=1000)
+        self.assertFalse(bloom.ready())
+        bloom.mark_ready()
+        self.assertTrue(bloom.ready())
+        # a filter with a different size isn't ready
+        other = BloomFilter('test', self.redis_client, capacity=2000)
+        self.assertFalse(other.ready())
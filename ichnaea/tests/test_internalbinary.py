@@ -0,0 +1,109 @@
+from ichnaea.internalbinary import (
+    binary_dumps,
+    binary_loads,
+    HEADER,
+    is_binary,
+)
+from ichnaea.internaljson import internal_dumps
+from ichnaea.models import (
+    CellAggregate,
+    CellObservation,
+    Radio,
+    WifiAggregate,
+    WifiObservation,
+)
+from ichnaea.queue import (
+    BinaryCodec,
+    JSONCodec,
+)
+from ichnaea.tests.base import TestCase
+from ichnaea.tests.factories import (
+    CellObservationFactory,
+    WifiObservationFactory,
+)
+
+
+class TestInternalBinary(TestCase):
+
+    def test_cell_roundtrip(self):
+        obs = CellObservationFactory(
+            accuracy=10.5, altitude=100.0, signal=-70, ta=3)
+        data = binary_dumps(obs)
+        self.assertTrue(is_binary(data))
+        result = binary_loads(data)
+        self.assertTrue(type(result) is CellObservation)
+        self.assertEqual(result, obs)
+        self.assertTrue(type(result.radio) is Radio)
+        self.assertEqual(result.heading, None)
+
+    def test_wifi_roundtrip(self):
+        obs = WifiObservationFactory(channel=11, signal=-80, snr=20)
+        data = binary_dumps(obs)
+        result = binary_loads(data)
+        self.assertTrue(type(result) is WifiObservation)
+        self.assertEqual(result, obs)
+        self.assertEqual(result.mac, obs.mac)
+
+    def test_aggregate_roundtrip(self):
+        for obs_factory, aggregate_cls in (
+                (CellObservationFactory, CellAggregate),
+                (WifiObservationFactory, WifiAggregate)):
+            obs = obs_factory(signal=-80)
+            aggregate = aggregate_cls.from_observation(obs)
+            obs.signal = -70
+            aggregate.add(obs)
+            result = binary_loads(binary_dumps(aggregate))
+            self.assertTrue(type(result) is aggregate_cls)
+            self.assertEqual(result, aggregate)
+            self.assertEqual(result.samples, 2)
+            self.assertEqual(result.signal, -70)
+
+    def test_sparse(self):
+        obs = WifiObservation(key='a82066000001', lat=1.0, lon=2.0)
+        data = binary_dumps(obs)
+        self.assertEqual(len(data), HEADER.size + 6 + 2 * 8)
+        self.assertEqual(binary_loads(data), obs)
+
+    def test_smaller(self):
+        obs = CellObservationFactory()
+        self.assertTrue(
+            len(binary_dumps(obs)) * 3 < len(internal_dumps(obs)))
+
+    def test_unsupported(self):
+        with self.assertRaises(TypeError):
+            binary_dumps({'a': 1})
+        obs = CellObservationFactory()
+        obs.signal = 100000
+        with self.assertRaises(ValueError):
+            binary_dumps(obs)
+
+    def test_version(self):
+        data = bytearray(binary_dumps(CellObservationFactory()))
+        data[0] = 99
+        with self.assertRaises(ValueError):
+            binary_loads(bytes(data))
+
+
+class TestBinaryCodec(TestCase):
+
+    codec = BinaryCodec()
+
+    def test_roundtrip(self):
+        obs = WifiObservationFactory()
+        self.assertEqual(self.codec.decode(self.codec.encode(obs)), obs)
+
+    def test_decode_json(self):
+        obs = CellObservationFactory()
+        data = JSONCodec().encode(obs)
+        self.assertFalse(is_binary(data))
+        self.assertFalse(is_binary(data.encode('utf-8')))
+        self.assertEqual(self.codec.decode(data.encode('utf-8')), obs)
+
+    def test_json_fallback(self):
+        obs = CellObservationFactory()
+        obs.signal = 100000
+        data = self.codec.encode(obs)
+        self.assertFalse(is_binary(data))
+        self.assertEqual(self.codec.decode(data), obs)
+        self.assertEqual(self.codec.decode(self.codec.encode({'a': 1})),
+                         {'a': 1})
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from ichnaea.leaderboard import Leaderboard
+from ichnaea.models import ScoreKey
+from ichnaea.tests.base import RedisTestCase
+from ichnaea import util
+
+
+class TestLeaderboard(RedisTestCase):
+
+    def setUp(self):
+        super(TestLeaderboard, self).setUp()
+        self.leaderboard = Leaderboard(self.redis_client)
+        self.today = util.utcnow().date()
+
+    def _add(self, values):
+        with self.redis_client.pipeline() as pipe:
+            for userid, score_key, day, value in values:
+                self.leaderboard.add(pipe, userid, score_key, day, value)
+            pipe.execute()
+
+    def test_key(self):
+        self.assertEqual(self.leaderboard.key(ScoreKey.location),
+                         b'leaders:location')
+        self.assertEqual(
+            self.leaderboard.key(ScoreKey.new_cell, self.today),
+            b'leaders:new_cell:' + self.today.strftime('%Y%m%d').encode())
+
+    def test_top(self):
+        self._add([(1, ScoreKey.location, self.today, 5),
+                   (2, ScoreKey.location, self.today, 12),
+                   (1, ScoreKey.location, self.today, 10),
+                   (3, ScoreKey.new_cell, self.today, 20)])
+        self.assertEqual(self.leaderboard.top(ScoreKey.location),
+                         [(1, 15), (2, 12)])
+        self.assertEqual(
+            self.leaderboard.top(ScoreKey.location, min_value=13), [(1, 15)])
+
+    def test_top_days(self):
+        old_day = self.today - timedelta(days=8)
+        yesterday = self.today - timedelta(days=1)
+        self._add([(1, ScoreKey.new_wifi, self.today, 2),
+                   (2, ScoreKey.new_wifi, yesterday, 3),
+                   (1, ScoreKey.new_wifi, yesterday, 2),
+                   (3, ScoreKey.new_wifi, old_day, 10),
+                   (4, ScoreKey.new_wifi, self.today, 1)])
+        self.assertEqual(
+            self.leaderboard.top_days(ScoreKey.new_wifi, self.today, 8, 2),
+            [(1, 4), (2, 3)])
+        self.assertEqual(
+            self.leaderboard.top_days(ScoreKey.new_cell, self.today, 8, 2),
+            [])
+        self.assertEqual(self.redis_client.keys(b'*:union'), [])
+
+    def test_replace(self):
+        self.assertFalse(self.leaderboard.ready())
+        self._add([(1, ScoreKey.location, self.today, 5),
+                   (1, ScoreKey.new_cell, self.today, 5)])
+        self.leaderboard.replace(
+            {ScoreKey.location: {2: 3, 3: 4}, ScoreKey.new_cell: {}},
+            {(ScoreKey.new_wifi, self.today): {2: 1}})
+
+        self.assertTrue(self.leaderboard.ready())
+        self.assertEqual(self.leaderboard.top(ScoreKey.location),
+                         [(3, 4), (2, 3)])
+        self.assertEqual(self.leaderboard.top(ScoreKey.new_cell), [])
+        self.assertEqual(
+            self.leaderboard.top_days(ScoreKey.new_wifi, self.today, 1, 5),
+            [(2, 1)])
+        self.assertTrue(self.redis_client.ttl(
+            self.leaderboard.key(ScoreKey.new_wifi, self.today)) > 0)
+        self.assertEqual(self.redis_client.keys(b'*:new'), [])
@@ -0,0 +1,60 @@
+from ichnaea.lease import Lease
+from ichnaea.tests.base import RedisTestCase
+
+
+class TestLease(RedisTestCase):
+
+    def _lease(self, name='test', timeout=60):
+        return Lease(name, self.redis_client, self.stats_client,
+                     timeout=timeout)
+
+    def test_acquire(self):
+        lease = self._lease()
+        self.assertTrue(lease.acquire())
+        self.assertTrue(0 < self.redis_client.ttl(lease.key()) <= 60)
+        self.assertFalse(self._lease().acquire())
+        # other resources can be leased
+        self.assertTrue(self._lease(name='other').acquire())
+        self.check_stats(counter=[
+            ('lease.acquire', 2, ['lease:test', 'result:success']),
+            ('lease.acquire', 1, ['lease:test', 'result:busy']),
+        ])
+
+    def test_release(self):
+        lease = self._lease()
+        lease.release()
+        self.assertTrue(lease.acquire())
+        lease.release()
+        self.assertFalse(self.redis_client.exists(lease.key()))
+        self.assertTrue(self.redis_client.exists(lease.released_key()))
+
+        second = self._lease()
+        self.assertTrue(second.acquire())
+        self.check_stats(timer=[
+            ('lease.work', 1, ['lease:test']),
+            ('lease.idle', 1, ['lease:test']),
+        ])
+
+    def test_release_lost(self):
+        lease = self._lease()
+        self.assertTrue(lease.acquire())
+        # the lease expired and was taken over by another consumer
+        self.redis_client.delete(lease.key())
+        other = self._lease()
+        self.assertTrue(other.acquire())
+        lease.release()
+        self.assertEqual(self.redis_client.get(lease.key()),
+                         other.token.encode('ascii'))
+
+    def test_renew(self):
+        lease = self._lease(timeout=60)
+        self.assertTrue(lease.acquire())
+        self.redis_client.expire(lease.key(), 5)
+        self.assertTrue(lease.renew())
+        self.assertTrue(self.redis_client.ttl(lease.key()) > 5)
+
+        self.redis_client.delete(lease.key())
+        self.assertFalse(lease.renew())
+        self.check_stats(counter=[
+            ('lease.renew', 1, ['lease:test', 'result:lost']),
+        ])
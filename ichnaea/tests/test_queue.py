@@ -0,0 +1,167 @@
+import time
+
+from ichnaea.queue import (
+    DataQueue,
+    UniqueDataQueue,
+)
+from ichnaea.tests.base import RedisTestCase
+
+
+class TestReliableDataQueue(RedisTestCase):
+
+    def _queue(self, reliable=True):
+        return DataQueue('test', self.redis_client,
+                         queue_key='test', reliable=reliable)
+
+    def _claims(self, queue):
+        return self.redis_client.zrange(queue.claims_key(), 0, -1)
+
+    def test_claim_ack(self):
+        queue = self._queue()
+        queue.enqueue([1, 2, 3])
+        claim_key, items = queue.claim(batch=2)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(queue.size(), 1)
+        self.assertEqual(self.redis_client.llen(claim_key), 2)
+        self.assertEqual(self._claims(queue), [claim_key.encode('ascii')])
+
+        queue.ack(claim_key)
+        self.assertFalse(self.redis_client.exists(claim_key))
+        self.assertEqual(self._claims(queue), [])
+        self.assertEqual(queue.size(), 1)
+
+    def test_claim_empty(self):
+        queue = self._queue()
+        claim_key, items = queue.claim(batch=10)
+        self.assertEqual(items, [])
+        self.assertEqual(self._claims(queue), [])
+        queue.ack(claim_key)
+
+    def test_multiple_consumers(self):
+        queue = self._queue()
+        queue.enqueue(list(range(10)))
+        claim1, items1 = queue.claim(batch=4)
+        claim2, items2 = queue.claim(batch=4)
+        self.assertNotEqual(claim1, claim2)
+        self.assertEqual(set(items1) & set(items2), set())
+        self.assertEqual(len(self._claims(queue)), 2)
+
+    def test_reclaim(self):
+        queue = self._queue()
+        queue.enqueue([1, 2, 3])
+        claim_key, items = queue.claim(batch=2)
+        # claims are only reclaimed after their deadline
+        self.assertEqual(queue.reclaim(), (0, 0))
+        self.assertEqual(queue.reclaim(
+            now=time.time() + queue.processing_timeout + 1), (2, 0))
+        self.assertFalse(self.redis_client.exists(claim_key))
+        self.assertEqual(self._claims(queue), [])
+        # the reclaimed items are dequeued first, in their old order
+        self.assertEqual(queue.dequeue(batch=3), items + [1])
+
+    def test_dead_letter(self):
+        queue = self._queue()
+        queue.max_attempts = 2
+        queue.enqueue([1, 2])
+        later = time.time() + queue.processing_timeout + 1
+        queue.claim(batch=1)
+        self.assertEqual(queue.reclaim(now=later), (1, 0))
+        # the second failed claim gives up on the item
+        claim_key, items = queue.claim(batch=1)
+        self.assertEqual(queue.reclaim(now=later), (0, 1))
+        self.assertEqual(queue.size(), 1)
+        self.assertEqual(self.redis_client.lrange(queue.dead_key(), 0, -1),
+                         [queue.codec.encode(items[0]).encode('ascii')])
+
+        # acknowledged items forget their attempts
+        queue.enqueue([3])
+        queue.claim(batch=1)
+        self.assertEqual(queue.reclaim(now=later), (1, 0))
+        claim_key, items = queue.claim(batch=1)
+        queue.ack(claim_key)
+        self.assertFalse(self.redis_client.exists(queue.attempts_key()))
+
+    def test_not_reliable(self):
+        queue = self._queue(reliable=False)
+        queue.enqueue([1, 2])
+        claim_key, items = queue.claim(batch=5)
+        self.assertEqual(claim_key, None)
+        self.assertEqual(len(items), 2)
+        queue.ack(claim_key)
+        self.assertEqual(queue.reclaim(), (0, 0))
+
+
+class TestDataQueueWait(RedisTestCase):
+
+    def test_wait(self):
+        queue = DataQueue('test', self.redis_client, queue_key='test')
+        queue.enqueue([1, 2, 3])
+        self.assertTrue(queue.wait(timeout=1))
+        # no items are removed
+        self.assertEqual(sorted(queue.dequeue(batch=0)), [1, 2, 3])
+
+    def test_wait_empty(self):
+        queue = DataQueue('test', self.redis_client, queue_key='test')
+        self.assertFalse(queue.wait(timeout=1))
+        self.assertEqual(queue.size(), 0)
+
+
+class TestUniqueDataQueue(RedisTestCase):
+
+    def _queue(self):
+        return UniqueDataQueue('test', self.redis_client,
+                               queue_key='test_unique')
+
+    def test_deduplicate(self):
+        queue = self._queue()
+        queue.enqueue([b'a', b'b', b'a'], json=False)
+        queue.enqueue([b'b', b'c'], json=False)
+        self.assertEqual(queue.size(), 3)
+        self.assertEqual(queue.monitor_name, 'test')
+        self.assertEqual(sorted(queue.dequeue(batch=0, json=False)),
+                         [b'a', b'b', b'c'])
+        self.assertEqual(queue.size(), 0)
+
+    def test_order(self):
+        queue = self._queue()
+        queue.enqueue([b'a'], json=False)
+        time.sleep(0.01)
+        queue.enqueue([b'b'], json=False)
+        time.sleep(0.01)
+        # adding an item again doesn't move it to the end
+        queue.enqueue([b'c', b'a'], json=False)
+        self.assertEqual(queue.dequeue(batch=2, json=False), [b'a', b'b'])
+        self.assertEqual(queue.dequeue(batch=2, json=False), [b'c'])
+        self.assertEqual(queue.dequeue(batch=2, json=False), [])
+
+    def test_json(self):
+        queue = self._queue()
+        with self.redis_client.pipeline() as pipe:
+            queue.enqueue([{'a': 1}, {'a': 1}, {'b': 2}], pipe=pipe)
+            self.assertEqual(queue.size(), 0)
+            pipe.execute()
+        self.assertTrue(queue.enough_data(batch=2))
+        self.assertEqual(queue.dequeue(batch=5),
+                         [{'a': 1}, {'b': 2}])
+
+    def test_legacy_key(self):
+        queue = UniqueDataQueue('test', self.redis_client,
+                                queue_key='test_unique', legacy_key='test')
+        self.redis_client.lpush('test', b'b', b'a', b'b')
+        queue.enqueue([b'c'], json=False)
+        self.assertEqual(queue.size(), 4)
+        self.assertTrue(queue.wait(timeout=1))
+        # items left in the old list are dequeued first
+        self.assertEqual(queue.dequeue(batch=2, json=False), [b'b', b'a'])
+        self.assertEqual(queue.dequeue(batch=2, json=False), [b'b'])
+        self.assertEqual(queue.dequeue(batch=2, json=False), [b'c'])
+        self.assertEqual(queue.size(), 0)
+
+    def test_wait(self):
+        queue = self._queue()
+        self.assertFalse(queue.wait(timeout=1))
+        queue.enqueue([b'a'], json=False)
+        self.assertTrue(queue.wait(timeout=1))
+        self.assertEqual(queue.dequeue(json=False), [b'a'])
+        # a left over signal doesn't report an empty queue as ready
+        self.assertFalse(queue.wait(timeout=1))
@@ -11,7 +11,8 @@ from ichnaea.models.content import (
     Stat,
     StatKey,
 )
-from ichnaea.content.stats import (
+from ichnaea.leaderboard import Leaderboard
+from ichnaea.stats import (
     global_stats,
     histogram,
     leaders,
@@ -20,6 +21,7 @@ from ichnaea.content.stats import (
     transliterate,
 )
 from ichnaea.tests.base import (
+    ConnectionTestCase,
     DBTestCase,
     TestCase,
 )
@@ -221,3 +223,48 @@ class TestTransliterate(TestCase):
             trans = transliterate(record.name)
             non_ascii = [c for c in trans if ord(c) > 127]
             self.assertEqual(non_ascii, [])
+
+
+class TestLeaderboardStats(ConnectionTestCase):
+
+    def setUp(self):
+        super(TestLeaderboardStats, self).setUp()
+        self.leaderboard = Leaderboard(self.redis_client)
+        self.today = util.utcnow().date()
+        self.users = []
+        for i in range(3):
+            user = User(nickname=u'nick-%s' % i)
+            self.session.add(user)
+            self.users.append(user)
+        self.session.flush()
+
+    def test_leaders(self):
+        userids = [user.id for user in self.users]
+        self.leaderboard.replace(
+            {ScoreKey.location: {userids[0]: 12, userids[1]: 5,
+                                 userids[2]: 30, 1000: 11}}, {})
+        # the score table is no longer used
+        self.session.add(Score(key=ScoreKey.location, userid=userids[1],
+                               time=self.today, value=50))
+        self.session.flush()
+
+        self.assertEqual(leaders(self.session, self.redis_client), [
+            {'nickname': u'nick-2', 'num': 30},
+            {'nickname': u'nick-0', 'num': 12},
+            {'nickname': u'anonymous', 'num': 11},
+        ])
+
+    def test_leaders_weekly(self):
+        userids = [user.id for user in self.users]
+        yesterday = self.today - timedelta(days=1)
+        self.leaderboard.replace({}, {
+            (ScoreKey.new_cell, self.today): {userids[0]: 2, userids[1]: 1},
+            (ScoreKey.new_cell, yesterday): {userids[1]: 3},
+        })
+
+        result = leaders_weekly(self.session, self.redis_client, batch=5)
+        self.assertEqual(result, {
+            'new_cell': [{'nickname': u'nick-1', 'num': 4},
+                         {'nickname': u'nick-0', 'num': 2}],
+            'new_wifi': [],
+        })
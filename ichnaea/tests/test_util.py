@@ -1,4 +1,5 @@
 from datetime import datetime
+from io import BytesIO
 
 from pytz import UTC
 
@@ -33,3 +34,22 @@ class TestUtil(TestCase):
     def test_roundtrip_gzip(self):
         data = util.decode_gzip(util.encode_gzip(b'foo'))
         self.assertEqual(data, u'foo')
+
+    def test_decode_gzip_malformed(self):
+        with self.assertRaises(OSError):
+            util.decode_gzip(b'invalid')
+        with self.assertRaises(OSError):
+            util.decode_gzip(self.gzip_foo[:-6])
+
+    def test_gunzip_max_size(self):
+        data = util.encode_gzip(b'a' * 100000)
+        self.assertEqual(len(util.gunzip(BytesIO(data), max_size=100000)),
+                         100000)
+        with self.assertRaises(util.SizeLimitError):
+            util.gunzip(BytesIO(data), max_size=99999)
+
+    def test_read_limited(self):
+        data = BytesIO(b'a' * 10)
+        self.assertEqual(util.read_limited(data, chunk_size=3), b'a' * 10)
+        with self.assertRaises(util.SizeLimitError):
+            util.read_limited(BytesIO(b'a' * 10), max_size=9, chunk_size=3)
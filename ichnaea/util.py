@@ -6,6 +6,7 @@ from io import BytesIO
 import shutil
 import sys
 import tempfile
+import zlib
 
 from pytz import UTC
 import six
@@ -69,19 +70,53 @@ def encode_gzip(data, compresslevel=6, encoding='utf-8'):
     return out.getvalue()
 
 
-def decode_gzip(data, encoding='utf-8'):
-    """Decode the bytes data and return a Unicode string.
+class SizeLimitError(ValueError):
+    """Raised if data exceeds its maximum allowed size."""
+
+
+def read_limited(fileobj, max_size=None, chunk_size=65536):
+    """
+    Read all data from the file object in chunks and return it as bytes.
+
+    :raises: :exc:`SizeLimitError` as soon as more than `max_size`
+             bytes have been read.
+    """
+    out = BytesIO()
+    total = 0
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_size is not None and total > max_size:
+            raise SizeLimitError('Data exceeds %s bytes.' % max_size)
+        out.write(chunk)
+    return out.getvalue()
 
-    :raises: OSError
+
+def gunzip(fileobj, max_size=None):
+    """
+    Incrementally decompress the gzip data read from the file object
+    and return the decompressed bytes.
+
+    :raises: OSError, :exc:`SizeLimitError` as soon as the decompressed
+             data exceeds `max_size` bytes.
     """
     try:
-        with GzipFile(None, mode='rb', fileobj=BytesIO(data)) as gzip_file:
-            out = gzip_file.read()
-        return out.decode(encoding)
-    except (IOError, OSError) as exc:
+        with GzipFile(None, mode='rb', fileobj=fileobj) as gzip_file:
+            return read_limited(gzip_file, max_size=max_size)
+    except (EOFError, IOError, OSError, zlib.error) as exc:
         raise OSError(str(exc))
 
 
+def decode_gzip(data, encoding='utf-8', max_size=None):
+    """Decode the bytes data and return a Unicode string.
+
+    :raises: OSError, :exc:`SizeLimitError`
+    """
+    return gunzip(BytesIO(data), max_size=max_size).decode(encoding)
+
+
 @contextmanager
 def selfdestruct_tempdir():
     base_path = tempfile.mkdtemp()
@@ -3,7 +3,10 @@ Holds global web application state and the WSGI handler.
 """
 
 from ichnaea.config import read_config
-from ichnaea.webapp.config import main
+from ichnaea.webapp.config import (
+    main,
+    shutdown_worker,
+)
 
 _APP = None  #: Internal module global holding the runtime web app.
 
@@ -30,3 +33,15 @@ def wsgi_app(environ, start_response):  # pragma: no cover
             return _APP
 
     return _APP(environ, start_response)
+
+
+def worker_exit(server, worker):  # pragma: no cover
+    """
+    Called as part of gunicorn's worker_exit, calls
+    :func:`ichnaea.webapp.config.shutdown_worker`.
+    """
+    global _APP
+
+    if _APP is not None:
+        shutdown_worker(_APP)
+        _APP = None
@@ -6,10 +6,13 @@ from pyramid.config import Configurator
 from pyramid.tweens import EXCVIEW
 
 from ichnaea.api.config import configure_api
+from ichnaea.api.locate.querylog import configure_query_log
 from ichnaea.api.locate.searcher import (
     configure_position_searcher,
     configure_region_searcher,
 )
+from ichnaea.api.timing import configure_profiler
+from ichnaea.async.config import configure_export
 from ichnaea.cache import configure_redis
 from ichnaea.content.views import configure_content
 from ichnaea.db import (
@@ -88,8 +91,16 @@ def main(app_config, ping_connections=False,
     registry.stats_client = stats_client = configure_stats(
         app_config, _client=_stats_client)
 
+    registry.export_queues = configure_export(redis_client, app_config)
+
     registry.http_session = configure_http_session(_session=_http_session)
 
+    registry.profiler = configure_profiler(
+        app_config, raven_client=raven_client)
+
+    registry.query_log = configure_query_log(
+        app_config, raven_client=raven_client)
+
     registry.geoip_db = geoip_db = configure_geoip(
         app_config.get('geoip', 'db_path'), raven_client=raven_client,
         _client=_geoip_db)
@@ -125,3 +136,12 @@ def main(app_config, ping_connections=False,
         registry.redis_client.ping()
 
     return config.make_wsgi_app()
+
+
+def shutdown_worker(app):
+    """
+    Write out all queued query log records of the web app.
+
+    This is executed inside each gunicorn worker process on exit.
+    """
+    app.registry.query_log.close()
@@ -64,3 +64,9 @@ del _statsd_config
 def post_worker_init(worker):
     # Actually initialize the application
     worker.wsgi(None, None)
+
+
+def worker_exit(server, worker):
+    # Write out the queued query log records
+    from ichnaea.webapp.app import worker_exit
+    worker_exit(server, worker)
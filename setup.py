@@ -56,9 +56,12 @@ setup(
     zip_safe=False,
     entry_points={
         'console_scripts': [
+            'location_benchmark=ichnaea.scripts.benchmark:console_entry',
+            'location_evaluate=ichnaea.scripts.evaluate:console_entry',
             'location_initdb=ichnaea.scripts.initdb:console_entry',
             'location_load=ichnaea.scripts.load:console_entry',
             'location_map=ichnaea.scripts.datamap:console_entry',
+            'location_microbench=ichnaea.scripts.microbench:console_entry',
         ],
     },
 )